@@ -1,30 +1,49 @@
 # backend flask
 import os
 import time
+IMPORT_STARTED = time.perf_counter()
+import atexit
 import uuid
 import base64
-import random
+import json
+import struct
 import decimal
 import threading
 import numpy as np
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
-from threading import Lock
+from concurrent.futures import TimeoutError
 from functools import wraps
+from contextlib import contextmanager
 
 # computer vision yolo
 import cv2
-from ultralytics import YOLO
 
 # db & sys
 import psycopg2
 import psycopg2.extras
-from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
+from dbpool import ConnectionPool
+from batcher import InferenceBatcher, QueueFull, Superseded, Expired
+from framegate import FrameChangeGate
+from tracker import KeyframeTracker
+import roi
+from schema import ensure_schema
+import rollup
+from catalog import ProductCatalog, notify_changed
+import imagevariants
+from scale import ScaleReader
+from statusstream import StatusHub
+import sharedstate
+from clientstate import ClientStateStore
+from authcache import TokenCache, UserCache
+from backends import load_backend, BackgroundLoader
+import metrics
+import detection
+from procpool import ProcessInferenceEngine, WorkerUnavailable
 
 # web
-from flask import Flask, render_template, Response, jsonify, request, send_from_directory
+from flask import Flask, render_template, Response, jsonify, request, send_from_directory, stream_with_context, g, has_request_context
 from flask_cors import CORS
 
 # jwt
@@ -41,63 +60,257 @@ DB_CONFIG = {
     "password": os.environ.get("DB_PASS", "gajahbengkak"),
     "dbname": os.environ.get("DB_NAME", "timbangandigitalai")
 }
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 2))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "super-secret-dev-key")  # change in production
 JWT_ALGO = "HS256"
 JWT_EXP_HOURS = int(os.environ.get("JWT_EXP_HOURS", 4))
+# token terverifikasi di-cache sampai exp-nya; baris users di-cache singkat untuk /auth/me
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+USER_CACHE_TTL_S = float(os.environ.get("USER_CACHE_TTL_S", 30))
 
 SIMULATE_SCALE = os.environ.get("SIMULATE_SCALE", "1") == "1"
 SERIAL_PORT = os.environ.get("SERIAL_PORT", "COM3")
 BAUD_RATE = int(os.environ.get("BAUD_RATE", 9600))
+# berat dianggap stabil bila fluktuasi <= SCALE_STABLE_TOLERANCE (kg) selama SCALE_STABLE_WINDOW_MS
+SCALE_BUFFER_SIZE = int(os.environ.get("SCALE_BUFFER_SIZE", 256))
+SCALE_STABLE_WINDOW_MS = int(os.environ.get("SCALE_STABLE_WINDOW_MS", 500))
+SCALE_STABLE_TOLERANCE = float(os.environ.get("SCALE_STABLE_TOLERANCE", 0.005))
+
+# push status (SSE) per client_id di port terpisah, lihat statusstream.py
+STATUS_STREAM_ENABLED = os.environ.get("STATUS_STREAM_ENABLED", "1") == "1"
+STATUS_STREAM_PORT = int(os.environ.get("STATUS_STREAM_PORT", 4001))
+STATUS_STREAM_COALESCE_MS = int(os.environ.get("STATUS_STREAM_COALESCE_MS", 100))
+STATUS_STREAM_HEARTBEAT_S = float(os.environ.get("STATUS_STREAM_HEARTBEAT_S", 15))
+
+# mode multi-worker (gunicorn -c gunicorn.conf.py "app:create_app()"): timbangan, latest_detection,
+# client_last_ts dan SSE dipegang satu proses owner, worker mengaksesnya lewat sharedstate.py
+MULTIWORKER = sharedstate.multiworker_enabled()
+
+# backend inferensi: pytorch | torchscript | onnx | openvino (lihat backends.py)
+# imgsz/threads per backend: INFER_IMGSZ[_<BACKEND>], INFER_THREADS[_<BACKEND>]
+INFER_BACKEND = os.environ.get("INFER_BACKEND", "pytorch").lower()
+# model dimuat + warm-up di thread background; MODEL_WAIT_ON_START=1 -> app.run menunggu model siap
+MODEL_WAIT_ON_START = os.environ.get("MODEL_WAIT_ON_START", "0") == "1"
+CAMERA_INDEX = int(os.environ.get("CAMERA_INDEX", 0))
+
+# micro-batching inferensi lintas client
+INFER_MAX_BATCH = int(os.environ.get("INFER_MAX_BATCH", 8))
+INFER_MAX_WAIT_MS = float(os.environ.get("INFER_MAX_WAIT_MS", 10))
+# admission control: antrian dibatasi (503 + Retry-After bila penuh), frame lama per client
+# dibuang saat frame baru datang, frame yang lewat INFER_TIMEOUT_S tidak dijalankan
+INFER_MAX_QUEUE = int(os.environ.get("INFER_MAX_QUEUE", 32))
+INFER_DROP_SUPERSEDED = os.environ.get("INFER_DROP_SUPERSEDED", "1") == "1"
+INFER_TIMEOUT_S = float(os.environ.get("INFER_TIMEOUT_S", 12))
+# INFER_WORKERS > 0 -> inferensi + plot + encode di proses worker terpisah (lihat procpool.py),
+# frame & JPEG lewat shared memory berukuran INFER_WORKER_FRAME_MB / INFER_WORKER_OUT_MB per slot
+INFER_WORKERS = int(os.environ.get("INFER_WORKERS", 0))
+INFER_WORKER_FRAME_MB = float(os.environ.get("INFER_WORKER_FRAME_MB", 8))
+INFER_WORKER_OUT_MB = float(os.environ.get("INFER_WORKER_OUT_MB", 2))
+
+# ROI tray per kiosk/client (ROI_CONFIG_FILE, lihat roi.RoiConfig) + ROI_DEFAULT "x1,y1,x2,y2"
+# (pecahan 0-1 atau piksel). INFER_MAX_SIDE > 0 -> crop diperkecil ke sisi terpanjang ini.
+# INFER_LATENCY_BUDGET_MS > 0 -> mode adaptif: sisi inferensi turun/naik di antara INFER_SIZES
+# mengikuti latensi antri + inferensi terbaru
+ROI_CONFIG_FILE = os.environ.get("ROI_CONFIG_FILE", "roi_config.json")
+ROI_DEFAULT = os.environ.get("ROI_DEFAULT", "")
+INFER_MAX_SIDE = int(os.environ.get("INFER_MAX_SIDE", 0))
+INFER_LATENCY_BUDGET_MS = float(os.environ.get("INFER_LATENCY_BUDGET_MS", 0))
+INFER_SIZES = [int(v) for v in os.environ.get("INFER_SIZES", "640,512,416,320").split(",") if v.strip()]
+
+# tracking antar frame (tracker.py): YOLO penuh tiap TRACK_KEYFRAME_INTERVAL frame atau bila conf
+# track < TRACK_MIN_CONF, di antaranya box digeser optical flow. Per client lewat field/query
+# `track`; TRACK_DEFAULT=1 -> aktif untuk client yang tidak menyebutkan
+TRACK_DEFAULT = os.environ.get("TRACK_DEFAULT", "0") == "1"
+TRACK_KEYFRAME_INTERVAL = int(os.environ.get("TRACK_KEYFRAME_INTERVAL", 8))
+TRACK_MIN_CONF = float(os.environ.get("TRACK_MIN_CONF", 0.5))
+TRACK_MAX_AGE_S = float(os.environ.get("TRACK_MAX_AGE_S", 1.0))
+
+# anotasi gambar hasil deteksi: DETECT_ANNOTATE=0 -> default hanya kirim boxes (tanpa plot/encode)
+DETECT_ANNOTATE = os.environ.get("DETECT_ANNOTATE", "1") == "1"
+ANNOTATED_JPEG_QUALITY = int(os.environ.get("ANNOTATED_JPEG_QUALITY", 80))
+ANNOTATED_MAX_SIDE = int(os.environ.get("ANNOTATED_MAX_SIDE", 0))  # 0 = ukuran asli
+
+# lewati inferensi bila frame client tidak berubah (selisih rata-rata piksel 0-255)
+FRAME_GATE_ENABLED = os.environ.get("FRAME_GATE_ENABLED", "1") == "1"
+FRAME_GATE_THRESHOLD = float(os.environ.get("FRAME_GATE_THRESHOLD", 4.0))
+FRAME_GATE_MAX_STALE_S = float(os.environ.get("FRAME_GATE_MAX_STALE_S", 2.0))
+
+# /api/riwayat: batas baris per halaman & ukuran fetch cursor streaming
+RIWAYAT_MAX_LIMIT = int(os.environ.get("RIWAYAT_MAX_LIMIT", 1000))
+RIWAYAT_STREAM_ITERSIZE = int(os.environ.get("RIWAYAT_STREAM_ITERSIZE", 500))
+
+# /api/checkout: deteksi terakhir client dipakai bila tidak lebih tua dari ini (0 = tanpa batas);
+# CHECKOUT_REQUIRE_STABLE=1 -> tolak (409) selama timbangan belum stabil
+CHECKOUT_MAX_DETECTION_AGE_S = float(os.environ.get("CHECKOUT_MAX_DETECTION_AGE_S", 5))
+CHECKOUT_REQUIRE_STABLE = os.environ.get("CHECKOUT_REQUIRE_STABLE", "1") == "1"
+
+# /api/transaksi/sync: maks transaksi per batch dari antrian offline kiosk
+SYNC_MAX_ITEMS = int(os.environ.get("SYNC_MAX_ITEMS", 500))
+
+# LISTEN/NOTIFY agar cache katalog produk di worker lain ikut diperbarui
+CATALOG_LISTEN = os.environ.get("CATALOG_LISTEN", "1") == "1"
 
 UPLOAD_FOLDER = os.path.join(os.getcwd(), "static", "assets", "img")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
+# gambar produk & variannya tidak pernah ditimpa (nama unik) -> boleh di-cache lama
+IMAGE_MAX_AGE = int(os.environ.get("IMAGE_MAX_AGE", 31536000))
+
+# Server-Timing per request: always | optin (header X-Server-Timing: 1 atau ?timing=1) | off
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "optin").lower()
 
 # app
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
+     expose_headers=["X-Detection", "X-Client-Id", "X-Labels", "Server-Timing", "X-Next-Interval-Ms", "Retry-After"])
+
+# -----------------------------
+# METRICS (Prometheus di /metrics)
+# -----------------------------
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "aiscale_http_request_seconds", "Durasi request per endpoint", ["endpoint", "method"])
+HTTP_REQUESTS_TOTAL = metrics.Counter(
+    "aiscale_http_requests_total", "Jumlah request per endpoint dan status", ["endpoint", "method", "status"])
+STAGE_SECONDS = metrics.Histogram(
+    "aiscale_detect_stage_seconds",
+    "Durasi tiap tahap deteksi (b64decode, imdecode, frame_gate, queue_wait, inference, plot, imencode, b64encode)",
+    ["stage"])
+DB_SECONDS = metrics.Histogram(
+    "aiscale_db_seconds", "Waktu tunggu koneksi pool (db_wait) dan lama koneksi dipakai (db) per route",
+    ["route", "phase"])
+DETECT_FRAMES_TOTAL = metrics.Counter(
+    "aiscale_detect_frames_total", "Frame yang diproses, per sumber hasil (model / frame_gate)", ["source"])
+stage = metrics.StageTimer(STAGE_SECONDS)
+db_timer = metrics.StageTimer(DB_SECONDS, label="phase")
+
+@app.before_request
+def metrics_begin_request():
+    g.request_started = time.perf_counter()
+    if SERVER_TIMING == "always" or (
+            SERVER_TIMING == "optin" and (request.headers.get("X-Server-Timing") or request.args.get("timing"))):
+        metrics.begin_timings()
+
+@app.after_request
+def metrics_end_request(resp):
+    started = g.pop("request_started", None)
+    if started is None:
+        return resp
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or "unknown"
+    HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method)
+    HTTP_REQUESTS_TOTAL.inc(endpoint=endpoint, method=request.method, status=str(resp.status_code))
+    timings = metrics.end_timings()
+    if timings is not None:
+        resp.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+        resp.headers["Timing-Allow-Origin"] = "*"
+    return resp
+
+@app.teardown_request
+def metrics_teardown_request(exc):
+    # thread worker dipakai ulang: jangan sampai timing request ini terbawa ke request berikutnya
+    metrics.end_timings()
 
 # -----------------------------
 # UTIL
 # -----------------------------
-def get_db():
-    return psycopg2.connect(**DB_CONFIG)
+DB_POOL = ConnectionPool(DB_CONFIG, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT)
+atexit.register(DB_POOL.closeall)
+
+CATALOG = ProductCatalog(DB_POOL)
+
+def cached_json(body, etag):
+    # 304 bila If-None-Match cocok; client wajib revalidasi (no-cache) tapi tidak unduh ulang
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+@contextmanager
+def get_db(autocommit=False):
+    # pakai: `with get_db() as db:` -> koneksi dikembalikan ke pool otomatis
+    # waktu tunggu pool (db_wait) dan lama koneksi dipakai (db) dicatat per route
+    # autocommit=True untuk route satu statement (CTE sudah atomik -> tanpa round trip COMMIT
+    # terpisah); flag dikembalikan sebelum koneksi masuk pool lagi
+    route = (request.endpoint or "unknown") if has_request_context() else "background"
+    t0 = time.perf_counter()
+    with DB_POOL.connection() as db:
+        t1 = time.perf_counter()
+        db_timer.record("db_wait", t1 - t0, route=route)
+        if autocommit:
+            db.autocommit = True
+        try:
+            yield db
+        finally:
+            if autocommit and not db.closed:
+                db.autocommit = False
+            db_timer.record("db", time.perf_counter() - t1, route=route)
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def as_number(x):
-    try:
-        return float(x.cpu().numpy())
-    except Exception:
-        try:
-            return float(x)
-        except Exception:
-            return 0.0
+def parse_bool(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
 
 # -----------------------------
 # YOLO dataset (model yolo)
 # -----------------------------
-try:
-    model = YOLO("models/best.pt")
-except Exception as e:
-    print("⚠️ Peringatan: gagal load model YOLO:", e)
-    model = None
-
-cap = cv2.VideoCapture(0)
+def warmup_model(backend):
+    # frame dummy lewat jalur yang sama dengan request (predict + plot + encode),
+    # supaya alokasi/JIT/font tidak dibayar oleh /api/detect_frame pertama
+    dummy = np.zeros((backend.imgsz, backend.imgsz, 3), dtype=np.uint8)
+    summarize_result(dummy, backend.predict([dummy])[0], annotate=True, names=backend.names)
+    print(f"✅ Backend inferensi: {backend.name} ({backend.weights}, imgsz={backend.imgsz}) siap")
+
+PROCESS_ENGINE = None
+if INFER_WORKERS > 0:
+    # model hanya dimuat di worker (warm-up juga di sana); MODEL menunggu worker pertama siap
+    PROCESS_ENGINE = ProcessInferenceEngine(
+        workers=INFER_WORKERS, backend=INFER_BACKEND, conf=0.6,
+        slots=-(-INFER_MAX_BATCH // INFER_WORKERS),
+        frame_bytes=int(INFER_WORKER_FRAME_MB * 1024 * 1024), out_bytes=int(INFER_WORKER_OUT_MB * 1024 * 1024),
+        jpeg_quality=ANNOTATED_JPEG_QUALITY, max_side=ANNOTATED_MAX_SIDE,
+    )
+    atexit.register(PROCESS_ENGINE.stop)
+    MODEL = BackgroundLoader(PROCESS_ENGINE.start)
+else:
+    MODEL = BackgroundLoader(lambda: load_backend(INFER_BACKEND, conf=0.6), warmup_fn=warmup_model)
+
+# kamera hanya dibuka bila benar-benar dipakai (stream MJPEG di bawah dinonaktifkan)
+_camera = None
+_camera_lock = threading.Lock()
+
+def get_camera():
+    global _camera
+    with _camera_lock:
+        if _camera is None:
+            _camera = cv2.VideoCapture(CAMERA_INDEX)
+        return _camera
 
 # global vars
-latest_weight = 0.0
-# changed: latest_detection is now a dict storing status per client_id
+# changed: latest_detection is now a bounded TTL store (clientstate.py) storing status per client_id
 # structure: latest_detection[client_id] = {"detection": str, "weight": float, "ts": timestamp_iso}
-latest_detection = {}
-scale_connection = None
-
-# worker pool for frames
-WORKER_POOL = ThreadPoolExecutor(max_workers=4)
-client_last_ts = {}
-client_lock = Lock()
+CLIENT_STATE_TTL_S = float(os.environ.get("CLIENT_STATE_TTL_S", 600))
+CLIENT_STATE_MAX = int(os.environ.get("CLIENT_STATE_MAX", 10000))
+CLIENT_STATE_SHARDS = int(os.environ.get("CLIENT_STATE_SHARDS", 16))
+
+if MULTIWORKER:
+    # satu salinan untuk semua worker, disimpan di proses owner
+    STATE_CLIENT = sharedstate.StateClient()
+    latest_detection = sharedstate.RemoteStateStore(STATE_CLIENT, "latest_detection")
+    client_last_ts = sharedstate.RemoteStateStore(STATE_CLIENT, "client_last_ts")
+else:
+    STATE_CLIENT = None
+    latest_detection = ClientStateStore(CLIENT_STATE_TTL_S, CLIENT_STATE_MAX, CLIENT_STATE_SHARDS, name="latest_detection")
+
+    # waktu request terakhir per client untuk batas MIN_INTERVAL_S (cukup disimpan sebentar)
+    client_last_ts = ClientStateStore(60, CLIENT_STATE_MAX, CLIENT_STATE_SHARDS, name="client_last_ts")
 MIN_INTERVAL_S = 0.06
 
 # -----------------------------
@@ -124,6 +337,15 @@ def decode_token(token: str):
     except Exception as e:
         raise
 
+TOKEN_CACHE = TokenCache(decode_token, max_entries=TOKEN_CACHE_SIZE)
+USER_CACHE = UserCache(ttl_s=USER_CACHE_TTL_S)
+
+def verify_token(token: str):
+    # dipakai semua endpoint (JSON, raw/biner, SSE): frame ke-2 dst. dari token yang sama tidak di-decode ulang
+    if not token:
+        raise jwt.InvalidTokenError("token missing")
+    return TOKEN_CACHE.decode(token)
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -131,7 +353,8 @@ def token_required(f):
 
         # 1. Ambil dari header
         if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(" ")[1]
+            parts = request.headers['Authorization'].split(" ", 1)
+            token = parts[1].strip() if len(parts) == 2 else None
 
         # 2. Ambil dari querystring
         if not token:
@@ -141,9 +364,9 @@ def token_required(f):
             return jsonify({'message': 'Token missing!'}), 401
 
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            data = verify_token(token)
             current_email = data['email']
-        except:
+        except Exception:
             return jsonify({'message': 'Token invalid!'}), 401
 
         return f(current_email, *args, **kwargs)
@@ -151,30 +374,22 @@ def token_required(f):
 
 
 # -----------------------------
-# Timbangan (simulasi/dummy)
+# Timbangan (serial / simulasi) - lihat scale.py
 # -----------------------------
-def read_scale_data():
-    global latest_weight, scale_connection
-    if SIMULATE_SCALE:
-        while True:
-            latest_weight = round(random.uniform(0.1, 2.5), 3)
-            time.sleep(1)
-    else:
-        try:
-            import serial
-            scale_connection = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-            print(f"✅ Berhasil terhubung ke timbangan di port {SERIAL_PORT}")
-            while True:
-                line = scale_connection.readline().decode('utf-8').strip()
-                if line:
-                    try:
-                        latest_weight = float(line.split()[0])
-                    except Exception:
-                        print("⚠️ Format data dari timbangan tidak valid:", line)
-                time.sleep(0.5)
-        except Exception as e:
-            print("❌ Gagal terhubung ke timbangan:", e)
-            latest_weight = -1.0
+SCALE_CONFIG = {
+    "port": SERIAL_PORT,
+    "baud_rate": BAUD_RATE,
+    "simulate": SIMULATE_SCALE,
+    "buffer_size": SCALE_BUFFER_SIZE,
+    "stable_window_ms": SCALE_STABLE_WINDOW_MS,
+    "stable_tolerance": SCALE_STABLE_TOLERANCE,
+}
+# multi-worker: port serial hanya dibuka proses owner, worker membaca berat dari shared memory
+SCALE = sharedstate.RemoteScale(STATE_CLIENT) if MULTIWORKER else ScaleReader(**SCALE_CONFIG)
+
+@app.route("/api/scale", methods=["GET"])
+def api_scale():
+    return jsonify(SCALE.stats())
 
 # -----------------------------
 # AUTH routes: signup / login / me
@@ -194,21 +409,22 @@ def auth_signup():
     if not email or not password:
         return jsonify({"error": "Silahkan masukkan email dan kata sandi Anda"}), 400
 
-    db = get_db()
-    cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT id FROM users WHERE email = %s", (email,))
-    if cur.fetchone():
-        cur.close(); db.close()
-        return jsonify({"error": "Email sudah terdaftar, silahkan gunakan akun lain atau login dengan akun yang sudah ada"}), 400
-
-    pw_hash = generate_password_hash(password)
-    cur.execute(
-        "INSERT INTO users (first_name, last_name, email, password_hash) VALUES (%s, %s, %s, %s) RETURNING id;",
-        (first, last, email, pw_hash)
-    )
-    user = cur.fetchone()
-    db.commit()
-    cur.close(); db.close()
+    with get_db() as db:
+        cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT id FROM users WHERE email = %s", (email,))
+        if cur.fetchone():
+            cur.close()
+            return jsonify({"error": "Email sudah terdaftar, silahkan gunakan akun lain atau login dengan akun yang sudah ada"}), 400
+
+        pw_hash = generate_password_hash(password)
+        cur.execute(
+            "INSERT INTO users (first_name, last_name, email, password_hash) VALUES (%s, %s, %s, %s) RETURNING id;",
+            (first, last, email, pw_hash)
+        )
+        user = cur.fetchone()
+        db.commit()
+        cur.close()
+    USER_CACHE.invalidate(email)
     return jsonify({"message": "registered", "id": user["id"]}), 201
 
 @app.route("/auth/login", methods=["POST"])
@@ -223,11 +439,11 @@ def auth_login():
     if not email or not password:
         return jsonify({"error": "Silahkan masukkan email dan kata sandi Anda"}), 400
 
-    db = get_db()
-    cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT id, email, password_hash FROM users WHERE email = %s", (email,))
-    user = cur.fetchone()
-    cur.close(); db.close()
+    with get_db() as db:
+        cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT id, email, password_hash FROM users WHERE email = %s", (email,))
+        user = cur.fetchone()
+        cur.close()
     if not user or not check_password_hash(user["password_hash"], password):
         return jsonify({"error": "user atau password salah"}), 401
 
@@ -237,13 +453,16 @@ def auth_login():
 @app.route("/auth/me", methods=["GET"])
 @token_required
 def auth_me(current_email):
-    db = get_db()
-    cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT id, first_name, last_name, email, role, created_at FROM users WHERE email = %s", (current_email,))
-    u = cur.fetchone()
-    cur.close(); db.close()
-    if not u:
-        return jsonify({"error": "not_found"}), 404
+    u = USER_CACHE.get(current_email)
+    if u is None:
+        with get_db() as db:
+            cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SELECT id, first_name, last_name, email, role, created_at FROM users WHERE email = %s", (current_email,))
+            u = cur.fetchone()
+            cur.close()
+        if not u:
+            return jsonify({"error": "not_found"}), 404
+        USER_CACHE.set(current_email, u)
     # convert decimals/datetimes if present
     return jsonify(u)
 
@@ -264,28 +483,37 @@ def index():
 def api_status():
     """
     Expecting JSON: { "client_id": "<uuid>" }
-    Returns: {"detection": "...", "weight": 0.123, "ts": "..."}
+    Returns: {"detection": "...", "weight": 0.123, "stable": true, "ts": "..."}
+    weight selalu berat stabil terakhir dari timbangan (bukan nilai saat deteksi).
     If client_id missing, fallback to "server" latest (eg. video feed) or return default.
     """
-    global latest_detection, latest_weight
     data = request.get_json(silent=True) or {}
-    client_id = data.get("client_id")
-
-    if client_id:
-        status = latest_detection.get(client_id, {
-            "detection": "-",
-            "weight": latest_weight,
-            "ts": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
-        })
-    else:
-        # fallback: try server-side video feed key
-        status = latest_detection.get("server", {
-            "detection": "-",
-            "weight": latest_weight,
-            "ts": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
-        })
+    return jsonify(client_status(data.get("client_id")))
+
+def client_status(client_id):
+    return sharedstate.client_status(latest_detection, SCALE.reading(), client_id)
+
+def scale_weight_state():
+    reading = SCALE.reading()
+    return reading.stable_weight, reading.stable
+
+# SSE: kirim hanya saat label deteksi / berat stabil berubah; /api/status tetap sebagai fallback
+# multi-worker: satu server SSE di proses owner (publish otomatis saat latest_detection di-set)
+if MULTIWORKER:
+    STATUS_HUB = sharedstate.RemoteStatusHub(STATE_CLIENT)
+else:
+    STATUS_HUB = StatusHub(
+        client_status,
+        scale_weight_state,
+        verify_token,
+        port=STATUS_STREAM_PORT,
+        coalesce_ms=STATUS_STREAM_COALESCE_MS,
+        heartbeat_s=STATUS_STREAM_HEARTBEAT_S,
+    )
 
-    return jsonify(status)
+@app.route("/api/status/stream/info", methods=["GET"])
+def api_status_stream_info():
+    return jsonify(STATUS_HUB.stats())
 
 
 # -----------------------------
@@ -307,7 +535,7 @@ def api_status():
 #                    b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 #     else:
 #         while True:
-#             success, frame = cap.read()
+#             success, frame = get_camera().read()
 #             if not success:
 #                 break
 #             results = model(frame, conf=0.6, verbose=False)
@@ -315,7 +543,7 @@ def api_status():
 #             try:
 #                 if len(results[0].boxes) > 0:
 #                     top_detection = results[0].boxes[0]
-#                     cls_idx = int(as_number(top_detection.cls)) if hasattr(top_detection, "cls") else 0
+#                     cls_idx = int(detection.as_number(top_detection.cls)) if hasattr(top_detection, "cls") else 0
 #                     label = model.names[cls_idx] if hasattr(model, "names") else str(cls_idx)
 #                     # store server-side detection under a special key
 #                     latest_detection["server"] = {
@@ -357,31 +585,19 @@ def api_status():
 @app.route("/api/produk", methods=["GET"])
 def api_get_produk():
     try:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT kode_produk, nama_produk, harga_per_kg, path_gambar FROM produk ORDER BY kode_produk ASC;")
-        produk = cursor.fetchall()
-        cursor.close(); db.close()
-        for p in produk:
-            if "harga_per_kg" in p and isinstance(p["harga_per_kg"], decimal.Decimal):
-                p["harga_per_kg"] = float(p["harga_per_kg"])
-        return jsonify(produk)
+        body, etag = CATALOG.get_all()
+        return cached_json(body, etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/produk/<int:kode_produk>", methods=["GET"])
 def api_get_produk_single(kode_produk):
     try:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT kode_produk, nama_produk, harga_per_kg, path_gambar FROM produk WHERE kode_produk = %s;", (kode_produk,))
-        produk = cursor.fetchone()
-        cursor.close(); db.close()
-        if not produk:
+        cached = CATALOG.get_one(kode_produk)
+        if not cached:
             return jsonify({"error": "Produk tidak ditemukan"}), 404
-        if "harga_per_kg" in produk and isinstance(produk["harga_per_kg"], decimal.Decimal):
-            produk["harga_per_kg"] = float(produk["harga_per_kg"])
-        return jsonify(produk)
+        body, etag = cached
+        return cached_json(body, etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -416,26 +632,23 @@ def api_create_produk(current_email):
         path_gambar = None
         if file and file.filename != "":
             if allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-                filename = f"{name}_{timestamp}{ext}"
-                save_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(save_path)
+                filename = imagevariants.save_upload(file, UPLOAD_FOLDER)
                 path_gambar = f"/static/assets/img/{filename}"
             else:
                 return jsonify({"error": "Format file tidak diizinkan"}), 400
 
         # --- INSERT DB (harga_value) ---
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(
-            "INSERT INTO produk (nama_produk, harga_per_kg, path_gambar) VALUES (%s, %s, %s) RETURNING kode_produk, nama_produk, harga_per_kg, path_gambar;",
-            (nama, harga_value, path_gambar)
-        )
-        new_prod = cursor.fetchone()
-        db.commit()
-        cursor.close(); db.close()
+        with get_db() as db:
+            cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(
+                "INSERT INTO produk (nama_produk, harga_per_kg, path_gambar) VALUES (%s, %s, %s) RETURNING kode_produk, nama_produk, harga_per_kg, path_gambar;",
+                (nama, harga_value, path_gambar)
+            )
+            new_prod = cursor.fetchone()
+            notify_changed(cursor, new_prod["kode_produk"], CATALOG.token)
+            db.commit()
+            cursor.close()
+        CATALOG.refresh(new_prod["kode_produk"])
 
         if new_prod and "harga_per_kg" in new_prod and isinstance(new_prod["harga_per_kg"], decimal.Decimal):
             new_prod["harga_per_kg"] = float(new_prod["harga_per_kg"])
@@ -470,12 +683,7 @@ def api_update_produk(current_email, kode_produk):
             updates.append("harga_per_kg = %s"); values.append(harga)
         if file and file.filename != "":
             if allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-                filename = f"{name}_{timestamp}{ext}"
-                save_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(save_path)
+                filename = imagevariants.save_upload(file, UPLOAD_FOLDER)
                 relative = f"/static/assets/img/{filename}"
                 updates.append("path_gambar = %s")
                 values.append(relative)
@@ -484,12 +692,16 @@ def api_update_produk(current_email, kode_produk):
 
         values.append(kode_produk)
         sql = f"UPDATE produk SET {', '.join(updates)} WHERE kode_produk = %s RETURNING kode_produk, nama_produk, harga_per_kg, path_gambar;"
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(sql, tuple(values))
-        updated = cursor.fetchone()
-        db.commit()
-        cursor.close(); db.close()
+        with get_db() as db:
+            cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(sql, tuple(values))
+            updated = cursor.fetchone()
+            if updated:
+                notify_changed(cursor, kode_produk, CATALOG.token)
+            db.commit()
+            cursor.close()
+        if updated:
+            CATALOG.refresh(kode_produk)
         if not updated:
             return jsonify({"error": "Produk tidak ditemukan"}), 404
         if "harga_per_kg" in updated and isinstance(updated["harga_per_kg"], decimal.Decimal):
@@ -502,12 +714,16 @@ def api_update_produk(current_email, kode_produk):
 @token_required
 def api_delete_produk(current_email, kode_produk):
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("DELETE FROM produk WHERE kode_produk = %s RETURNING kode_produk;", (kode_produk,))
-        deleted = cursor.fetchone()
-        db.commit()
-        cursor.close(); db.close()
+        with get_db() as db:
+            cursor = db.cursor()
+            cursor.execute("DELETE FROM produk WHERE kode_produk = %s RETURNING kode_produk;", (kode_produk,))
+            deleted = cursor.fetchone()
+            if deleted:
+                notify_changed(cursor, kode_produk, CATALOG.token)
+            db.commit()
+            cursor.close()
+        if deleted:
+            CATALOG.refresh(kode_produk)
         if not deleted:
             return jsonify({"error": "Produk tidak ditemukan"}), 404
         return jsonify({"message": f"Produk {kode_produk} berhasil dihapus"})
@@ -516,7 +732,30 @@ def api_delete_produk(current_email, kode_produk):
 
 @app.route("/static/assets/img/<path:filename>")
 def serve_image(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    ?size=thumb|card|full -> varian ter-resize (WebP bila browser menerima image/webp, selain itu JPEG)
+    tanpa size -> file asli
+    Cache-Control immutable hanya untuk varian dan nama berbasis hash (imagevariants.is_immutable).
+    """
+    size = request.args.get("size")
+    vary_accept = False
+    if size:
+        if size not in imagevariants.VARIANT_SIZES:
+            return jsonify({"error": "invalid_size", "allowed": list(imagevariants.VARIANT_SIZES)}), 400
+        fmt = "webp" if request.accept_mimetypes["image/webp"] else "jpg"
+        variant = imagevariants.ensure_variant(UPLOAD_FOLDER, filename, size, fmt)
+        if variant:
+            filename = variant
+            vary_accept = True
+    if imagevariants.is_immutable(filename):
+        resp = send_from_directory(UPLOAD_FOLDER, filename, max_age=IMAGE_MAX_AGE, etag=True)
+        resp.headers["Cache-Control"] = f"public, max-age={IMAGE_MAX_AGE}, immutable"
+    else:
+        # nama tetap (gambar lama / fallback ke asli): cache default Flask, selalu revalidasi ETag
+        resp = send_from_directory(UPLOAD_FOLDER, filename, etag=True)
+    if vary_accept:
+        resp.vary.add("Accept")
+    return resp
 
 # -----------------------------
 # transaksi / cetak (protected)
@@ -526,126 +765,580 @@ def serve_image(filename):
 def cetak(current_email):
     data = request.get_json()
     try:
-        db = get_db()
-        cursor = db.cursor()
-        sql = """
-            INSERT INTO transaksi (nama_produk, berat_kg, harga_per_kg, total_harga, timestamp) 
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        val = (
-            data['nama_produk'],
-            data['berat_kg'],
-            data['harga_per_kg'],
-            data['total_harga'],
-            datetime.now()
-        )
-        cursor.execute(sql, val)
-        db.commit()
-        cursor.close(); db.close()
+        # transaksi + rekap harian (transaksi_harian) ditulis dalam satu transaksi
+        with get_db() as db:
+            cursor = db.cursor()
+            rollup.insert_transaksi(
+                cursor,
+                data['nama_produk'],
+                data['berat_kg'],
+                data['harga_per_kg'],
+                data['total_harga'],
+                datetime.now(tz=ZoneInfo("Asia/Jakarta"))
+            )
+            db.commit()
+            cursor.close()
         return jsonify({"status": f"✅ Transaksi {data['nama_produk']} berhasil disimpan!"})
     except Exception as e:
         return jsonify({"status": f"❌ Gagal menyimpan: {e}"}), 500
 
+# batas kolom transaksi: nama_produk varchar(100), berat_kg numeric(10,3), harga_per_kg/total_harga integer
+# (nilai di luar batas harus ditolak per item, jangan sampai menggagalkan INSERT satu batch)
+NAMA_PRODUK_MAX_LEN = 100
+BERAT_KG_MAX = decimal.Decimal("9999999.999")
+INT4_MAX = 2 ** 31 - 1
+
+def parse_int_field(value, name):
+    """Bilangan bulat 0..INT4_MAX; 1.5 / "abc" / true ditolak (tidak dibulatkan diam-diam)."""
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"{name} harus bilangan bulat")
+    try:
+        number = decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        raise ValueError(f"{name} harus bilangan bulat")
+    if not number.is_finite() or number != number.to_integral_value():
+        raise ValueError(f"{name} harus bilangan bulat")
+    if number < 0 or number > INT4_MAX:
+        raise ValueError(f"{name} harus 0..{INT4_MAX}")
+    return int(number)
+
+def valid_idempotency_key(key):
+    # kolom transaksi.idempotency_key varchar(64)
+    return isinstance(key, str) and bool(key.strip()) and len(key) <= 64
+
+def parse_sync_item(item):
+    """Validasi satu transaksi sync -> tuple baris INSERT (raise ValueError bila tidak valid)."""
+    if not isinstance(item, dict):
+        raise ValueError("item harus object")
+    key = item.get("idempotency_key")
+    if not valid_idempotency_key(key):
+        raise ValueError("idempotency_key wajib (string, maks 64 karakter)")
+    nama_produk = item.get("nama_produk")
+    if not isinstance(nama_produk, str) or not nama_produk.strip():
+        raise ValueError("nama_produk wajib")
+    if len(nama_produk) > NAMA_PRODUK_MAX_LEN:
+        raise ValueError(f"nama_produk maks {NAMA_PRODUK_MAX_LEN} karakter")
+    try:
+        berat_kg = decimal.Decimal(str(item.get("berat_kg")))
+    except decimal.InvalidOperation:
+        raise ValueError("berat_kg harus angka")
+    if not berat_kg.is_finite():
+        raise ValueError("berat_kg harus angka")
+    # numeric(10,3): dibulatkan ke gram seperti yang akan disimpan Postgres
+    berat_kg = berat_kg.quantize(decimal.Decimal("0.001"), rounding=decimal.ROUND_HALF_UP)
+    if berat_kg <= 0 or berat_kg > BERAT_KG_MAX:
+        raise ValueError(f"berat_kg harus > 0 dan <= {BERAT_KG_MAX}")
+    harga_per_kg = parse_int_field(item.get("harga_per_kg"), "harga_per_kg")
+    # total dari kiosk dipakai apa adanya (harga saat penjualan offline); kosong -> dihitung server
+    total_harga = item.get("total_harga")
+    if total_harga is None:
+        total_harga = checkout_total(berat_kg, harga_per_kg)
+    total_harga = parse_int_field(total_harga, "total_harga")
+    ts = item.get("timestamp")
+    if ts:
+        ts = datetime.fromisoformat(ts)
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=ZoneInfo("Asia/Jakarta"))
+    else:
+        ts = datetime.now(tz=ZoneInfo("Asia/Jakarta"))
+    return (key, nama_produk, berat_kg, harga_per_kg, total_harga, ts)
+
+@app.route("/api/transaksi/sync", methods=["POST"])
+@token_required
+def api_transaksi_sync(current_email):
+    """
+    Sync batch penjualan dari antrian lokal kiosk (offline-tolerant).
+    JSON: { transaksi: [ { idempotency_key, nama_produk, berat_kg, harga_per_kg,
+                           total_harga (optional), timestamp ISO (optional) }, ... ] }
+    Semua item valid ditulis dengan satu INSERT multi-row (+ rekap harian), kunci yang sudah
+    pernah diterima dilewati. Return hasil per item (urutan sama dengan request):
+      created | duplicate (id transaksi yang sudah ada) | invalid (error)
+    Kiosk boleh mengirim ulang batch yang sama sampai berhasil tanpa takut dobel.
+    """
+    data = request.get_json(silent=True)
+    items = data.get("transaksi") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "transaksi_required"}), 400
+    if len(items) > SYNC_MAX_ITEMS:
+        return jsonify({"error": "too_many_items", "max_items": SYNC_MAX_ITEMS}), 413
+
+    results = []
+    rows = {}
+    for item in items:
+        key = item.get("idempotency_key") if isinstance(item, dict) else None
+        try:
+            row = parse_sync_item(item)
+        except (TypeError, ValueError) as e:
+            results.append({"idempotency_key": key, "status": "invalid", "error": str(e)})
+            continue
+        # kunci yang sama dua kali dalam satu batch: hanya yang pertama ditulis
+        rows.setdefault(key, row)
+        results.append({"idempotency_key": key})
+
+    written = {}
+    if rows:
+        try:
+            with get_db(autocommit=True) as db:
+                cursor = db.cursor()
+                written = rollup.insert_transaksi_batch(cursor, list(rows.values()))
+                cursor.close()
+        except Exception as e:
+            # tidak ada yang tertulis: kiosk kirim ulang batch yang sama nanti
+            return jsonify({"status": f"❌ Gagal menyimpan: {e}", "error": "db_error"}), 503
+
+    created = duplicate = 0
+    seen = set()
+    for r in results:
+        if "status" in r:
+            continue
+        key = r["idempotency_key"]
+        trx_id, ts, is_new = written.get(key, (None, None, False))
+        if is_new and key not in seen:
+            r["status"] = "created"
+            created += 1
+        else:
+            r["status"] = "duplicate"
+            duplicate += 1
+        seen.add(key)
+        r["id"] = trx_id
+        r["timestamp"] = ts.isoformat() if ts else None
+
+    return jsonify({
+        "created": created,
+        "duplicate": duplicate,
+        "invalid": len(results) - created - duplicate,
+        "results": results,
+    })
+
+RIWAYAT_COLUMNS = """
+    SELECT id,
+           nama_produk,
+           berat_kg::float8 AS berat,
+           harga_per_kg,
+           total_harga,
+           timestamp AS waktu
+    FROM transaksi
+"""
+
+def encode_riwayat_cursor(row):
+    raw = f"{row['waktu'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_riwayat_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    ts, row_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").rsplit("|", 1)
+    return datetime.fromisoformat(ts), int(row_id)
+
+def build_riwayat_query(args):
+    """
+    Filter tanggal ditulis sebagai rentang timestamp (sargable, pakai idx_transaksi_timestamp_id):
+      tanggal=YYYY-MM-DD            -> timestamp >= d AND timestamp < d + 1
+      tanggal=YYYY-MM-DD:YYYY-MM-DD -> timestamp >= d1 AND timestamp < d2 + 1
+    Keyset: after=<cursor dari next_cursor> -> (timestamp, id) lewat baris terakhir halaman sebelumnya
+    """
+    tanggal = args.get("tanggal", "")
+    desc = args.get("sort", "desc") != "asc"
+    where = []
+    params = []
+
+    if tanggal:
+        if ":" in tanggal:
+            start_date, end_date = tanggal.split(":")
+        else:
+            start_date = end_date = tanggal
+        where.append("timestamp >= %s::date AND timestamp < %s::date + 1")
+        params.extend([start_date, end_date])
+
+    after = args.get("after")
+    if after:
+        after_ts, after_id = decode_riwayat_cursor(after)
+        where.append(f"(timestamp, id) {'<' if desc else '>'} (%s, %s)")
+        params.extend([after_ts, after_id])
+
+    query = RIWAYAT_COLUMNS
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    order = "DESC" if desc else "ASC"
+    query += f" ORDER BY timestamp {order}, id {order}"
+    return query, params
+
+def stream_riwayat_ndjson(query, params):
+    # named cursor -> baris diambil bertahap dari server, tidak pernah fetchall() di memori
+    with get_db() as db:
+        cur = db.cursor(name=f"riwayat_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.itersize = RIWAYAT_STREAM_ITERSIZE
+        try:
+            cur.execute(query, tuple(params))
+            for row in cur:
+                yield app.json.dumps(row) + "\n"
+        finally:
+            cur.close()
+            db.rollback()
+
 @app.route("/api/riwayat", methods=["GET"])
 @token_required
 def get_riwayat(current_user):
-    tanggal = request.args.get("tanggal", "")
-    sort = request.args.get("sort", "desc")
+    """
+    Query: tanggal, sort=asc|desc
+      limit=<n>&after=<cursor> -> {"items": [...], "next_cursor": "..." | null}
+      format=ndjson            -> satu transaksi per baris (streaming, boleh dikombinasi limit/after)
+      tanpa limit/format       -> array JSON penuh (kontrak lama)
+    """
     try:
-        db = get_db()
-        cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        query = """
-            SELECT id,
-                   nama_produk,
-                   berat_kg AS berat,
-                   harga_per_kg,
-                   total_harga,
-                   timestamp AS waktu
-            FROM transaksi
-        """
-        params = []
-
-        if tanggal:
-            if ":" in tanggal:
-                start_date, end_date = tanggal.split(":")
-                query += " WHERE DATE(timestamp) BETWEEN %s AND %s"
-                params.extend([start_date, end_date])
-            else:
-                query += " WHERE DATE(timestamp) = %s"
-                params.append(tanggal)
-
-        # default sort by time only
-        query += f" ORDER BY timestamp {'ASC' if sort == 'asc' else 'DESC'}"
+        query, params = build_riwayat_query(request.args)
+    except ValueError:
+        return jsonify({"error": "invalid_cursor"}), 400
 
-        cur.execute(query, tuple(params))
-        rows = cur.fetchall()
+    limit = request.args.get("limit")
+    if limit is not None:
+        try:
+            limit = max(1, min(int(limit), RIWAYAT_MAX_LIMIT))
+        except ValueError:
+            return jsonify({"error": "invalid_limit"}), 400
 
-        for r in rows:
-            for k, v in r.items():
-                if isinstance(v, decimal.Decimal):
-                    r[k] = float(v)
+    if request.args.get("format") == "ndjson":
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+        return Response(stream_with_context(stream_riwayat_ndjson(query, params)),
+                        mimetype="application/x-ndjson")
 
-        cur.close(); db.close()
-        return jsonify(rows)
+    try:
+        if limit:
+            # ambil satu baris ekstra untuk tahu masih ada halaman berikutnya
+            query += " LIMIT %s"
+            params.append(limit + 1)
+
+        with get_db() as db:
+            cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(query, tuple(params))
+            rows = cur.fetchall()
+            cur.close()
+
+        if not limit:
+            return jsonify(rows)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return jsonify({
+            "items": rows,
+            "next_cursor": encode_riwayat_cursor(rows[-1]) if has_more else None
+        })
     except Exception as e:
         print("❌ Error saat ambil riwayat:", e)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/riwayat/summary", methods=["GET"])
+@token_required
+def get_riwayat_summary(current_user):
+    """
+    Rekap harian dari transaksi_harian (bukan dari baris mentah transaksi).
+    Query: tanggal=YYYY-MM-DD atau YYYY-MM-DD:YYYY-MM-DD (default: hari ini), nama_produk (opsional)
+    Returns: {"days": [{tanggal, nama_produk, jumlah, total_berat_kg, total_harga}], "totals": {...}}
+    """
+    tanggal = request.args.get("tanggal", "")
+    if tanggal:
+        start_date, _, end_date = tanggal.partition(":")
+        end_date = end_date or start_date
+    else:
+        start_date = end_date = datetime.now(tz=ZoneInfo("Asia/Jakarta")).date().isoformat()
+    try:
+        with get_db() as db:
+            cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            rows = rollup.fetch_summary(cur, start_date, end_date, request.args.get("nama_produk"))
+            cur.close()
+        for r in rows:
+            r["tanggal"] = r["tanggal"].isoformat()
+        totals = {
+            "jumlah": sum(r["jumlah"] for r in rows),
+            "total_berat_kg": round(sum(r["total_berat_kg"] for r in rows), 3),
+            "total_harga": sum(r["total_harga"] for r in rows),
+        }
+        return jsonify({"from": start_date, "to": end_date, "days": rows, "totals": totals})
+    except Exception as e:
+        print("❌ Error saat ambil rekap riwayat:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+# -----------------------------
+# DB pool stats (protected) - untuk sizing DB_POOL_MIN / DB_POOL_MAX
+# -----------------------------
+@app.route("/api/db/pool", methods=["GET"])
+@token_required
+def api_db_pool_stats(current_email):
+    return jsonify(DB_POOL.stats())
+
+@app.route("/api/produk/cache", methods=["GET"])
+@token_required
+def api_produk_cache_stats(current_email):
+    return jsonify(CATALOG.stats())
+
+
 # -----------------------------
 # Multi-client detect_frame (protected)
 # -----------------------------
-def process_frame_yolo(frame):
-    global model
+def infer_frames_yolo(frames):
+    # satu panggilan model untuk banyak frame; hasil per frame (None bila model tidak ada)
+    model = MODEL.get()
     if model is None:
-        ret, buf = cv2.imencode('.jpg', frame)
-        return "Model not loaded", [], buf.tobytes()
-    results = model(frame, conf=0.6, verbose=False)
-    detections = []
-    top_label = "Tidak ada"
+        return [None] * len(frames)
+    return model.predict(frames)
+
+def encode_jpeg(image):
+    return detection.encode_jpeg(image, ANNOTATED_JPEG_QUALITY, ANNOTATED_MAX_SIDE, stage)
+
+def summarize_result(frame, result, annotate=True, names=None):
+    """
+    Return (top_label, detections, jpeg_bytes), lihat detection.summarize_result.
+    annotate=False -> lewati results.plot() dan cv2.imencode, jpeg_bytes = None
+    """
+    if names is None:
+        model = MODEL.get()
+        names = model.names if model is not None else {}
+    return detection.summarize_result(frame, result, names, annotate=annotate, quality=ANNOTATED_JPEG_QUALITY,
+                                      max_side=ANNOTATED_MAX_SIDE, timer=stage)
+
+def record_worker_timings(timings):
+    for name, seconds in timings.items():
+        stage.record(name, seconds)
+
+def process_frame_yolo(frame, annotate=True):
+    if PROCESS_ENGINE is not None:
+        label, boxes, annotated_bytes, timings = PROCESS_ENGINE.process(frame, annotate)
+        record_worker_timings(timings)
+        return label, boxes, annotated_bytes
+    with stage("inference"):
+        result = infer_frames_yolo([frame])[0]
+    return summarize_result(frame, result, annotate=annotate)
+
+# frame dari semua client digabung jadi batch, plot/encode tetap di thread request
+# scheduler: antrian per client dilayani round-robin, hanya frame terbaru per client yang diinferensi
+INFERENCE_BATCHER = InferenceBatcher(
+    PROCESS_ENGINE.run_batch if PROCESS_ENGINE is not None else infer_frames_yolo, max_batch_size=INFER_MAX_BATCH, max_wait_ms=INFER_MAX_WAIT_MS,
+    max_queue=INFER_MAX_QUEUE, drop_superseded=INFER_DROP_SUPERSEDED, autostart=False,
+)
+ROI_CONFIG = roi.RoiConfig(ROI_CONFIG_FILE, default_roi=ROI_DEFAULT, default_max_side=INFER_MAX_SIDE)
+ADAPTIVE_RES = roi.AdaptiveResolution(INFER_SIZES, budget_ms=INFER_LATENCY_BUDGET_MS)
+TRACKER = KeyframeTracker(
+    interval=TRACK_KEYFRAME_INTERVAL, min_conf=TRACK_MIN_CONF, max_age_s=TRACK_MAX_AGE_S, enabled_default=TRACK_DEFAULT,
+    store=ClientStateStore(CLIENT_STATE_TTL_S, CLIENT_STATE_MAX, CLIENT_STATE_SHARDS, name="tracks"),
+)
+FRAME_GATE = FrameChangeGate(
+    threshold=FRAME_GATE_THRESHOLD, max_stale_s=FRAME_GATE_MAX_STALE_S, enabled=FRAME_GATE_ENABLED,
+    store=ClientStateStore(FRAME_GATE_MAX_STALE_S, CLIENT_STATE_MAX, CLIENT_STATE_SHARDS, name="frame_gate"),
+)
+
+@app.route("/auth/cache", methods=["GET"])
+@token_required
+def auth_cache_stats(current_email):
+    return jsonify({"tokens": TOKEN_CACHE.stats(), "users": USER_CACHE.stats()})
+
+@app.route("/api/clients/stats", methods=["GET"])
+@token_required
+def api_clients_stats(current_email):
+    return jsonify([store.stats() for store in (latest_detection, client_last_ts, FRAME_GATE.entries, TRACKER.entries)])
+
+@app.route("/api/inference/stats", methods=["GET"])
+@token_required
+def api_inference_stats(current_email):
+    stats = INFERENCE_BATCHER.stats()
+    stats["frame_gate"] = FRAME_GATE.stats()
+    stats["roi"] = ROI_CONFIG.stats()
+    stats["adaptive"] = ADAPTIVE_RES.stats()
+    stats["tracker"] = TRACKER.stats()
+    stats["backend"] = MODEL.stats()
+    return jsonify(stats)
+
+@app.route("/api/roi/<key>", methods=["GET"])
+@token_required
+def api_roi_get(current_email, key):
+    """ROI untuk kiosk_id/client_id `key` (entri sendiri, atau default bila tidak ada)."""
+    entry = ROI_CONFIG.get(key)
+    return jsonify({"key": key, "custom": entry is not None, **(entry or ROI_CONFIG.lookup())})
+
+@app.route("/api/roi/<key>", methods=["PUT"])
+@token_required
+def api_roi_set(current_email, key):
+    """JSON: { roi: [x1, y1, x2, y2] | "x1,y1,x2,y2" | null, max_side: int (optional) }"""
+    data = request.get_json(silent=True) or {}
     try:
-        boxes = results[0].boxes
-    except Exception:
-        boxes = []
-    if len(boxes) > 0:
-        for box in boxes:
-            try:
-                cls_idx = int(as_number(box.cls))
-            except Exception:
-                cls_idx = int(box.cls) if hasattr(box, "cls") else 0
-            try:
-                conf = float(as_number(box.conf))
-            except Exception:
-                conf = float(box.conf) if hasattr(box, "conf") else 0.0
-            try:
-                xyxy = box.xyxy[0]
-                x1 = float(as_number(xyxy[0])); y1 = float(as_number(xyxy[1]))
-                x2 = float(as_number(xyxy[2])); y2 = float(as_number(xyxy[3]))
-            except Exception:
-                x1 = y1 = x2 = y2 = 0.0
-            label = model.names[cls_idx] if hasattr(model, "names") else str(cls_idx)
-            detections.append({
-                "cls": cls_idx, "label": label, "conf": round(conf, 4),
-                "x1": round(x1,1), "y1": round(y1,1), "x2": round(x2,1), "y2": round(y2,1)
-            })
-        top_label = detections[0]["label"]
+        entry = ROI_CONFIG.set(key, roi=data.get("roi"), max_side=data.get("max_side") or 0)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "invalid_roi", "detail": str(e)}), 400
+    except OSError as e:
+        return jsonify({"error": "roi_save_failed", "detail": str(e)}), 500
+    # tidak perlu forget: key biasanya kiosk_id (cache per client_id); FRAME_GATE / TRACKER
+    # membandingkan ROI + transform tersimpan dan otomatis miss / keyframe bila berubah
+    return jsonify({"key": key, "custom": True, **entry})
+
+@app.route("/api/roi/<key>", methods=["DELETE"])
+@token_required
+def api_roi_delete(current_email, key):
     try:
-        annotated = results[0].plot()
-    except Exception:
-        annotated = frame
-    ret, buf = cv2.imencode('.jpg', annotated)
-    jpeg_bytes = buf.tobytes()
-    return top_label, detections, jpeg_bytes
+        removed = ROI_CONFIG.remove(key)
+    except OSError as e:
+        return jsonify({"error": "roi_save_failed", "detail": str(e)}), 500
+    return jsonify({"key": key, "removed": removed})
+
+def check_model_ready():
+    # 503 selama model masih dimuat / warm-up (state failed tetap dilayani: "Model not loaded")
+    if MODEL.state in ("pending", "loading"):
+        resp = jsonify({"error": "model_loading", "state": MODEL.state})
+        resp.headers["Retry-After"] = "2"
+        return resp, 503
+    return None
+
+def next_interval_ms():
+    # interval kirim frame yang disarankan ke kiosk: tidak lebih cepat dari antrian bisa dikosongkan
+    return int(max(MIN_INTERVAL_S, INFERENCE_BATCHER.retry_after_s()) * 1000)
+
+def detection_error_response(e):
+    if isinstance(e, QueueFull):
+        retry_ms = max(int(e.retry_after_s * 1000), int(MIN_INTERVAL_S * 1000))
+        resp = jsonify({"error": "overloaded", "retry_after_ms": retry_ms, "next_interval_ms": retry_ms})
+        resp.headers["Retry-After"] = str(max(1, -(-retry_ms // 1000)))
+        return resp, 503
+    if isinstance(e, WorkerUnavailable):
+        resp = jsonify({"error": "inference_unavailable", "detail": str(e)})
+        resp.headers["Retry-After"] = "2"
+        return resp, 503
+    if isinstance(e, Superseded):
+        return jsonify({"error": "superseded", "detail": "frame lebih baru dari client ini sedang diproses"}), 409
+    return jsonify({"error": "processing_timeout"}), 504
+
+@app.after_request
+def add_next_interval_hint(resp):
+    if request.endpoint in ("api_detect_frame", "api_detect_frame_raw") and "X-Next-Interval-Ms" not in resp.headers:
+        resp.headers["X-Next-Interval-Ms"] = str(next_interval_ms())
+    return resp
+
+def check_client_rate(client_id):
+    # return response 429 bila client mengirim terlalu cepat, None bila boleh lanjut
+    if not client_last_ts.check_interval(client_id, MIN_INTERVAL_S):
+        return jsonify({"error": "too_many_requests", "min_interval_s": MIN_INTERVAL_S}), 429
+    return None
+
+def decode_image_buffer(buf):
+    # np.frombuffer tidak menyalin data: cv2.imdecode baca langsung dari buffer request
+    nparr = np.frombuffer(buf, np.uint8)
+    with stage("imdecode"):
+        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("cannot_decode_frame")
+    return frame
+
+def inference_max_side(cfg):
+    # batas terkecil yang berlaku: config ROI kiosk/default, lalu ukuran adaptif
+    sides = [s for s in (cfg["max_side"], ADAPTIVE_RES.current() if ADAPTIVE_RES.enabled else 0) if s]
+    return min(sides) if sides else 0
+
+def annotate_original(frame, boxes, roi_box):
+    # frame inferensi = crop/resize -> gambar box (sudah dipetakan balik) di frame asli
+    with stage("plot"):
+        image = detection.draw_detections(frame, boxes, roi_box)
+    return encode_jpeg(image)
+
+def detect_with_model(client_id, infer_frame, plot_in_model):
+    """Satu frame lewat INFERENCE_BATCHER -> (label, boxes koordinat frame inferensi, jpeg|None)."""
+    # mode proses: worker juga menjalankan plot/encode, jadi annotate ikut dikirim
+    item = (infer_frame, plot_in_model) if PROCESS_ENGINE is not None else infer_frame
+    fut = INFERENCE_BATCHER.submit(item, key=client_id, timeout_s=INFER_TIMEOUT_S)
+    try:
+        result = fut.result(timeout=INFER_TIMEOUT_S)
+    except TimeoutError:
+        fut.cancel()
+        raise
+    DETECT_FRAMES_TOTAL.inc(source="model")
+    # queue_wait: antri di batcher sampai batch dimulai; inference: panggilan model untuk seluruh batch
+    stage.record("queue_wait", fut.queue_delay_s)
+    ADAPTIVE_RES.observe((fut.queue_delay_s + fut.infer_s) * 1000.0)
+    if PROCESS_ENGINE is not None:
+        label, boxes, annotated_bytes, timings = result
+        record_worker_timings(timings)
+        return label, boxes, annotated_bytes
+    stage.record("inference", fut.infer_s)
+    return summarize_result(infer_frame, result, annotate=plot_in_model)
+
+def decode_data_url(frame_b64):
+    # "data:image/jpeg;base64,...." atau base64 polos
+    if "," in frame_b64:
+        _, b64 = frame_b64.split(",", 1)
+    else:
+        b64 = frame_b64
+    with stage("b64decode"):
+        raw = base64.b64decode(b64)
+    return decode_image_buffer(raw)
+
+def run_detection(client_id, frame, annotate=True, kiosk_id=None, track=None):
+    """
+    Jalankan frame lewat INFERENCE_BATCHER lalu simpan latest_detection[client_id].
+    Frame dipotong ke ROI kiosk/client dan diperkecil (INFER_MAX_SIDE / mode adaptif)
+    sebelum inferensi; boxes selalu dalam koordinat frame asli.
+    Bila scene tidak berubah (FRAME_GATE), hasil terakhir client dipakai ulang tanpa model.
+    track=True (default TRACK_DEFAULT): YOLO hanya di keyframe, frame lain box digeser
+    TRACKER; label dari state track client (lebih stabil antar frame).
+    Raise QueueFull (antrian penuh), Superseded (ada frame lebih baru dari client ini),
+    Expired / TimeoutError bila lewat batas waktu.
+    """
+    track = TRACKER.enabled_default if track is None else track
+    cfg = ROI_CONFIG.lookup(kiosk_id, client_id)
+    with stage("roi"):
+        infer_frame, transform = roi.prepare_frame(frame, cfg["roi"], inference_max_side(cfg))
+    # plot()/worker hanya menganotasi bila frame inferensi = frame asli dan box = hasil model apa adanya
+    plot_in_model = annotate and transform == roi.IDENTITY and not track
+    view = (cfg["roi"], transform, infer_frame.shape[:2])
+    with stage("frame_gate"):
+        # sidik dari area ROI saja: gerakan di luar tray tidak memicu inferensi
+        signature = FRAME_GATE.signature(infer_frame) if FRAME_GATE.enabled else None
+        cached = FRAME_GATE.lookup(client_id, signature, annotate, view) if signature is not None else None
+    if cached is not None:
+        DETECT_FRAMES_TOTAL.inc(source="frame_gate")
+        label, boxes, annotated_bytes = cached
+        if not annotate:
+            annotated_bytes = None
+    else:
+        tracked = None
+        if track:
+            with stage("track"):
+                tracked = TRACKER.propagate(client_id, infer_frame, transform)
+        if tracked is not None:
+            DETECT_FRAMES_TOTAL.inc(source="tracker")
+            boxes = tracked
+            label = boxes[0]["label"] if boxes else "Tidak ada"
+            annotated_bytes = None
+        else:
+            label, boxes, annotated_bytes = detect_with_model(client_id, infer_frame, plot_in_model)
+            boxes = roi.map_detections(boxes, transform)
+            if track:
+                with stage("track"):
+                    boxes = TRACKER.update(client_id, infer_frame, transform, boxes)
+                if boxes:
+                    label = boxes[0]["label"]
+        if annotate and not plot_in_model:
+            roi_box = roi.roi_pixels(cfg["roi"], frame.shape[1], frame.shape[0]) if cfg["roi"] else None
+            annotated_bytes = annotate_original(frame, boxes, roi_box)
+        if signature is not None and tracked is None:
+            FRAME_GATE.store(client_id, signature, annotate, (label, boxes, annotated_bytes), view)
+
+    # store per-client detection (include weight and timestamp)
+    latest_detection[client_id] = {
+        "detection": label,
+        "weight": SCALE.stable_weight(),
+        "ts": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
+    }
+    STATUS_HUB.publish(client_id)
+    return label, boxes, annotated_bytes
 
 @app.route("/api/detect_frame", methods=["POST"])
 @token_required
 def api_detect_frame(current_email):
     """
-    Expects JSON: { frame: dataURL, client_id: "<uuid>" }
-    Stores latest_detection[client_id] = {"detection": label, "weight": latest_weight, "ts": ...}
-    Returns detection, boxes, annotated_frame
+    Expects JSON: { frame: dataURL, client_id: "<uuid>", annotate: bool (optional), kiosk_id: str (optional, pilih ROI),
+                    track: bool (optional, keyframe + tracking) }
+    Stores latest_detection[client_id] = {"detection": label, "weight": <berat stabil>, "ts": ...}
+    Returns detection, boxes, annotated_frame (null bila annotate=false)
     """
-    global latest_detection, latest_weight
     try:
         data = request.get_json(force=True)
     except Exception as e:
@@ -653,62 +1346,417 @@ def api_detect_frame(current_email):
 
     frame_b64 = data.get("frame")
     client_id = data.get("client_id") or str(uuid.uuid4())
+    kiosk_id = data.get("kiosk_id")
+    annotate = parse_bool(data.get("annotate"), DETECT_ANNOTATE)
+    track = parse_bool(data.get("track"), TRACK_DEFAULT)
     if not frame_b64:
         return jsonify({"error": "no_frame_provided"}), 400
 
-    now = time.time()
-    with client_lock:
-        last = client_last_ts.get(client_id, 0)
-        if now - last < MIN_INTERVAL_S:
-            return jsonify({"error": "too_many_requests", "min_interval_s": MIN_INTERVAL_S}), 429
-        client_last_ts[client_id] = now
+    not_ready = check_model_ready()
+    if not_ready:
+        return not_ready
+    limited = check_client_rate(client_id)
+    if limited:
+        return limited
 
     try:
-        if "," in frame_b64:
-            _, b64 = frame_b64.split(",", 1)
-        else:
-            b64 = frame_b64
-        img_bytes = base64.b64decode(b64)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None:
-            raise ValueError("cannot_decode_frame")
+        frame = decode_data_url(frame_b64)
     except Exception as e:
         return jsonify({"error": "failed_decode_frame", "detail": str(e)}), 400
 
-    fut = WORKER_POOL.submit(process_frame_yolo, frame)
     try:
-        label, boxes, annotated_bytes = fut.result(timeout=12)
-    except TimeoutError:
-        return jsonify({"error": "processing_timeout"}), 504
+        label, boxes, annotated_bytes = run_detection(client_id, frame, annotate=annotate, kiosk_id=kiosk_id, track=track)
+    except (QueueFull, Superseded, Expired, TimeoutError, WorkerUnavailable) as e:
+        return detection_error_response(e)
     except Exception as e:
         return jsonify({"error": "processing_error", "detail": str(e)}), 500
 
-    # store per-client detection (include weight and timestamp)
-    latest_detection[client_id] = {
+    annotated_b64 = None
+    if annotated_bytes:
+        try:
+            with stage("b64encode"):
+                encoded = base64.b64encode(annotated_bytes).decode('utf-8')
+            annotated_b64 = f"data:image/jpeg;base64,{encoded}"
+        except Exception:
+            annotated_b64 = None
+
+    resp = {
         "detection": label,
-        "weight": latest_weight,
-        "ts": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
+        "boxes": boxes,
+        "annotated_frame": annotated_b64,
+        "server_time": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
     }
+    return jsonify(resp)
+
+# format biner ringkas untuk response=bin:
+#   header "<H"  : jumlah box
+#   per box "<Hfffff": cls, conf, x1, y1, x2, y2 (little-endian)
+# label per cls tersedia di header X-Labels (JSON {cls: label})
+BOX_STRUCT = struct.Struct("<Hfffff")
+
+def pack_boxes(boxes):
+    out = bytearray(2 + BOX_STRUCT.size * len(boxes))
+    struct.pack_into("<H", out, 0, len(boxes))
+    for i, b in enumerate(boxes):
+        BOX_STRUCT.pack_into(out, 2 + i * BOX_STRUCT.size,
+                             b["cls"], b["conf"], b["x1"], b["y1"], b["x2"], b["y2"])
+    return bytes(out)
+
+@app.route("/api/detect_frame/raw", methods=["POST"])
+@token_required
+def api_detect_frame_raw(current_email):
+    """
+    Upload frame sebagai byte mentah (tanpa base64):
+      - body langsung: Content-Type image/jpeg | image/png | application/octet-stream
+      - multipart/form-data dengan field file "frame"
+    client_id lewat header X-Client-Id atau query ?client_id=, kiosk (pilih ROI) lewat X-Kiosk-Id / ?kiosk_id=
+    ?track=1 -> keyframe + tracking (lihat run_detection)
+    ?response=json (default, tanpa gambar) | jpeg (gambar anotasi mentah) | bin (lihat BOX_STRUCT)
+    json/bin tidak pernah menjalankan plot()/imencode; jpeg selalu anotasi.
+    Untuk jpeg/bin, label & client_id dikirim lewat header X-Detection / X-Client-Id.
+    """
+    client_id = request.headers.get("X-Client-Id") or request.args.get("client_id") or str(uuid.uuid4())
+    kiosk_id = request.headers.get("X-Kiosk-Id") or request.args.get("kiosk_id")
+    track = parse_bool(request.args.get("track"), TRACK_DEFAULT)
+    response_mode = (request.args.get("response") or "json").lower()
+    if response_mode not in ("json", "jpeg", "bin"):
+        return jsonify({"error": "invalid_response_mode", "allowed": ["json", "jpeg", "bin"]}), 400
+
+    if request.content_type and "multipart/form-data" in request.content_type:
+        file = request.files.get("frame")
+        buf = file.read() if file else b""
+    else:
+        buf = request.get_data(cache=False)
+    if not buf:
+        return jsonify({"error": "no_frame_provided"}), 400
+
+    not_ready = check_model_ready()
+    if not_ready:
+        return not_ready
+    limited = check_client_rate(client_id)
+    if limited:
+        return limited
 
     try:
-        encoded = base64.b64encode(annotated_bytes).decode('utf-8')
-        annotated_b64 = f"data:image/jpeg;base64,{encoded}"
-    except Exception:
-        annotated_b64 = None
+        frame = decode_image_buffer(buf)
+    except Exception as e:
+        return jsonify({"error": "failed_decode_frame", "detail": str(e)}), 400
+    del buf
+
+    try:
+        label, boxes, annotated_bytes = run_detection(client_id, frame, annotate=(response_mode == "jpeg"), kiosk_id=kiosk_id, track=track)
+    except (QueueFull, Superseded, Expired, TimeoutError, WorkerUnavailable) as e:
+        return detection_error_response(e)
+    except Exception as e:
+        return jsonify({"error": "processing_error", "detail": str(e)}), 500
+
+    if response_mode == "json":
+        return jsonify({
+            "detection": label,
+            "boxes": boxes,
+            "client_id": client_id,
+            "server_time": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
+        })
+
+    headers = {"X-Detection": label, "X-Client-Id": client_id, "Cache-Control": "no-store"}
+    if response_mode == "jpeg":
+        return Response(annotated_bytes, mimetype="image/jpeg", headers=headers)
+    labels = {str(b["cls"]): b["label"] for b in boxes}
+    headers["X-Labels"] = json.dumps(labels, separators=(",", ":"), ensure_ascii=True)
+    return Response(pack_boxes(boxes), mimetype="application/octet-stream", headers=headers)
+
+# -----------------------------
+# checkout satu panggilan: deteksi -> produk -> berat -> harga -> transaksi
+# -----------------------------
+def checkout_total(berat_kg, harga_per_kg):
+    # sama dengan kiosk lama: Math.round(berat * harga), dihitung dengan Decimal (tanpa galat float)
+    total = decimal.Decimal(str(berat_kg)) * int(harga_per_kg)
+    return int(total.quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP))
+
+def detection_age_s(status):
+    try:
+        ts = datetime.fromisoformat(status["ts"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (datetime.now(tz=ZoneInfo("Asia/Jakarta")) - ts).total_seconds()
+
+@app.route("/api/checkout", methods=["POST"])
+@token_required
+def api_checkout(current_email):
+    """
+    Pengganti detect_frame -> /api/status -> /api/produk -> /cetak dalam satu request.
+    JSON: { client_id: "<uuid>", frame: dataURL (optional), kiosk_id, track (optional),
+            kode_produk: int (optional, koreksi kasir: lewati label deteksi),
+            idempotency_key: str (optional, atau header Idempotency-Key) }
+    Tanpa frame -> pakai deteksi terakhir client (maks CHECKOUT_MAX_DETECTION_AGE_S).
+    Berat = berat stabil timbangan, total_harga dihitung server; transaksi + rekap harian
+    ditulis dengan satu statement. Return struk transaksi.
+    Request ulang dengan idempotency_key yang sama (retry Wi-Fi kiosk) tidak menulis transaksi
+    baru: struk transaksi pertama dikembalikan dengan "duplicate": true.
+    """
+    data = request.get_json(silent=True) or {}
+    client_id = data.get("client_id")
+    frame_b64 = data.get("frame")
+    if not client_id and not frame_b64 and data.get("kode_produk") is None:
+        return jsonify({"error": "client_id_or_frame_required"}), 400
+    idempotency_key = data.get("idempotency_key") or request.headers.get("Idempotency-Key")
+    if idempotency_key is not None and not valid_idempotency_key(idempotency_key):
+        return jsonify({"error": "invalid_idempotency_key", "detail": "string, maks 64 karakter"}), 400
+    if idempotency_key:
+        # retry dicek sebelum timbangan/deteksi: barang mungkin sudah diangkat dari tray
+        try:
+            existing = checkout_existing(idempotency_key)
+        except Exception as e:
+            return jsonify({"status": f"❌ Gagal menyimpan: {e}"}), 500
+        if existing is not None:
+            return jsonify(existing)
+
+    reading = SCALE.reading()
+    if CHECKOUT_REQUIRE_STABLE and not reading.stable:
+        resp = jsonify({"error": "scale_not_stable", "weight": reading.weight})
+        resp.headers["Retry-After"] = "1"
+        return resp, 409
+    berat_kg = reading.stable_weight
+    if not berat_kg or berat_kg <= 0:
+        return jsonify({"error": "invalid_weight", "weight": berat_kg}), 409
+
+    boxes = None
+    if frame_b64:
+        client_id = client_id or str(uuid.uuid4())
+        not_ready = check_model_ready()
+        if not_ready:
+            return not_ready
+        try:
+            frame = decode_data_url(frame_b64)
+        except Exception as e:
+            return jsonify({"error": "failed_decode_frame", "detail": str(e)}), 400
+        try:
+            label, boxes, _ = run_detection(client_id, frame, annotate=False, kiosk_id=data.get("kiosk_id"),
+                                            track=parse_bool(data.get("track"), TRACK_DEFAULT))
+        except (QueueFull, Superseded, Expired, TimeoutError, WorkerUnavailable) as e:
+            return detection_error_response(e)
+        except Exception as e:
+            return jsonify({"error": "processing_error", "detail": str(e)}), 500
+    else:
+        status = latest_detection.get(client_id) if client_id else None
+        label = status["detection"] if status else None
+        age = detection_age_s(status) if status else None
+        if data.get("kode_produk") is None:
+            if status is None:
+                return jsonify({"error": "no_detection", "detail": "kirim frame atau jalankan deteksi dulu"}), 409
+            if CHECKOUT_MAX_DETECTION_AGE_S and (age is None or age > CHECKOUT_MAX_DETECTION_AGE_S):
+                return jsonify({"error": "detection_stale", "age_s": age}), 409
+
+    try:
+        if data.get("kode_produk") is not None:
+            produk = CATALOG.get_row(int(data["kode_produk"]))
+        else:
+            produk = CATALOG.find_by_label(label)
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid_kode_produk"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if produk is None or produk.get("harga_per_kg") is None:
+        return jsonify({"error": "produk_tidak_ditemukan", "detection": label, "kode_produk": data.get("kode_produk")}), 404
+
+    harga_per_kg = int(produk["harga_per_kg"])
+    total_harga = checkout_total(berat_kg, harga_per_kg)
+    now = datetime.now(tz=ZoneInfo("Asia/Jakarta"))
+    try:
+        with get_db(autocommit=True) as db:
+            cursor = db.cursor()
+            if idempotency_key:
+                # ON CONFLICT (idempotency_key) DO NOTHING: retry yang datang bersamaan tidak dobel
+                row = (idempotency_key, produk["nama_produk"], berat_kg, harga_per_kg, total_harga, now)
+                trx_id, trx_ts, created = rollup.insert_transaksi_batch(cursor, [row]).get(
+                    idempotency_key, (None, None, False))
+            else:
+                trx_id, trx_ts = rollup.insert_transaksi(
+                    cursor, produk["nama_produk"], berat_kg, harga_per_kg, total_harga, now,
+                )
+                created = True
+            cursor.close()
+    except Exception as e:
+        return jsonify({"status": f"❌ Gagal menyimpan: {e}"}), 500
+    if not created:
+        existing = checkout_existing(idempotency_key)
+        if existing is None:
+            # request lain dengan kunci yang sama belum commit
+            resp = jsonify({"error": "checkout_in_progress", "idempotency_key": idempotency_key})
+            resp.headers["Retry-After"] = "1"
+            return resp, 409
+        return jsonify(existing)
 
     resp = {
+        "status": f"✅ Transaksi {produk['nama_produk']} berhasil disimpan!",
+        "receipt": {
+            "id": trx_id,
+            "kode_produk": produk["kode_produk"],
+            "nama_produk": produk["nama_produk"],
+            "berat_kg": berat_kg,
+            "harga_per_kg": harga_per_kg,
+            "total_harga": total_harga,
+            "timestamp": trx_ts.isoformat() if trx_ts else None,
+        },
         "detection": label,
-        "boxes": boxes,
-        "annotated_frame": annotated_b64,
-        "server_time": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
+        "client_id": client_id,
     }
+    if idempotency_key:
+        resp["idempotency_key"] = idempotency_key
+        resp["duplicate"] = False
+    if boxes is not None:
+        resp["boxes"] = boxes
     return jsonify(resp)
 
+def checkout_existing(idempotency_key):
+    """Respons /api/checkout untuk kunci yang sudah pernah tersimpan, atau None."""
+    with get_db() as db:
+        cursor = db.cursor()
+        row = rollup.fetch_by_key(cursor, idempotency_key)
+        cursor.close()
+    if row is None:
+        return None
+    trx_id, nama_produk, berat_kg, harga_per_kg, total_harga, trx_ts = row
+    produk = CATALOG.find_by_label(nama_produk)
+    return {
+        "status": f"✅ Transaksi {nama_produk} sudah tersimpan",
+        "receipt": {
+            "id": trx_id,
+            "kode_produk": produk["kode_produk"] if produk and produk["nama_produk"] == nama_produk else None,
+            "nama_produk": nama_produk,
+            "berat_kg": float(berat_kg),
+            "harga_per_kg": harga_per_kg,
+            "total_harga": total_harga,
+            "timestamp": trx_ts.isoformat() if trx_ts else None,
+        },
+        "idempotency_key": idempotency_key,
+        "duplicate": True,
+    }
+
+# -----------------------------
+# /metrics (format teks Prometheus)
+# -----------------------------
+metrics.Gauge("aiscale_db_pool_connections", "Koneksi pool per state",
+              lambda: {(k,): v for k, v in DB_POOL.stats().items() if k in ("size", "idle", "in_use", "waiting")},
+              ["state"])
+metrics.Gauge("aiscale_inference_queue_depth", "Frame yang menunggu di batcher",
+              lambda: INFERENCE_BATCHER.stats()["queue_depth"])
+metrics.CounterFunc("aiscale_inference_batches_total", "Jumlah batch inferensi sejak start",
+              lambda: INFERENCE_BATCHER.stats()["batches"])
+metrics.Gauge("aiscale_inference_max_side", "Sisi terpanjang frame inferensi saat ini (mode adaptif)",
+              lambda: ADAPTIVE_RES.current())
+metrics.Gauge("aiscale_model_ready", "1 bila model sudah dimuat dan warm-up", lambda: 1 if MODEL.ready else 0)
+metrics.Gauge("aiscale_frame_gate_hit_ratio", "Rasio frame yang dilayani dari cache frame gate",
+              lambda: FRAME_GATE.stats()["hit_ratio"])
+metrics.Gauge("aiscale_clients", "Client dengan status deteksi aktif", lambda: len(latest_detection))
+metrics.Gauge("aiscale_scale_connected", "1 bila timbangan terhubung", lambda: 1 if SCALE.reading().connected else 0)
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# -----------------------------
+# Health / readiness
+# -----------------------------
+def db_ready():
+    try:
+        with DB_POOL.connection(timeout=1.0) as db:
+            cur = db.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # liveness: proses hidup, tanpa query DB
+    return jsonify({
+        "status": "ok",
+        "startup_ms": STARTUP_MS,
+        "model": MODEL.state,
+        "db_pool": DB_POOL.stats(),
+        "scale": SCALE.stats(),
+        "shared_state": STATE_CLIENT.stats() if STATE_CLIENT is not None else None,
+    })
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # readiness: model sudah warm-up dan DB bisa dipakai; status timbangan dilaporkan saja
+    db_ok, db_error = db_ready()
+    ready = MODEL.ready and db_ok
+    body = {
+        "ready": ready,
+        "model": MODEL.stats(),
+        "db": {"ok": db_ok, "error": db_error, "pool": DB_POOL.stats()},
+        "scale": SCALE.stats(),
+    }
+    resp = jsonify(body)
+    if not ready:
+        resp.headers["Retry-After"] = "2"
+        return resp, 503
+    return resp
+
 # -----------------------------
 # Run app
 # -----------------------------
+_services_lock = threading.Lock()
+_services_started = False
+
+def start_services():
+    """
+    Thread latar per proses: schema, listener katalog, batcher, loader model.
+    Idempotent. Dengan preload_app gunicorn dipanggil di post_fork (thread tidak ikut fork),
+    bukan saat import di master.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    threading.Thread(target=ensure_schema, args=(DB_POOL,), name="ensure-schema", daemon=True).start()
+    threading.Thread(target=prefill_db_pool, name="db-prefill", daemon=True).start()
+    if CATALOG_LISTEN:
+        CATALOG.start_listener(DB_CONFIG)
+    INFERENCE_BATCHER.start()
+    MODEL.start()
+
+def prefill_db_pool():
+    # buka DB_POOL_MIN koneksi di proses ini (bukan di master sebelum fork: socket tidak boleh dibagi)
+    try:
+        opened = DB_POOL.prefill()
+        print("✅ DB pool: %d koneksi awal dibuka (min=%d)" % (opened, DB_POOL_MIN))
+    except (psycopg2.Error, OSError) as e:
+        print("⚠️ Peringatan: gagal membuka koneksi awal DB pool:", e)
+
+def owner_config():
+    """Konfigurasi proses owner multi-worker (sharedstate.StateOwner), diambil dari CONFIG di atas."""
+    return {
+        "scale": SCALE_CONFIG,
+        "client_state": {"ttl_s": CLIENT_STATE_TTL_S, "max_entries": CLIENT_STATE_MAX, "shards": CLIENT_STATE_SHARDS},
+        "status_stream": {
+            "enabled": STATUS_STREAM_ENABLED, "port": STATUS_STREAM_PORT,
+            "coalesce_ms": STATUS_STREAM_COALESCE_MS, "heartbeat_s": STATUS_STREAM_HEARTBEAT_S,
+        },
+        "jwt": {"secret": SECRET_KEY, "algorithm": JWT_ALGO, "cache_size": TOKEN_CACHE_SIZE},
+    }
+
+def create_app():
+    """App factory untuk gunicorn: `gunicorn -c gunicorn.conf.py "app:create_app()"`."""
+    if not sharedstate.is_preload_master():
+        start_services()
+    return app
+
+# master gunicorn (preload) tidak menjalankan thread apa pun; worker memulainya sendiri
+if not sharedstate.is_preload_master():
+    start_services()
+STARTUP_MS = round((time.perf_counter() - IMPORT_STARTED) * 1000.0, 1)
+print(f"✅ app.py siap dalam {STARTUP_MS} ms (model dimuat di background)")
+
 if __name__ == "__main__":
-    t = threading.Thread(target=read_scale_data, daemon=True)
-    t.start()
+    SCALE.start()
+    if STATUS_STREAM_ENABLED:
+        STATUS_HUB.start()
+    if MODEL_WAIT_ON_START:
+        MODEL.wait()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 4000)), debug=True, use_reloader=False)
@@ -0,0 +1,97 @@
+# cache token JWT yang sudah diverifikasi + cache baris user (TTL pendek)
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class TokenCache:
+    """
+    LRU token -> payload hasil jwt.decode. Entri tidak pernah dipakai melewati `exp` token,
+    jadi hasilnya sama dengan decode ulang, hanya tanpa biaya verifikasi HMAC per frame.
+    Token disimpan sebagai hash (token mentah tidak disimpan di memori cache).
+    """
+
+    def __init__(self, decode_fn, max_entries=1024):
+        self.decode_fn = decode_fn
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # sha256(token) -> (payload, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, token):
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                payload, exp = item
+                if exp is None or exp > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._data[key]
+            self.misses += 1
+
+        payload = self.decode_fn(token)  # raise bila invalid/expired -> tidak di-cache
+        exp = payload.get("exp")
+        with self._lock:
+            self._data[key] = (payload, float(exp) if exp is not None else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class UserCache:
+    """email -> baris users, kedaluwarsa setelah ttl_s; invalidate(email) saat user/role berubah."""
+
+    def __init__(self, ttl_s=30.0, max_entries=512):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # email -> (row, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(email)
+            if item is not None and item[1] > now:
+                self._data.move_to_end(email)
+                self.hits += 1
+                return dict(item[0])
+            if item is not None:
+                del self._data[email]
+            self.misses += 1
+            return None
+
+    def set(self, email, row):
+        with self._lock:
+            self._data[email] = (dict(row), time.monotonic() + self.ttl_s)
+            self._data.move_to_end(email)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, email=None):
+        with self._lock:
+            if email is None:
+                self._data.clear()
+            else:
+                self._data.pop(email, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "max_entries": self.max_entries, "ttl_s": self.ttl_s,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,529 @@
+# backend inferensi YOLO yang bisa dipilih lewat config:
+#   pytorch     -> models/best.pt (default, sama seperti sebelumnya)
+#   torchscript -> models/best.torchscript
+#   onnx        -> models/best.onnx              (butuh onnxruntime)
+#   openvino    -> models/best_openvino_model/   (butuh openvino)
+#   stub        -> tanpa model/ultralytics, deteksi palsu + latensi tiruan (benchmark offline)
+# Semua dimuat lewat ultralytics YOLO(...), jadi pre/post-processing dan objek Results
+# tetap sama dan summarize_result() tidak perlu tahu backend mana yang dipakai.
+#
+# CLI:
+#   python backends.py export   --backend onnx [--imgsz 640]
+#   python backends.py validate --backend onnx [--images static/assets/img] [--limit 50]
+import os
+import sys
+import time
+import glob
+import argparse
+import threading
+from collections import deque
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "models")
+SOURCE_WEIGHTS = "best.pt"
+
+BACKEND_FILES = {
+    "pytorch": "best.pt",
+    "torchscript": "best.torchscript",
+    "onnx": "best.onnx",
+    "openvino": "best_openvino_model",
+}
+# format export ultralytics untuk tiap backend hasil konversi
+EXPORT_FORMATS = {"torchscript": "torchscript", "onnx": "onnx", "openvino": "openvino"}
+# export dengan dimensi batch dinamis: InferenceBatcher mengirim sampai INFER_MAX_BATCH frame sekaligus
+DYNAMIC_EXPORTS = ("onnx", "openvino")
+
+
+def backend_path(name, model_dir=MODEL_DIR):
+    if name not in BACKEND_FILES:
+        raise ValueError(f"backend tidak dikenal: {name} (pilih: {', '.join(BACKEND_FILES)})")
+    return os.path.join(model_dir, BACKEND_FILES[name])
+
+
+def backend_config(name, env=os.environ):
+    """
+    Config per backend dari env, mis. untuk onnx:
+      INFER_IMGSZ_ONNX / INFER_IMGSZ, INFER_THREADS_ONNX / INFER_THREADS, INFER_WEIGHTS_ONNX
+    threads 0 = default runtime.
+    INFER_FIT_IMGSZ=1 -> imgsz per panggilan mengikuti frame yang sudah diperkecil (ROI/adaptif),
+    default aktif bila INFER_LATENCY_BUDGET_MS > 0. Hanya pytorch (model export ber-shape tetap).
+    """
+    suffix = name.upper()
+
+    def pick(key, default):
+        return env.get(f"{key}_{suffix}", env.get(key, default))
+
+    return {
+        "weights": env.get(f"INFER_WEIGHTS_{suffix}") or backend_path(name),
+        "imgsz": int(pick("INFER_IMGSZ", 640)),
+        "threads": int(pick("INFER_THREADS", 0)),
+        "fit_imgsz": pick("INFER_FIT_IMGSZ", "1" if float(env.get("INFER_LATENCY_BUDGET_MS", 0)) > 0 else "0") == "1",
+    }
+
+
+class LatencyStats:
+    """Latensi per panggilan predict (window terakhir) untuk membandingkan backend."""
+
+    def __init__(self, window=500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.frames = 0
+
+    def record(self, ms, frames):
+        with self._lock:
+            self._samples.append((ms, frames))
+            self.calls += 1
+            self.frames += frames
+
+    def stats(self):
+        with self._lock:
+            samples = list(self._samples)
+            calls, frames = self.calls, self.frames
+        if not samples:
+            return {"calls": calls, "frames": frames}
+        per_call = sorted(ms for ms, _ in samples)
+        total_ms = sum(ms for ms, _ in samples)
+        total_frames = sum(n for _, n in samples) or 1
+        return {
+            "calls": calls,
+            "frames": frames,
+            "avg_ms": round(total_ms / len(samples), 2),
+            "p50_ms": round(per_call[len(per_call) // 2], 2),
+            "p95_ms": round(per_call[min(len(per_call) - 1, int(len(per_call) * 0.95))], 2),
+            "max_ms": round(per_call[-1], 2),
+            "ms_per_frame": round(total_ms / total_frames, 2),
+        }
+
+
+class YoloBackend:
+    def __init__(self, name="pytorch", weights=None, imgsz=640, threads=0, conf=0.6, device="cpu", fit_imgsz=False):
+        if name not in BACKEND_FILES:
+            raise ValueError(f"backend tidak dikenal: {name}")
+        self.name = name
+        self.weights = weights or backend_path(name)
+        self.imgsz = int(imgsz)
+        self.threads = int(threads)
+        self.conf = conf
+        self.device = device
+        self.fit_imgsz = fit_imgsz and name == "pytorch"
+        self.model = None
+        self.latency = LatencyStats()
+        self.load_ms = None
+        # batch tetap model hasil export lama (mis. ONNX batch=1) -> predict() memecah batch
+        self.max_batch = None
+        self._batch_checked = False
+
+    @property
+    def names(self):
+        return self.model.names if self.model is not None else {}
+
+    def load(self, warmup=True):
+        from ultralytics import YOLO
+
+        t0 = time.perf_counter()
+        if self.threads and self.name in ("pytorch", "torchscript"):
+            import torch
+            torch.set_num_threads(self.threads)
+        self.model = YOLO(self.weights, task="detect")
+        if warmup:
+            # panggilan pertama membuat predictor ultralytics (dan session ONNX/OpenVINO)
+            import numpy as np
+            self.model(np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8),
+                       imgsz=self.imgsz, device=self.device, verbose=False)
+            if self.threads and self.name in ("onnx", "openvino"):
+                self._apply_threads()
+            self._check_batch()
+        self.load_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        return self
+
+    def _apply_threads(self):
+        # ultralytics tidak membuka opsi thread untuk ONNX/OpenVINO -> buat ulang session-nya
+        inner = getattr(getattr(self.model, "predictor", None), "model", None)
+        try:
+            if self.name == "onnx":
+                import onnxruntime as ort
+                opts = ort.SessionOptions()
+                opts.intra_op_num_threads = self.threads
+                opts.inter_op_num_threads = 1
+                providers = inner.session.get_providers()
+                inner.session = ort.InferenceSession(self.weights, sess_options=opts, providers=providers)
+            elif self.name == "openvino":
+                import openvino as ov
+                core = ov.Core()
+                xml = next(iter(sorted(glob.glob(os.path.join(self.weights, "*.xml")))))
+                inner.ov_compiled_model = core.compile_model(
+                    core.read_model(xml), "CPU",
+                    config={"PERFORMANCE_HINT": "LATENCY", "INFERENCE_NUM_THREADS": self.threads},
+                )
+        except Exception as e:
+            print(f"⚠️ Gagal set thread backend {self.name}:", e)
+
+    def _check_batch(self):
+        # hanya bisa dibaca setelah predictor ultralytics dibuat (panggilan pertama)
+        inner = getattr(getattr(self.model, "predictor", None), "model", None)
+        if inner is None:
+            return
+        self._batch_checked = True
+        dim = None
+        try:
+            if self.name == "onnx":
+                dim = inner.session.get_inputs()[0].shape[0]
+            elif self.name == "openvino":
+                dim = inner.ov_compiled_model.inputs[0].get_partial_shape()[0]
+                dim = dim.get_length() if dim.is_static else None
+        except Exception as e:
+            print(f"⚠️ Gagal membaca ukuran batch backend {self.name}:", e)
+        self.max_batch = dim if isinstance(dim, int) and dim > 0 else None
+        if self.max_batch:
+            print(f"⚠️ Backend {self.name} di-export dengan batch tetap {self.max_batch}: batch dipecah "
+                  f"(export ulang: python backends.py export --backend {self.name})")
+
+    def call_imgsz(self, frames):
+        # frame yang sudah diperkecil tidak perlu di-letterbox naik lagi ke imgsz penuh
+        if not self.fit_imgsz:
+            return self.imgsz
+        longest = max(max(f.shape[:2]) for f in frames)
+        return min(self.imgsz, max(32, -(-longest // 32) * 32))
+
+    def predict(self, frames):
+        frames = list(frames)
+        t0 = time.perf_counter()
+        imgsz = self.call_imgsz(frames)
+        results = []
+        start = 0
+        while start < len(frames):
+            # batas batch belum diketahui sebelum predictor dibuat: kirim satu frame dulu
+            step = self.max_batch or (len(frames) if self._batch_checked else 1)
+            results.extend(self.model(frames[start:start + step], conf=self.conf, imgsz=imgsz,
+                                      device=self.device, verbose=False))
+            start += step
+            if not self._batch_checked:
+                self._check_batch()
+        self.latency.record((time.perf_counter() - t0) * 1000.0, len(frames))
+        return results
+
+    __call__ = predict
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "weights": self.weights,
+            "imgsz": self.imgsz,
+            "fit_imgsz": self.fit_imgsz,
+            "threads": self.threads,
+            "max_batch": self.max_batch,
+            "loaded": self.model is not None,
+            "load_ms": self.load_ms,
+            "latency": self.latency.stats(),
+        }
+
+
+class _StubBox:
+    __slots__ = ("cls", "conf", "xyxy")
+
+    def __init__(self, cls, conf, xyxy):
+        self.cls = cls
+        self.conf = conf
+        self.xyxy = [xyxy]
+
+
+class _StubResult:
+    def __init__(self, frame, boxes):
+        self.orig_img = frame
+        self.boxes = boxes
+
+    def plot(self):
+        import cv2
+        img = self.orig_img.copy()
+        for b in self.boxes:
+            x1, y1, x2, y2 = (int(v) for v in b.xyxy[0])
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        return img
+
+
+class StubBackend:
+    """
+    Pengganti model untuk benchmark offline: satu box per frame (kelas dari rata-rata
+    kecerahan, jadi frame yang sama selalu memberi label yang sama) dan latensi
+    base_ms + per_frame_ms * jumlah frame.
+    """
+
+    name = "stub"
+
+    def __init__(self, base_ms=20.0, per_frame_ms=5.0, labels=("apel", "jeruk", "pisang"), conf=0.6):
+        self.weights = None
+        self.imgsz = 640
+        self.threads = 0
+        self.conf = conf
+        self.base_ms = base_ms
+        self.per_frame_ms = per_frame_ms
+        self.names = dict(enumerate(labels))
+        self.model = self
+        self.latency = LatencyStats()
+        self.load_ms = 0.0
+
+    def load(self, warmup=True):
+        return self
+
+    def predict(self, frames):
+        frames = list(frames)
+        t0 = time.perf_counter()
+        time.sleep((self.base_ms + self.per_frame_ms * len(frames)) / 1000.0)
+        results = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            cls = int(frame.mean()) % len(self.names)
+            box = _StubBox(cls, 0.9, [w * 0.25, h * 0.25, w * 0.75, h * 0.75])
+            results.append(_StubResult(frame, [box]))
+        self.latency.record((time.perf_counter() - t0) * 1000.0, len(frames))
+        return results
+
+    __call__ = predict
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "base_ms": self.base_ms,
+            "per_frame_ms": self.per_frame_ms,
+            "loaded": True,
+            "load_ms": self.load_ms,
+            "latency": self.latency.stats(),
+        }
+
+
+def load_backend(name, conf=0.6, warmup=True, env=os.environ):
+    """
+    Muat backend sesuai config. Bila file hasil export belum ada / runtime-nya tidak
+    terpasang, jatuh ke pytorch (best.pt) supaya aplikasi tetap jalan.
+    """
+    if name == "stub":
+        return StubBackend(base_ms=float(env.get("INFER_STUB_MS", 20)),
+                           per_frame_ms=float(env.get("INFER_STUB_PER_FRAME_MS", 5)), conf=conf)
+    cfg = backend_config(name, env)
+    if name != "pytorch" and not os.path.exists(cfg["weights"]):
+        print(f"⚠️ {cfg['weights']} tidak ada (jalankan: python backends.py export --backend {name}), pakai pytorch")
+        name, cfg = "pytorch", backend_config("pytorch", env)
+    try:
+        return YoloBackend(name, conf=conf, **cfg).load(warmup=warmup)
+    except Exception as e:
+        if name == "pytorch":
+            raise
+        print(f"⚠️ Gagal load backend {name}:", e, "-> pakai pytorch")
+        return YoloBackend("pytorch", conf=conf, **backend_config("pytorch", env)).load(warmup=warmup)
+
+
+class BackgroundLoader:
+    """
+    Muat backend di thread terpisah supaya import app.py / fork worker tidak menunggu
+    bobot model. state: pending -> loading -> ready | failed.
+    warmup_fn(backend) dijalankan sebelum state jadi ready (mis. inferensi + plot dummy).
+    """
+
+    def __init__(self, load_fn, warmup_fn=None, name="model-loader"):
+        self.load_fn = load_fn
+        self.warmup_fn = warmup_fn
+        self.name = name
+        self.state = "pending"
+        self.error = None
+        self.backend = None
+        self.ready_ms = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._t0 = time.perf_counter()
+            self.state = "loading"
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            backend = self.load_fn()
+            if self.warmup_fn is not None:
+                self.warmup_fn(backend)
+            self.backend = backend
+            self.state = "ready"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print("⚠️ Peringatan: gagal load model YOLO:", e)
+        finally:
+            self.ready_ms = round((time.perf_counter() - self._t0) * 1000.0, 1)
+            self._ready.set()
+
+    def get(self, timeout=0.0):
+        """Backend bila sudah siap, selain itu None (tunggu paling lama `timeout` detik)."""
+        if self.state != "ready" and timeout:
+            self._ready.wait(timeout)
+        return self.backend
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def stats(self):
+        out = {"state": self.state, "ready_after_ms": self.ready_ms, "error": self.error}
+        if self.backend is not None:
+            out.update(self.backend.stats())
+        return out
+
+
+# -----------------------------
+# export & validasi
+# -----------------------------
+def export(name, imgsz=640, model_dir=MODEL_DIR):
+    from ultralytics import YOLO
+
+    if name not in EXPORT_FORMATS:
+        raise ValueError(f"backend {name} tidak perlu/bisa di-export")
+    source = os.path.join(model_dir, SOURCE_WEIGHTS)
+    out = YOLO(source).export(format=EXPORT_FORMATS[name], imgsz=imgsz, dynamic=name in DYNAMIC_EXPORTS)
+    print(f"✅ Export {name}: {out}")
+    return out
+
+
+def _iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _boxes(result):
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return []
+    xyxy = boxes.xyxy.cpu().numpy().tolist()
+    cls = boxes.cls.cpu().numpy().astype(int).tolist()
+    conf = boxes.conf.cpu().numpy().tolist()
+    return list(zip(cls, conf, xyxy))
+
+
+def compare(reference, candidate, iou_threshold=0.5):
+    """Cocokkan box per kelas (greedy IoU). Return (matched, missing, extra, max_conf_diff)."""
+    ref, cand = _boxes(reference), _boxes(candidate)
+    used = set()
+    matched = 0
+    max_conf_diff = 0.0
+    for cls, conf, box in ref:
+        best, best_iou = None, iou_threshold
+        for j, (c_cls, _, c_box) in enumerate(cand):
+            if j in used or c_cls != cls:
+                continue
+            iou = _iou(box, c_box)
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            used.add(best)
+            matched += 1
+            max_conf_diff = max(max_conf_diff, abs(conf - cand[best][1]))
+    return matched, len(ref) - matched, len(cand) - len(used), max_conf_diff
+
+
+def validate(name, images, imgsz=640, conf=0.25, iou_threshold=0.5, threads=0, batch=4):
+    import cv2
+
+    reference = YoloBackend("pytorch", imgsz=imgsz, conf=conf, threads=threads).load()
+    candidate = YoloBackend(name, imgsz=imgsz, conf=conf, threads=threads).load()
+    totals = {"images": 0, "ref_boxes": 0, "matched": 0, "missing": 0, "extra": 0, "max_conf_diff": 0.0}
+    frames = []
+    singles = []
+    for path in images:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        ref = reference.predict([frame])[0]
+        cand = candidate.predict([frame])[0]
+        if len(frames) < batch:
+            frames.append(frame)
+            singles.append(cand)
+        matched, missing, extra, conf_diff = compare(ref, cand, iou_threshold)
+        totals["images"] += 1
+        totals["ref_boxes"] += matched + missing
+        totals["matched"] += matched
+        totals["missing"] += missing
+        totals["extra"] += extra
+        totals["max_conf_diff"] = max(totals["max_conf_diff"], round(conf_diff, 4))
+        if missing or extra:
+            print(f"  ≠ {os.path.basename(path)}: missing={missing} extra={extra}")
+    totals["recall_vs_pytorch"] = round(totals["matched"] / totals["ref_boxes"], 4) if totals["ref_boxes"] else 1.0
+    # jalur InferenceBatcher: beberapa frame dalam satu panggilan harus sama dengan satu per satu
+    totals["batch_ok"] = True
+    if frames:
+        n = len(frames)
+        frames += [frames[i % n] for i in range(n, batch)]
+        singles += [singles[i % n] for i in range(n, batch)]
+        try:
+            batched = candidate.predict(frames)
+            for single, result in zip(singles, batched):
+                matched, missing, extra, _ = compare(single, result, iou_threshold)
+                if missing or extra:
+                    totals["batch_ok"] = False
+                    print(f"  ≠ batch {len(frames)}: missing={missing} extra={extra}")
+        except Exception as e:
+            totals["batch_ok"] = False
+            print(f"  ❌ batch {len(frames)} frame gagal:", e)
+    return totals, reference.stats(), candidate.stats()
+
+
+def _list_images(folder, limit):
+    paths = []
+    for ext in ("jpg", "jpeg", "png", "webp"):
+        paths.extend(glob.glob(os.path.join(folder, f"*.{ext}")))
+    return sorted(paths)[:limit] if limit else sorted(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export & validasi backend inferensi YOLO")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_export = sub.add_parser("export", help="export models/best.pt ke backend lain")
+    p_export.add_argument("--backend", required=True, choices=sorted(EXPORT_FORMATS))
+    p_export.add_argument("--imgsz", type=int, default=640)
+
+    p_val = sub.add_parser("validate", help="bandingkan hasil backend dengan PyTorch + latensi")
+    p_val.add_argument("--backend", required=True, choices=sorted(BACKEND_FILES))
+    p_val.add_argument("--images", default=os.path.join("static", "assets", "img"))
+    p_val.add_argument("--limit", type=int, default=50)
+    p_val.add_argument("--imgsz", type=int, default=640)
+    p_val.add_argument("--conf", type=float, default=0.25)
+    p_val.add_argument("--iou", type=float, default=0.5)
+    p_val.add_argument("--threads", type=int, default=0)
+    p_val.add_argument("--batch", type=int, default=4, help="ukuran batch untuk cek jalur batch (> 1)")
+    p_val.add_argument("--min-recall", type=float, default=0.95)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "export":
+        export(args.backend, imgsz=args.imgsz)
+        return 0
+
+    images = _list_images(args.images, args.limit)
+    if not images:
+        print(f"❌ Tidak ada gambar di {args.images}")
+        return 1
+    totals, ref_stats, cand_stats = validate(args.backend, images, imgsz=args.imgsz, conf=args.conf,
+                                             iou_threshold=args.iou, threads=args.threads, batch=max(2, args.batch))
+    print("Hasil validasi:", totals)
+    for s in (ref_stats, cand_stats):
+        print(f"  {s['backend']:<12} latency: {s['latency']}")
+    ok = totals["recall_vs_pytorch"] >= args.min_recall and totals["batch_ok"]
+    if ok:
+        print("✅ Lolos")
+    elif not totals["batch_ok"]:
+        print("❌ Hasil batch berbeda dari frame tunggal / batch gagal")
+    else:
+        print(f"❌ Recall di bawah {args.min_recall}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# micro-batching: gabungkan frame dari banyak client jadi satu panggilan model([...])
+import time
+import itertools
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+
+class QueueFull(Exception):
+    """Antrian inferensi penuh; retry_after_s = perkiraan waktu sampai antrian longgar."""
+
+    def __init__(self, retry_after_s):
+        super().__init__("inference queue full")
+        self.retry_after_s = retry_after_s
+
+
+class Superseded(Exception):
+    """Frame dibuang karena client yang sama sudah mengirim frame lebih baru."""
+
+
+class Expired(Exception):
+    """Frame tidak sempat diproses sebelum deadline-nya (pemanggil sudah tidak menunggu)."""
+
+
+class InferenceBatcher:
+    """
+    Antrian inferensi bersama untuk semua client.
+    - submit(frame, key=client_id) -> Future, hasilnya milik pemanggil masing-masing
+    - antrian per key, dilayani round-robin: satu client yang burst tidak membuat
+      frame client lain menunggu di belakangnya
+    - drop_superseded: frame lama yang belum diproses dibuang (Superseded) saat key
+      yang sama mengirim frame baru -> hanya frame terbaru per client yang diinferensi
+    - total antrian dibatasi max_queue; bila penuh submit() raise QueueFull
+    - item dengan deadline yang sudah lewat / future yang dibatalkan tidak dijalankan
+    - worker mengumpulkan sampai `max_batch_size` item atau sampai item tertua
+      sudah menunggu `max_wait_ms`, lalu memanggil infer_fn(list_of_items) sekali
+    - infer_fn harus mengembalikan list hasil dengan urutan yang sama
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=10.0, max_queue=64,
+                 drop_superseded=True, name="inference-batcher", autostart=True):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.drop_superseded = drop_superseded
+
+        self._queues = OrderedDict()  # key -> deque[(item, future, enqueued_at, deadline)]; urutan = giliran
+        self._depth = 0
+        self._anon = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._stopped = False
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = {}
+        self._queue_delay_total_s = 0.0
+        self._queue_delay_max_s = 0.0
+        self._infer_total_s = 0.0
+        self._last_batch_size = 0
+        self._last_infer_ms = 0.0
+        self._rejected = 0
+        self._superseded = 0
+        self._expired = 0
+        self._cancelled = 0
+
+        self.name = name
+        self._thread = None
+        if autostart:
+            self.start()
+
+    def start(self):
+        # autostart=False: thread dimulai belakangan (mis. di worker gunicorn setelah fork)
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def retry_after_s(self):
+        """Perkiraan waktu menghabiskan antrian sekarang (dipakai untuk Retry-After / interval kiosk)."""
+        with self._stats_lock:
+            per_batch = self._infer_total_s / self._batches if self._batches else 0.1
+        with self._cond:
+            depth = self._depth
+        batches = -(-depth // self.max_batch_size)  # ceil
+        return max(self.max_wait_s, batches * per_batch)
+
+    def submit(self, item, key=None, timeout_s=None):
+        fut = Future()
+        now = time.monotonic()
+        deadline = now + timeout_s if timeout_s else None
+        dropped = []
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("batcher stopped")
+            if key is None:
+                key = ("anon", next(self._anon))
+            queue = self._queues.get(key)
+            if queue and self.drop_superseded:
+                dropped = list(queue)
+                queue.clear()
+                self._depth -= len(dropped)
+            if self._depth >= self.max_queue:
+                # kembalikan yang tadi dibuang: frame baru ini yang ditolak, bukan yang lama
+                if dropped:
+                    queue.extend(dropped)
+                    self._depth += len(dropped)
+                    dropped = []
+                full = True
+            else:
+                full = False
+                if queue is None:
+                    queue = self._queues[key] = deque()
+                queue.append((item, fut, now, deadline))
+                self._depth += 1
+                self._cond.notify()
+        if full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise QueueFull(self.retry_after_s())
+        if dropped:
+            with self._stats_lock:
+                self._superseded += len(dropped)
+            for _, old, _, _ in dropped:
+                if old.set_running_or_notify_cancel():
+                    old.set_exception(Superseded())
+        return fut
+
+    def _oldest_enqueued_locked(self):
+        return min(q[0][2] for q in self._queues.values() if q)
+
+    def _pop_round_robin_locked(self, n):
+        # satu item dari tiap client bergiliran; client yang masih punya antrian pindah ke belakang
+        batch = []
+        while len(batch) < n and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            batch.append(queue.popleft())
+            self._depth -= 1
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+        return batch
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._depth and not self._stopped:
+                self._cond.wait()
+            if not self._depth:
+                return None
+            deadline = self._oldest_enqueued_locked() + self.max_wait_s
+            while self._depth < self.max_batch_size and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+                if not self._depth:
+                    break
+            return self._pop_round_robin_locked(self.max_batch_size)
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            # buang yang sudah dibatalkan / lewat deadline: tidak ada yang menunggu hasilnya
+            now = time.monotonic()
+            live = []
+            expired = cancelled = 0
+            for entry in batch:
+                fut, deadline = entry[1], entry[3]
+                if not fut.set_running_or_notify_cancel():
+                    cancelled += 1
+                elif deadline is not None and now >= deadline:
+                    fut.set_exception(Expired())
+                    expired += 1
+                else:
+                    live.append(entry)
+            if expired or cancelled:
+                with self._stats_lock:
+                    self._expired += expired
+                    self._cancelled += cancelled
+            batch = live
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            delays = [started - entry[2] for entry in batch]
+            try:
+                results = self.infer_fn([entry[0] for entry in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError("infer_fn returned %d results for %d items" % (len(results), len(batch)))
+            except Exception as e:
+                results = None
+                error = e
+            infer_s = time.monotonic() - started
+            # timing per item, dibaca pemanggil setelah fut.result() (instrumentasi per stage)
+            for entry, delay in zip(batch, delays):
+                fut = entry[1]
+                fut.queue_delay_s = delay
+                fut.infer_s = infer_s
+                fut.batch_size = len(batch)
+            if results is None:
+                for entry in batch:
+                    entry[1].set_exception(error)
+            else:
+                for entry, res in zip(batch, results):
+                    entry[1].set_result(res)
+
+            with self._stats_lock:
+                n = len(batch)
+                self._batches += 1
+                self._items += n
+                self._batch_sizes[n] = self._batch_sizes.get(n, 0) + 1
+                self._queue_delay_total_s += sum(delays)
+                self._queue_delay_max_s = max(self._queue_delay_max_s, max(delays))
+                self._infer_total_s += infer_s
+                self._last_batch_size = n
+                self._last_infer_ms = infer_s * 1000.0
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            depth = self._depth
+            clients = len(self._queues)
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait_s * 1000.0, 3),
+                "max_queue": self.max_queue,
+                "queue_depth": depth,
+                "queued_clients": clients,
+                "batches": batches,
+                "items": items,
+                "avg_batch_size": round(items / batches, 3) if batches else 0.0,
+                "last_batch_size": self._last_batch_size,
+                "batch_size_hist": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "avg_queue_delay_ms": round(1000.0 * self._queue_delay_total_s / items, 3) if items else 0.0,
+                "max_queue_delay_ms": round(1000.0 * self._queue_delay_max_s, 3),
+                "avg_infer_ms": round(1000.0 * self._infer_total_s / batches, 3) if batches else 0.0,
+                "last_infer_ms": round(self._last_infer_ms, 3),
+                "rejected": self._rejected,
+                "superseded": self._superseded,
+                "expired": self._expired,
+                "cancelled": self._cancelled,
+            }
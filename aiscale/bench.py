@@ -0,0 +1,419 @@
+# benchmark offline untuk jalur deteksi & CRUD:
+#   detect_frame      POST /api/detect_frame (JSON base64)
+#   detect_frame_raw  POST /api/detect_frame/raw (JPEG mentah)
+#   process_frame     process_frame_yolo() langsung (tanpa HTTP/batcher)
+#   riwayat           GET /api/riwayat?limit=<n>
+#   produk            GET /api/produk
+# N kiosk disimulasikan sebagai thread, masing-masing client_id sendiri, frame dari
+# static/assets/img diputar bergiliran. Hasil: JSON (throughput, p50/p95/p99 per endpoint).
+#
+#   python bench.py --kiosks 4 --duration 20 --out bench.json
+#   python bench.py --reset-db --seed-transaksi 20000      # DB sekali pakai dari ujicobamodelai.sql
+#   python bench.py --compare bench-old.json --out bench-new.json
+#
+# Default: backend "stub" (tanpa model), DB_NAME=aiscale_bench, server in-process (Flask test client).
+# --url http://host:4000 -> jalankan ke server yang sudah berjalan (process_frame dilewati).
+import os
+import sys
+import json
+import time
+import glob
+import uuid
+import base64
+import shutil
+import platform
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DUMP = os.path.join(HERE, "..", "ujicobamodelai.sql")
+ENDPOINTS = ("detect_frame", "detect_frame_raw", "process_frame", "riwayat", "produk")
+
+BENCH_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS produk (
+        kode_produk SERIAL PRIMARY KEY,
+        nama_produk VARCHAR(100),
+        harga_per_kg INTEGER,
+        path_gambar VARCHAR
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS transaksi (
+        id SERIAL PRIMARY KEY,
+        nama_produk VARCHAR(100),
+        berat_kg NUMERIC(10,3),
+        harga_per_kg INTEGER,
+        total_harga INTEGER,
+        timestamp TIMESTAMPTZ DEFAULT now()
+    )
+    """,
+]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(samples, elapsed_s):
+    # samples: [(latency_ms, status)]
+    lat = sorted(ms for ms, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sum(n for s, n in statuses.items() if s.startswith("2"))
+
+    def r(x):
+        return round(x, 2) if x is not None else None
+
+    return {
+        "requests": len(samples),
+        "ok": ok,
+        "errors": len(samples) - ok,
+        "status": statuses,
+        "elapsed_s": round(elapsed_s, 3),
+        "throughput_rps": round(ok / elapsed_s, 2) if elapsed_s > 0 else 0.0,
+        "mean_ms": r(sum(lat) / len(lat)) if lat else None,
+        "p50_ms": r(percentile(lat, 50)),
+        "p95_ms": r(percentile(lat, 95)),
+        "p99_ms": r(percentile(lat, 99)),
+        "max_ms": r(lat[-1]) if lat else None,
+    }
+
+
+# -----------------------------
+# DB sekali pakai
+# -----------------------------
+def db_config(args):
+    return {
+        "host": os.environ.get("DB_HOST", "localhost"),
+        "port": int(os.environ.get("DB_PORT", 5432)),
+        "user": os.environ.get("DB_USER", "postgres"),
+        "password": os.environ.get("DB_PASS", "gajahbengkak"),
+        "dbname": args.db_name,
+    }
+
+
+def prepare_db(args):
+    import psycopg2
+
+    cfg = db_config(args)
+    if args.reset_db:
+        admin = psycopg2.connect(**dict(cfg, dbname="postgres"))
+        admin.autocommit = True
+        cur = admin.cursor()
+        cur.execute(f'DROP DATABASE IF EXISTS "{args.db_name}"')
+        cur.execute(f'CREATE DATABASE "{args.db_name}"')
+        cur.close()
+        admin.close()
+        restore_dump(args, cfg)
+
+    conn = psycopg2.connect(**cfg)
+    cur = conn.cursor()
+    for sql in BENCH_TABLES_SQL:
+        cur.execute(sql)
+    cur.execute("SELECT count(*) FROM produk")
+    if cur.fetchone()[0] == 0:
+        cur.execute("INSERT INTO produk (nama_produk, harga_per_kg, path_gambar) VALUES "
+                    "('apel', 30000, NULL), ('jeruk', 25000, NULL), ('pisang', 18000, NULL)")
+    cur.execute("SELECT count(*) FROM transaksi")
+    missing = args.seed_transaksi - cur.fetchone()[0]
+    if missing > 0:
+        # data deterministik: produk bergiliran, tersebar mundur 1 menit per baris
+        cur.execute(
+            """
+            INSERT INTO transaksi (nama_produk, berat_kg, harga_per_kg, total_harga, timestamp)
+            SELECT (ARRAY['apel','jeruk','pisang'])[1 + g %% 3],
+                   round((0.1 + (g %% 250) / 100.0)::numeric, 3),
+                   (ARRAY[30000,25000,18000])[1 + g %% 3],
+                   round((0.1 + (g %% 250) / 100.0) * (ARRAY[30000,25000,18000])[1 + g %% 3]),
+                   now() - g * interval '1 minute'
+            FROM generate_series(1, %s) AS g
+            """,
+            (missing,),
+        )
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def restore_dump(args, cfg):
+    if not args.dump or not os.path.exists(args.dump):
+        print("⚠️ Dump tidak ditemukan, DB diisi data sintetis saja")
+        return
+    pg_restore = shutil.which("pg_restore")
+    if not pg_restore:
+        print("⚠️ pg_restore tidak ada di PATH, DB diisi data sintetis saja")
+        return
+    env = dict(os.environ, PGPASSWORD=cfg["password"])
+    cmd = [pg_restore, "--no-owner", "--no-privileges", "-h", cfg["host"], "-p", str(cfg["port"]),
+           "-U", cfg["user"], "-d", cfg["dbname"], args.dump]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        # pg_restore mengembalikan != 0 juga untuk warning (mis. role tidak ada)
+        print("⚠️ pg_restore:", proc.stderr.strip().splitlines()[-1:] or proc.returncode)
+
+
+# -----------------------------
+# transport
+# -----------------------------
+class InProcessClient:
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        resp = self.client.open(path, method=method, data=body, headers=headers or {})
+        resp.get_data()
+        return resp.status_code
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None, headers=None):
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+        except Exception:
+            return 0
+
+
+# -----------------------------
+# skenario
+# -----------------------------
+def load_frames(folder, limit):
+    paths = []
+    for ext in ("jpg", "jpeg"):
+        paths.extend(glob.glob(os.path.join(folder, f"*.{ext}")))
+    paths = sorted(paths)[:limit]
+    frames = []
+    for p in paths:
+        with open(p, "rb") as f:
+            frames.append(f.read())
+    return frames
+
+
+def make_request_fn(endpoint, args, token, frames, app_module):
+    auth = {"Authorization": f"Bearer {token}"}
+    if endpoint == "detect_frame":
+        bodies = [json.dumps({"frame": "data:image/jpeg;base64," + base64.b64encode(f).decode("ascii"),
+                              "annotate": args.annotate}).encode("utf-8") for f in frames]
+
+        def fn(client, kiosk_id, i):
+            body = bodies[i % len(bodies)]
+            # client_id per kiosk disisipkan tanpa re-encode frame
+            body = body[:-1] + f',"client_id":"{kiosk_id}"}}'.encode("utf-8")
+            return client.request("POST", "/api/detect_frame", body, dict(auth, **{"Content-Type": "application/json"}))
+        return fn
+
+    if endpoint == "detect_frame_raw":
+        mode = "jpeg" if args.annotate else "json"
+
+        def fn(client, kiosk_id, i):
+            headers = dict(auth, **{"Content-Type": "image/jpeg", "X-Client-Id": kiosk_id})
+            return client.request("POST", f"/api/detect_frame/raw?response={mode}", frames[i % len(frames)], headers)
+        return fn
+
+    if endpoint == "process_frame":
+        import cv2
+        import numpy as np
+        decoded = [cv2.imdecode(np.frombuffer(f, np.uint8), cv2.IMREAD_COLOR) for f in frames]
+
+        def fn(client, kiosk_id, i):
+            app_module.process_frame_yolo(decoded[i % len(decoded)], annotate=args.annotate)
+            return 200
+        return fn
+
+    if endpoint == "riwayat":
+        def fn(client, kiosk_id, i):
+            return client.request("GET", f"/api/riwayat?limit={args.riwayat_limit}", headers=auth)
+        return fn
+
+    if endpoint == "produk":
+        def fn(client, kiosk_id, i):
+            return client.request("GET", "/api/produk", headers=auth)
+        return fn
+
+    raise ValueError(endpoint)
+
+
+def run_scenario(endpoint, request_fn, make_client, args):
+    samples = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.kiosks + 1)
+    interval = 1.0 / args.fps if args.fps > 0 and endpoint.startswith("detect") else 0.0
+
+    def kiosk(n):
+        client = make_client()
+        kiosk_id = f"bench-{n}-{uuid.uuid4().hex[:8]}"
+        local = []
+        start_gate.wait()
+        deadline = time.perf_counter() + args.duration
+        i = n  # kiosk mulai dari frame berbeda
+        next_at = time.perf_counter()
+        while time.perf_counter() < deadline:
+            if args.requests and len(local) >= args.requests:
+                break
+            if interval:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_at += interval
+            t0 = time.perf_counter()
+            status = request_fn(client, kiosk_id, i)
+            local.append(((time.perf_counter() - t0) * 1000.0, status))
+            i += 1
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=kiosk, args=(n,), daemon=True) for n in range(args.kiosks)]
+    for t in threads:
+        t.start()
+    start_gate.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - t0)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(baseline, current):
+    print(f"{'endpoint':<18}{'rps':>10}{'Δrps%':>9}{'p95 ms':>10}{'Δp95%':>9}")
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<18}{cur['throughput_rps']:>10}{'-':>9}{cur['p95_ms']:>10}{'-':>9}")
+            continue
+
+        def delta(a, b):
+            return f"{(b - a) / a * 100:+.1f}" if a and b is not None else "-"
+
+        print(f"{name:<18}{cur['throughput_rps']:>10}{delta(base['throughput_rps'], cur['throughput_rps']):>9}"
+              f"{cur['p95_ms']:>10}{delta(base['p95_ms'], cur['p95_ms']):>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark latensi/throughput aiscale (offline)")
+    parser.add_argument("--kiosks", type=int, default=4, help="jumlah kiosk (thread) bersamaan")
+    parser.add_argument("--duration", type=float, default=10.0, help="detik per endpoint")
+    parser.add_argument("--requests", type=int, default=0, help="batas request per kiosk (0 = sampai duration)")
+    parser.add_argument("--fps", type=float, default=16.0, help="laju frame per kiosk untuk detect_* (0 = secepatnya)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--images", default=os.path.join(HERE, "static", "assets", "img"))
+    parser.add_argument("--max-images", type=int, default=20)
+    parser.add_argument("--annotate", action="store_true", help="minta gambar anotasi (plot + encode)")
+    parser.add_argument("--riwayat-limit", type=int, default=50)
+    parser.add_argument("--backend", default="stub", help="INFER_BACKEND (stub|pytorch|onnx|openvino|torchscript)")
+    parser.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", "aiscale_bench"))
+    parser.add_argument("--reset-db", action="store_true", help="DROP/CREATE DB lalu restore --dump")
+    parser.add_argument("--dump", default=DEFAULT_DUMP)
+    parser.add_argument("--seed-transaksi", type=int, default=10000)
+    parser.add_argument("--url", help="server yang sudah berjalan (default: in-process)")
+    parser.add_argument("--out", help="file JSON hasil (default: stdout)")
+    parser.add_argument("--compare", help="JSON hasil sebelumnya untuk dibandingkan")
+    args = parser.parse_args(argv)
+    # app.py dijalankan dari folder aiscale (chdir di bawah) -> path output dibuat absolut dulu
+    args.out = os.path.abspath(args.out) if args.out else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"endpoint tidak dikenal: {', '.join(sorted(unknown))}")
+    frames = load_frames(args.images, args.max_images)
+    if not frames:
+        parser.error(f"tidak ada JPEG di {args.images}")
+
+    # config app harus di-set sebelum import app.py
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["INFER_BACKEND"] = args.backend
+    os.environ.setdefault("SIMULATE_SCALE", "1")
+    os.environ.setdefault("STATUS_STREAM_ENABLED", "0")
+    os.environ.setdefault("CATALOG_LISTEN", "0")
+
+    app_module = None
+    if args.url:
+        endpoints = [e for e in endpoints if e != "process_frame"]
+        import jwt
+        from datetime import datetime, timedelta, timezone
+        token = jwt.encode({"email": "bench@aiscale.local",
+                            "exp": datetime.now(timezone.utc) + timedelta(hours=1)},
+                           os.environ.get("SECRET_KEY", "super-secret-dev-key"), algorithm="HS256")
+        make_client = lambda: HttpClient(args.url)
+    else:
+        prepare_db(args)
+        sys.path.insert(0, HERE)
+        os.chdir(HERE)
+        import app as app_module
+        app_module.MODEL.wait(300)
+        if not app_module.MODEL.ready:
+            print("❌ Model tidak siap:", app_module.MODEL.stats())
+            return 1
+        token = app_module.create_token("bench@aiscale.local")
+        make_client = lambda: InProcessClient(app_module.app)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+            "target": args.url or "in-process",
+            "kiosks": args.kiosks,
+            "duration_s": args.duration,
+            "fps": args.fps,
+            "annotate": args.annotate,
+            "frames": len(frames),
+            "seed_transaksi": args.seed_transaksi,
+        },
+        "results": {},
+    }
+    for endpoint in endpoints:
+        fn = make_request_fn(endpoint, args, token, frames, app_module)
+        result = run_scenario(endpoint, fn, make_client, args)
+        report["results"][endpoint] = result
+        print(f"  {endpoint:<18} {result['throughput_rps']:>8} rps  p50={result['p50_ms']} "
+              f"p95={result['p95_ms']} p99={result['p99_ms']} ms  status={result['status']}", file=sys.stderr)
+
+    if app_module is not None:
+        report["inference"] = app_module.INFERENCE_BATCHER.stats()
+        report["db_pool"] = app_module.DB_POOL.stats()
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# cache katalog produk di memori proses: JSON sudah diserialisasi + ETag per versi
+import json
+import time
+import uuid
+import select
+import decimal
+import hashlib
+import threading
+from collections import namedtuple
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.extensions
+
+NOTIFY_CHANNEL = "produk_changed"
+
+SELECT_PRODUK_SQL = "SELECT kode_produk, nama_produk, harga_per_kg, path_gambar FROM produk ORDER BY kode_produk ASC;"
+SELECT_ONE_PRODUK_SQL = "SELECT kode_produk, nama_produk, harga_per_kg, path_gambar FROM produk WHERE kode_produk = %s;"
+
+CatalogSnapshot = namedtuple("CatalogSnapshot", "items list_body list_etag item_bodies by_label")
+
+
+def _dumps(obj):
+    # sama dengan output jsonify (sort_keys, ascii) supaya response tidak berubah
+    return json.dumps(obj, sort_keys=True, ensure_ascii=True, separators=(",", ":")).encode("utf-8")
+
+
+def _etag(body):
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+def normalize_produk(row):
+    row = dict(row)
+    if isinstance(row.get("harga_per_kg"), decimal.Decimal):
+        row["harga_per_kg"] = float(row["harga_per_kg"])
+    return row
+
+
+def label_key(name):
+    # label model vs nama_produk: cocok tanpa beda huruf besar/kecil & spasi berlebih
+    return " ".join(str(name or "").lower().split())
+
+
+def notify_changed(cur, kode_produk, token):
+    # dikirim dalam transaksi yang sama dengan perubahan -> baru terkirim saat commit
+    cur.execute("SELECT pg_notify(%s, %s);", (NOTIFY_CHANNEL, f"{token}:{kode_produk}"))
+
+
+class ProductCatalog:
+    """
+    - dimuat sekali dari DB (lazy), lalu dilayani dari memori
+    - get_all()/get_one() -> (body_bytes, etag)
+    - find_by_label(label) -> row produk untuk label deteksi (indeks dibangun bersama snapshot)
+    - refresh(kode_produk) dipanggil route mutasi setelah commit: baris dibaca ulang dari DB
+      (bukan baris versi pemanggil), jadi edit bersamaan tidak bisa masuk cache dengan urutan terbalik
+    - start_listener(): LISTEN produk_changed supaya worker lain ikut invalidasi
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.token = uuid.uuid4().hex  # penanda proses ini, notifikasi sendiri diabaikan
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loads = 0
+        self._invalidations = 0
+        self._remote_invalidations = 0
+        self._listener = None
+        self._stopped = threading.Event()
+
+    # -----------------------------
+    # snapshot
+    # -----------------------------
+    def _build(self, rows):
+        items = {r["kode_produk"]: r for r in sorted(rows, key=lambda r: r["kode_produk"])}
+        list_body = _dumps(list(items.values()))
+        item_bodies = {}
+        for kode, r in items.items():
+            body = _dumps(r)
+            item_bodies[kode] = (body, _etag(body))
+        by_label = {}
+        for r in items.values():
+            # nama kembar: kode_produk terkecil yang dipakai
+            by_label.setdefault(label_key(r.get("nama_produk")), r)
+        return CatalogSnapshot(items, list_body, _etag(list_body), item_bodies, by_label)
+
+    def _load_locked(self):
+        with self.pool.connection() as db:
+            cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(SELECT_PRODUK_SQL)
+            rows = [normalize_produk(r) for r in cur.fetchall()]
+            cur.close()
+        self._loads += 1
+        return self._build(rows)
+
+    def snapshot(self):
+        snap = self._snapshot
+        if snap is None:
+            with self._lock:
+                snap = self._snapshot
+                if snap is None:
+                    snap = self._snapshot = self._load_locked()
+        return snap
+
+    def get_all(self):
+        snap = self.snapshot()
+        return snap.list_body, snap.list_etag
+
+    def get_one(self, kode_produk):
+        return self.snapshot().item_bodies.get(kode_produk)
+
+    def get_row(self, kode_produk):
+        return self.snapshot().items.get(kode_produk)
+
+    def find_by_label(self, label):
+        return self.snapshot().by_label.get(label_key(label))
+
+    # -----------------------------
+    # refresh / invalidation
+    # -----------------------------
+    def refresh(self, kode_produk):
+        # baca + terapkan di bawah lock: urutan penerapan = urutan baca, dan tiap baca melihat
+        # commit terbaru -> cache tidak pernah mundur ke versi yang lebih lama
+        with self._lock:
+            if self._snapshot is None:
+                return
+            try:
+                with self.pool.connection() as db:
+                    cur = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                    cur.execute(SELECT_ONE_PRODUK_SQL, (kode_produk,))
+                    row = cur.fetchone()
+                    cur.close()
+            except (psycopg2.Error, OSError) as e:
+                print("⚠️ Gagal memuat ulang produk %s, cache katalog di-reset:" % kode_produk, e)
+                self._snapshot = None
+                self._invalidations += 1
+                return
+            items = dict(self._snapshot.items)
+            if row is None:
+                items.pop(kode_produk, None)
+            else:
+                items[kode_produk] = normalize_produk(row)
+            self._snapshot = self._build(items.values())
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._invalidations += 1
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "loaded": snap is not None,
+            "items": len(snap.items) if snap else 0,
+            "etag": snap.list_etag if snap else None,
+            "loads": self._loads,
+            "invalidations": self._invalidations,
+            "remote_invalidations": self._remote_invalidations,
+            "listening": bool(self._listener and self._listener.is_alive()),
+        }
+
+    # -----------------------------
+    # cross-process sync (LISTEN/NOTIFY)
+    # -----------------------------
+    def start_listener(self, config):
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._listen_loop, args=(dict(config),),
+                                          name="catalog-listener", daemon=True)
+        self._listener.start()
+
+    def stop_listener(self):
+        self._stopped.set()
+
+    def _listen_loop(self, config):
+        backoff = 1.0
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**config)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                # notifikasi selama terputus bisa hilang -> anggap cache basi
+                self.invalidate()
+                backoff = 1.0
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], 30.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    changed = False
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        if not n.payload.startswith(self.token + ":"):
+                            changed = True
+                    if changed:
+                        self._remote_invalidations += 1
+                        self.invalidate()
+            except Exception as e:
+                print("⚠️ Listener katalog produk terputus:", e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
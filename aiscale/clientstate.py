@@ -0,0 +1,123 @@
+# penyimpanan state per client_id: thread-safe, TTL + batas LRU, lock dipecah per shard
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class _Shard:
+    __slots__ = ("lock", "data", "evictions", "expirations")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = OrderedDict()  # key -> (value, expires_at); urutan tulis (terlama di depan)
+        self.evictions = 0
+        self.expirations = 0
+
+
+class ClientStateStore:
+    """
+    Pengganti dict global seperti latest_detection / client_last_ts.
+    - entri kedaluwarsa setelah ttl_s tanpa ditulis ulang
+    - tiap shard dibatasi max_entries / shards; bila penuh entri yang paling lama
+      tidak ditulis dibuang (LRU berdasarkan penulisan)
+    - key di-hash ke salah satu dari `shards` lock, jadi client berbeda jarang saling menunggu
+    """
+
+    def __init__(self, ttl_s=600.0, max_entries=10000, shards=16, name="clients"):
+        self.ttl_s = float(ttl_s)
+        self.shards = max(1, int(shards))
+        self.max_per_shard = max(1, int(max_entries) // self.shards)
+        self.name = name
+        self._shards = [_Shard() for _ in range(self.shards)]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % self.shards]
+
+    def _prune_locked(self, shard, now):
+        # buang entri kedaluwarsa di depan (LRU) + entri lebih dari kapasitas
+        data = shard.data
+        expired = evicted = 0
+        while data:
+            key, (_, expires_at) = next(iter(data.items()))
+            if expires_at > now and len(data) <= self.max_per_shard:
+                break
+            data.popitem(last=False)
+            if expires_at <= now:
+                expired += 1
+            else:
+                evicted += 1
+        shard.expirations += expired
+        shard.evictions += evicted
+
+    def set(self, key, value):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            shard.data[key] = (value, now + self.ttl_s)
+            shard.data.move_to_end(key)
+            self._prune_locked(shard, now)
+
+    __setitem__ = set
+
+    def get(self, key, default=None):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            item = shard.data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at <= now:
+                del shard.data[key]
+                shard.expirations += 1
+                return default
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def pop(self, key, default=None):
+        shard = self._shard(key)
+        with shard.lock:
+            item = shard.data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def check_interval(self, key, min_interval_s, now=None):
+        """
+        Rate limit atomik: True (dan catat waktu sekarang) bila panggilan terakhir key
+        sudah >= min_interval_s yang lalu; False bila terlalu cepat.
+        """
+        now = time.time() if now is None else now
+        shard = self._shard(key)
+        mono = time.monotonic()
+        with shard.lock:
+            item = shard.data.get(key)
+            if item is not None and item[1] > mono and now - item[0] < min_interval_s:
+                return False
+            shard.data[key] = (now, mono + self.ttl_s)
+            shard.data.move_to_end(key)
+            self._prune_locked(shard, mono)
+        return True
+
+    def sweep(self):
+        now = time.monotonic()
+        for shard in self._shards:
+            with shard.lock:
+                # TTL diperbarui setiap set() -> data juga terurut menurut expires_at
+                self._prune_locked(shard, now)
+
+    def __len__(self):
+        return sum(len(s.data) for s in self._shards)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "entries": len(self),
+            "max_entries": self.max_per_shard * self.shards,
+            "ttl_s": self.ttl_s,
+            "shards": self.shards,
+            "evictions": sum(s.evictions for s in self._shards),
+            "expirations": sum(s.expirations for s in self._shards),
+        }
@@ -2,7 +2,7 @@
 import os
 import getpass
 from werkzeug.security import generate_password_hash
-import psycopg2
+from dbpool import ConnectionPool
 
 DB_CONFIG = {
     "host": os.environ.get("DB_HOST", "localhost"),
@@ -21,13 +21,15 @@ def main():
         print("Empty password, abort.")
         return
     hashed = generate_password_hash(pw)
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO users (first_name,last_name,email,password_hash,role) VALUES (%s,%s,%s,%s,%s) RETURNING id;",
-                (first, last, email, hashed, "admin"))
-    uid = cur.fetchone()[0]
-    conn.commit()
-    cur.close(); conn.close()
+    pool = ConnectionPool(DB_CONFIG, minconn=0, maxconn=1)
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO users (first_name,last_name,email,password_hash,role) VALUES (%s,%s,%s,%s,%s) RETURNING id;",
+                    (first, last, email, hashed, "admin"))
+        uid = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+    pool.closeall()
     print("Created admin id:", uid)
 
 if __name__ == "__main__":
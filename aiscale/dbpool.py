@@ -0,0 +1,240 @@
+# pool koneksi PostgreSQL (thread-safe) untuk app.py / created_admin.py / yolov8.py
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Pool koneksi psycopg2 dengan batas min/max.
+    - checkout lewat `with pool.connection() as conn:` (rollback otomatis bila error)
+    - koneksi idle lama dicek dulu (SELECT 1) sebelum dipakai ulang
+    - stats(): in_use, idle, waiting, total wait time, dll.
+    - `minconn`: koneksi tidak dibuka di __init__ (pool dibuat saat import, bisa di master
+      gunicorn sebelum fork); panggil prefill() di proses yang memakainya. Setelah itu
+      minconn jadi batas bawah koneksi idle yang tidak ditutup reaper.
+    """
+
+    def __init__(self, config, minconn=1, maxconn=10, timeout=10.0,
+                 check_after_s=30.0, max_idle_s=300.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("invalid pool size: min=%s max=%s" % (minconn, maxconn))
+        self._config = dict(config)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after_s = check_after_s
+        self.max_idle_s = max_idle_s
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()  # (conn, last_used)
+        self._size = 0        # total koneksi terbuka (idle + in use)
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+
+    # -----------------------------
+    # internal
+    # -----------------------------
+    def _connect(self):
+        return psycopg2.connect(**self._config)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after_s:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reap_idle_locked(self):
+        # tutup koneksi idle yang terlalu lama, sisakan minimal `minconn`
+        now = time.monotonic()
+        stale = []
+        while self._idle and self._size > self.minconn:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.max_idle_s:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._discarded += 1
+            stale.append(conn)
+        return stale
+
+    # -----------------------------
+    # public API
+    # -----------------------------
+    def prefill(self):
+        """Buka koneksi sampai `minconn`; return jumlah yang dibuka. Error koneksi di-raise."""
+        opened = 0
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return opened
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            opened += 1
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout("no connection available within %.1fs" % timeout)
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    # LIFO: koneksi yang paling baru dipakai biasanya paling "hangat"
+                    conn, last_used = self._idle.pop()
+                else:
+                    create = True
+                    self._size += 1
+                self._in_use += 1
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._discarded += 1
+                    self._cond.notify()
+                continue
+
+            waited_s = time.monotonic() - start if waited else 0.0
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total_s += waited_s
+                if waited_s > self._wait_max_s:
+                    self._wait_max_s = waited_s
+            return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        discard = discard or conn.closed
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+                self._discarded += 1
+                stale = [conn]
+            else:
+                self._idle.append((conn, time.monotonic()))
+                stale = self._reap_idle_locked()
+            self._cond.notify()
+        for c in stale:
+            self._close_quietly(c)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [c for c, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for c in idle:
+            self._close_quietly(c)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+                "wait_time_total_s": round(self._wait_total_s, 4),
+                "wait_time_max_s": round(self._wait_max_s, 4),
+                "wait_time_avg_ms": round(1000.0 * self._wait_total_s / self._checkouts, 3) if self._checkouts else 0.0,
+            }
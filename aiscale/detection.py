@@ -0,0 +1,89 @@
+# ringkasan hasil YOLO -> (label, detections, jpeg) dipakai app.py dan worker procpool.py
+# (tanpa Flask/DB supaya bisa di-import di proses worker)
+from contextlib import nullcontext
+
+import cv2
+
+
+def as_number(x):
+    try:
+        return float(x.cpu().numpy())
+    except Exception:
+        try:
+            return float(x)
+        except Exception:
+            return 0.0
+
+
+def _no_timer(name):
+    return nullcontext()
+
+
+def encode_jpeg(image, quality=80, max_side=0, timer=_no_timer):
+    h, w = image.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / float(max(h, w))
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    with timer("imencode"):
+        ret, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.tobytes()
+
+
+def draw_detections(frame, detections, roi_box=None):
+    """Gambar box (koordinat frame asli) langsung dengan cv2, dipakai bila frame inferensi = crop ROI."""
+    image = frame.copy()
+    if roi_box is not None:
+        x1, y1, x2, y2 = roi_box
+        cv2.rectangle(image, (x1, y1), (x2 - 1, y2 - 1), (255, 160, 0), 1)
+    for d in detections:
+        p1 = (int(d["x1"]), int(d["y1"]))
+        cv2.rectangle(image, p1, (int(d["x2"]), int(d["y2"])), (0, 255, 0), 2)
+        cv2.putText(image, f'{d["label"]} {d["conf"]:.2f}', (p1[0], max(12, p1[1] - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
+    return image
+
+
+def summarize_result(frame, result, names, annotate=True, quality=80, max_side=0, timer=_no_timer):
+    """
+    Return (top_label, detections, jpeg_bytes).
+    annotate=False -> lewati results.plot() dan cv2.imencode, jpeg_bytes = None
+    timer(name) -> context manager pengukur stage (plot, imencode)
+    """
+    if result is None:
+        return "Model not loaded", [], encode_jpeg(frame, quality, max_side, timer) if annotate else None
+    detections = []
+    top_label = "Tidak ada"
+    try:
+        boxes = result.boxes
+    except Exception:
+        boxes = []
+    if len(boxes) > 0:
+        for box in boxes:
+            try:
+                cls_idx = int(as_number(box.cls))
+            except Exception:
+                cls_idx = int(box.cls) if hasattr(box, "cls") else 0
+            try:
+                conf = float(as_number(box.conf))
+            except Exception:
+                conf = float(box.conf) if hasattr(box, "conf") else 0.0
+            try:
+                xyxy = box.xyxy[0]
+                x1 = float(as_number(xyxy[0])); y1 = float(as_number(xyxy[1]))
+                x2 = float(as_number(xyxy[2])); y2 = float(as_number(xyxy[3]))
+            except Exception:
+                x1 = y1 = x2 = y2 = 0.0
+            label = names.get(cls_idx, str(cls_idx))
+            detections.append({
+                "cls": cls_idx, "label": label, "conf": round(conf, 4),
+                "x1": round(x1,1), "y1": round(y1,1), "x2": round(x2,1), "y2": round(y2,1)
+            })
+        top_label = detections[0]["label"]
+    if not annotate:
+        return top_label, detections, None
+    try:
+        with timer("plot"):
+            annotated = result.plot()
+    except Exception:
+        annotated = frame
+    return top_label, detections, encode_jpeg(annotated, quality, max_side, timer)
@@ -0,0 +1,165 @@
+# penulis deteksi_objek ber-buffer: banyak baris -> satu INSERT multi-row + satu commit
+import time
+import threading
+from collections import deque
+from datetime import datetime
+
+import psycopg2.extras
+
+INSERT_DETEKSI_SQL = """
+    INSERT INTO deteksi_objek
+        (nama_objek, confidence, timestamp, bbox_x_min, bbox_y_min, bbox_x_max, bbox_y_max)
+    VALUES %s
+"""
+
+
+def iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter <= 0:
+        return 0.0
+    area_a = max(0, a[2] - a[0]) * max(0, a[3] - a[1])
+    area_b = max(0, b[2] - b[0]) * max(0, b[3] - b[1])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+class DetectionWriter:
+    """
+    - add() hanya menaruh baris di buffer (tidak pernah menunggu DB)
+    - thread latar flush bila buffer >= flush_rows atau sudah flush_interval_s
+    - buffer dibatasi max_rows; bila penuh baris tertua dibuang (dihitung di stats)
+    - dedup_iou > 0: objek yang sama (label sama, IoU >= dedup_iou) yang masih terlihat
+      dalam dedup_window_s tidak ditulis ulang
+    - close(): flush sisa buffer lalu berhenti; flush terakhir yang gagal dicoba sekali lagi,
+      baris yang tetap tidak tertulis dihitung di `dropped`
+    """
+
+    def __init__(self, pool, flush_rows=100, flush_interval_s=1.0, max_rows=5000,
+                 dedup_iou=0.0, dedup_window_s=1.0):
+        self.pool = pool
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self.dedup_iou = dedup_iou
+        self.dedup_window_s = dedup_window_s
+
+        self._buffer = deque(maxlen=max_rows)
+        self._cond = threading.Condition()
+        self._seen = {}  # label -> [(bbox, last_seen)]
+        self._stopped = False
+
+        self._written = 0
+        self._dropped = 0
+        self._deduped = 0
+        self._flushes = 0
+        self._errors = 0
+
+        self._thread = threading.Thread(target=self._loop, name="detection-writer", daemon=True)
+        self._thread.start()
+
+    def _is_duplicate(self, label, bbox, now):
+        recent = [(b, t) for b, t in self._seen.get(label, []) if now - t <= self.dedup_window_s]
+        dup = False
+        for i, (b, _) in enumerate(recent):
+            if iou(b, bbox) >= self.dedup_iou:
+                recent[i] = (bbox, now)  # objek masih di sana: perbarui posisi terakhir
+                dup = True
+                break
+        if not dup:
+            recent.append((bbox, now))
+        self._seen[label] = recent
+        return dup
+
+    def add(self, label, confidence, bbox, ts=None):
+        bbox = (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))
+        now = time.monotonic()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("writer closed")
+            if self.dedup_iou > 0 and self._is_duplicate(label, bbox, now):
+                self._deduped += 1
+                return False
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped += 1
+            self._buffer.append((label, float(confidence), ts or datetime.now()) + bbox)
+            if len(self._buffer) >= self.flush_rows:
+                self._cond.notify()
+        return True
+
+    def _take(self):
+        with self._cond:
+            rows = list(self._buffer)
+            self._buffer.clear()
+        return rows
+
+    def _write(self, rows):
+        if not rows:
+            return
+        try:
+            with self.pool.connection() as db:
+                cur = db.cursor()
+                psycopg2.extras.execute_values(cur, INSERT_DETEKSI_SQL, rows, page_size=len(rows))
+                db.commit()
+                cur.close()
+        except Exception as e:
+            with self._cond:
+                self._errors += 1
+                # kembalikan ke depan buffer untuk dicoba lagi; buffer bisa sudah terisi baris baru,
+                # jadi yang dibuang adalah baris gagal yang paling tua (dan tetap dihitung)
+                space = self._buffer.maxlen - len(self._buffer)
+                keep = rows[len(rows) - space:] if space < len(rows) else rows
+                self._dropped += len(rows) - len(keep)
+                self._buffer.extendleft(reversed(keep))
+            print("❌ Gagal flush deteksi ke DB:", e)
+            return
+        with self._cond:
+            self._written += len(rows)
+            self._flushes += 1
+        print(f"✅ Simpan ke DB: {len(rows)} deteksi")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval_s
+                while not self._stopped and len(self._buffer) < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopped = self._stopped
+            self._write(self._take())
+            if stopped:
+                return
+
+    def flush(self):
+        self._write(self._take())
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # masih di tengah _write terakhir: jangan tulis paralel, sisa buffer dihitung hilang di bawah
+            print("⚠️ Penulis deteksi belum selesai dalam %.1fs" % timeout)
+        else:
+            # flush terakhir di _loop gagal -> baris kembali ke buffer, coba sekali lagi
+            self._write(self._take())
+        with self._cond:
+            lost = len(self._buffer)
+            self._dropped += lost
+            self._buffer.clear()
+        if lost:
+            print(f"❌ {lost} deteksi tidak tersimpan saat menutup penulis")
+
+    def stats(self):
+        with self._cond:
+            return {
+                "buffered": len(self._buffer),
+                "written": self._written,
+                "flushes": self._flushes,
+                "dropped": self._dropped,
+                "deduped": self._deduped,
+                "errors": self._errors,
+            }
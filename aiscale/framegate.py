@@ -0,0 +1,93 @@
+# gating perubahan frame per client: lewati inferensi bila isi tray tidak berubah
+import time
+import threading
+
+import cv2
+import numpy as np
+
+from clientstate import ClientStateStore
+
+
+class FrameChangeGate:
+    """
+    Simpan "sidik" kecil (grayscale 32x32) dari frame terakhir yang benar-benar
+    diinferensi per client, beserta hasilnya. Frame baru dianggap sama bila
+    rata-rata selisih piksel < `threshold` (skala 0-255) dan hasil cache
+    belum lebih tua dari `max_stale_s`.
+    `view` (ROI + transform + ukuran frame inferensi) ikut disimpan: ROI kiosk yang
+    diganti membuat hasil cache client-nya miss walau key ROI bukan client_id.
+    """
+
+    def __init__(self, threshold=4.0, max_stale_s=2.0, size=32, enabled=True, store=None):
+        self.threshold = float(threshold)
+        self.max_stale_s = float(max_stale_s)
+        self.size = int(size)
+        self.enabled = enabled
+        # client_id -> (signature, ts, annotated, result, view)
+        self.entries = store if store is not None else ClientStateStore(max_stale_s, name="frame_gate")
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+
+    def signature(self, frame):
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+
+    def lookup(self, client_id, signature, annotate, view=None):
+        """Return hasil cache bila scene tidak berubah, selain itu None."""
+        if not self.enabled:
+            return None
+        entry = self.entries.get(client_id)
+        if entry is None:
+            self._count(miss=True)
+            return None
+        prev_sig, ts, cached_annotated, result, prev_view = entry
+        if view != prev_view:
+            self._count(miss=True)
+            return None
+        if time.monotonic() - ts > self.max_stale_s:
+            self._count(miss=True, stale=True)
+            return None
+        # hasil tanpa gambar tidak bisa dipakai untuk request yang minta anotasi
+        if annotate and not cached_annotated:
+            self._count(miss=True)
+            return None
+        diff = float(np.mean(cv2.absdiff(signature, prev_sig)))
+        if diff >= self.threshold:
+            self._count(miss=True)
+            return None
+        self._count(miss=False)
+        return result
+
+    def store(self, client_id, signature, annotate, result, view=None):
+        if not self.enabled:
+            return
+        self.entries.set(client_id, (signature, time.monotonic(), annotate, result, view))
+
+    def forget(self, client_id):
+        self.entries.pop(client_id)
+
+    def _count(self, miss, stale=False):
+        with self._lock:
+            if miss:
+                self._misses += 1
+                if stale:
+                    self._stale += 1
+            else:
+                self._hits += 1
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "max_stale_s": self.max_stale_s,
+                "clients": len(self.entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "stale_misses": self._stale,
+                "hit_ratio": round(self._hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,46 @@
+# mode multi-worker: gunicorn -c gunicorn.conf.py "app:create_app()"
+# - app di-import sekali di master (preload_app), worker hasil fork memulai thread-nya sendiri (post_fork)
+# - timbangan, latest_detection / client_last_ts dan SSE status dipegang satu proses owner
+#   yang di-spawn master (lihat sharedstate.py); tiap worker tetap memuat model sendiri
+import os
+import sys
+import importlib
+
+os.environ["AISCALE_MULTIWORKER"] = "1"
+os.environ["AISCALE_MASTER_PID"] = str(os.getpid())
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get("BIND", "0.0.0.0:%s" % os.environ.get("PORT", 4000))
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))
+preload_app = True
+# inferensi CPU bisa lama saat model baru dimuat
+timeout = int(os.environ.get("WEB_TIMEOUT", 120))
+graceful_timeout = 10
+
+OWNER = None
+
+
+def on_starting(server):
+    # jalan di master setelah preload, sebelum worker di-fork: env alamat owner ikut diwarisi worker
+    global OWNER
+    if os.environ.get("AISCALE_STATE_ADDRESS"):
+        server.log.info("Owner state eksternal: %s", os.environ["AISCALE_STATE_ADDRESS"])
+        return
+    app_module = importlib.import_module("app")
+    import sharedstate
+    OWNER = sharedstate.StateOwner(app_module.owner_config()).start()
+    server.log.info("Owner state pid %s di %s", OWNER.process.pid, OWNER.address)
+
+
+def post_fork(server, worker):
+    # thread tidak ikut fork: batcher, loader model, listener katalog dimulai di tiap worker
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.start_services()
+
+
+def on_exit(server):
+    if OWNER is not None:
+        OWNER.stop()
@@ -0,0 +1,161 @@
+# varian gambar produk (thumb / card / full) dalam WebP + JPEG
+# backfill untuk gambar yang sudah ada:
+#   python imagevariants.py [folder]      (default: ./static/assets/img)
+import os
+import re
+import sys
+import posixpath
+import hashlib
+import tempfile
+
+import cv2
+import numpy as np
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+# sisi terpanjang (px) per varian
+VARIANT_SIZES = {"thumb": 160, "card": 480, "full": 1280}
+VARIANT_FORMATS = ("webp", "jpg")
+VARIANT_DIR = "variants"
+WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", 80))
+JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+HASH_LEN = 16
+# nama dari save_upload(): {nama}_{hash}{ext}
+_HASHED_NAME = re.compile(r"_[0-9a-f]{%d}\.[A-Za-z0-9]+$" % HASH_LEN)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LEN]
+
+
+def is_immutable(relpath):
+    """
+    True bila isi file di path ini tidak pernah berubah: varian hasil generate, atau nama
+    berbasis hash dari save_upload(). File lama bernama tetap (botol.png dll.) bisa diganti di tempat.
+    """
+    relpath = posixpath.normpath(relpath.replace("\\", "/"))  # "variants/../botol.png" -> "botol.png"
+    return relpath.startswith(VARIANT_DIR + "/") or bool(_HASHED_NAME.search(os.path.basename(relpath)))
+
+
+def variant_relpath(filename, size, fmt):
+    stem = os.path.splitext(filename)[0]
+    return f"{VARIANT_DIR}/{stem}.{size}.{fmt}"
+
+
+def _write_atomic(path, data):
+    # nama temp unik per panggilan: ensure_variant paralel untuk produk yang sama tidak saling menimpa
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # mkstemp membuat 0600; varian dilayani sebagai file statis
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _to_bgr(img, fmt):
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if img.shape[2] == 4 and fmt == "jpg":
+        # JPEG tanpa alpha -> tempel di atas latar putih
+        alpha = img[:, :, 3:4].astype(np.float32) / 255.0
+        bgr = img[:, :, :3].astype(np.float32)
+        return (bgr * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
+    return img
+
+
+def generate_variants(folder, filename, data=None, overwrite=False):
+    """Buat semua varian untuk satu gambar. Return jumlah file yang ditulis (0 bila tidak bisa didecode)."""
+    src = safe_join(folder, filename)
+    if src is None:
+        return 0
+    if data is None:
+        with open(src, "rb") as f:
+            data = f.read()
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return 0
+
+    os.makedirs(os.path.join(folder, VARIANT_DIR, os.path.dirname(filename)), exist_ok=True)
+    written = 0
+    h, w = img.shape[:2]
+    for size, max_side in VARIANT_SIZES.items():
+        resized = img
+        if max(h, w) > max_side:
+            scale = max_side / float(max(h, w))
+            resized = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        for fmt in VARIANT_FORMATS:
+            out_path = os.path.join(folder, variant_relpath(filename, size, fmt))
+            if not overwrite and os.path.exists(out_path):
+                continue
+            if fmt == "webp":
+                ok, buf = cv2.imencode(".webp", _to_bgr(resized, fmt), [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+            else:
+                ok, buf = cv2.imencode(".jpg", _to_bgr(resized, fmt), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if ok:
+                _write_atomic(out_path, buf.tobytes())
+                written += 1
+    return written
+
+
+def save_upload(file, folder):
+    """
+    Simpan file upload dengan nama berbasis hash isi ({nama}_{hash}{ext}) lalu buat variannya.
+    Nama yang sama selalu berarti isi yang sama -> aman di-cache selamanya (immutable).
+    Return nama file (relatif terhadap folder).
+    """
+    data = file.read()
+    name, ext = os.path.splitext(secure_filename(file.filename))
+    filename = f"{name}_{content_hash(data)}{ext.lower()}"
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    try:
+        generate_variants(folder, filename, data=data)
+    except Exception as e:
+        # gambar asli tetap tersimpan; varian bisa dibuat ulang lewat backfill / on-demand
+        print("⚠️ Gagal membuat varian gambar:", filename, e)
+    return filename
+
+
+def ensure_variant(folder, filename, size, fmt):
+    """Return path varian relatif terhadap folder, dibuat on-demand bila belum ada; None bila tidak bisa."""
+    if size not in VARIANT_SIZES or fmt not in VARIANT_FORMATS:
+        return None
+    rel = variant_relpath(filename, size, fmt)
+    full = safe_join(folder, rel)
+    if full is None:
+        return None
+    if os.path.exists(full):
+        return rel
+    src = safe_join(folder, filename)
+    if src is None or not os.path.isfile(src):
+        return None
+    try:
+        generate_variants(folder, filename)
+    except Exception as e:
+        print("⚠️ Gagal membuat varian gambar:", filename, e)
+        return None
+    return rel if os.path.exists(full) else None
+
+
+def backfill(folder):
+    total = 0
+    for entry in sorted(os.listdir(folder)):
+        path = os.path.join(folder, entry)
+        if not os.path.isfile(path) or entry.endswith((".svg", ".gif")):
+            continue
+        n = generate_variants(folder, entry)
+        if n:
+            print(f"✅ {entry}: {n} varian")
+        total += n
+    print(f"Selesai: {total} file varian ditulis")
+
+
+if __name__ == "__main__":
+    backfill(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), "static", "assets", "img"))
@@ -0,0 +1,189 @@
+# metrik ringan format Prometheus (tanpa dependency prometheus_client)
+# - Counter / Gauge / CounterFunc / Histogram dengan label, thread-safe, dirender oleh Registry.render() untuk /metrics
+# - StageTimer: `with stage("imdecode"):` -> observe ke histogram + dicatat untuk header Server-Timing
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# bucket detik: 0.5 ms .. 10 s (cukup untuk decode frame sampai query riwayat besar)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (nama, detik) per request; None = request ini tidak mengumpulkan Server-Timing
+_timings = contextvars.ContextVar("aiscale_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.documentation}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_str(self.labelnames, key)} {_fmt(v)}" for key, v in items]
+
+
+class Gauge:
+    """Nilai dibaca saat scrape: fn() -> angka, atau {tuple(label values): angka}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        registry.register(self)
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_label_str(self.labelnames, key)} {_fmt(v)}" for key, v in sorted(value.items())]
+
+
+class CounterFunc(Gauge):
+    """Counter yang nilainya dibaca saat scrape (fn() naik monoton, mis. stats() komponen lain)."""
+
+    kind = "counter"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [counts per bucket..., +Inf], sum
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._series.items())
+        out = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_fmt(bound)}"'
+                out.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_label_str(self.labelnames, key)} {cumulative}")
+        return out
+
+
+class StageTimer:
+    """
+    `with timer("plot"):` -> histogram.observe(durasi, <label>=nama) dan, bila request
+    sedang mengumpulkan timing, tambah entri untuk Server-Timing.
+    """
+
+    def __init__(self, histogram, label="stage"):
+        self.histogram = histogram
+        self.label = label
+
+    def record(self, name, seconds, **labels):
+        labels[self.label] = name
+        self.histogram.observe(seconds, **labels)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, seconds))
+
+    @contextmanager
+    def __call__(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0, **labels)
+
+
+def begin_timings():
+    _timings.set([])
+
+
+def end_timings():
+    timings = _timings.get()
+    _timings.set(None)
+    return timings
+
+
+def server_timing_header(timings, total_s=None):
+    # stage yang sama (mis. beberapa query DB) dijumlahkan
+    merged = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in merged.items()]
+    if total_s is not None:
+        parts.append(f"total;dur={total_s * 1000.0:.2f}")
+    return ", ".join(parts)
@@ -0,0 +1,461 @@
+# inferensi multi-proses (opsional, INFER_WORKERS > 0)
+# - tiap worker = proses terpisah dengan instance model sendiri -> predict, plot() dan imencode
+#   tidak lagi berebut GIL dengan thread Flask
+# - frame hasil decode ditulis ke SharedMemory milik worker (satu memcpy, tanpa pickle ndarray);
+#   JPEG anotasi dibaca balik dari SharedMemory output. Lewat Pipe hanya metadata kecil.
+# - thread monitor: worker mati / hang / tidak menjawab ping -> proses diganti baru
+# Worker dijalankan sebagai `python procpool.py worker ...` (bukan multiprocessing spawn) supaya
+# app.py tidak ikut di-import ulang di tiap worker; koneksi balik lewat Listener ber-authkey.
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import subprocess
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class WorkerUnavailable(RuntimeError):
+    pass
+
+
+# -----------------------------
+# sisi proses worker
+# -----------------------------
+def attach_shm(name):
+    # segmen milik proses utama: worker tidak boleh ikut mendaftarkannya ke resource tracker
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Python < 3.13: tanpa ini resource tracker worker meng-unlink segmen saat worker keluar
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _worker_main(index, conn, in_name, out_name, cfg):
+    os.environ.update(cfg.get("env") or {})
+    from backends import load_backend
+    import detection
+
+    shm_in = attach_shm(in_name)
+    shm_out = attach_shm(out_name)
+    try:
+        backend = load_backend(cfg["backend"], conf=cfg["conf"])
+        names = dict(backend.names)
+        # warm-up jalur lengkap (predict + plot + encode) sebelum lapor siap
+        dummy = np.zeros((backend.imgsz, backend.imgsz, 3), dtype=np.uint8)
+        detection.summarize_result(dummy, backend.predict([dummy])[0], names, annotate=True)
+    except Exception as e:
+        conn.send(("failed", os.getpid(), str(e)))
+        return
+    conn.send(("ready", os.getpid(), names))
+
+    frame_bytes = cfg["frame_bytes"]
+    out_bytes = cfg["out_bytes"]
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        if msg[0] == "ping":
+            conn.send(("pong",))
+            continue
+
+        _, metas = msg
+        frames = []
+        annotates = []
+        for slot, meta in enumerate(metas):
+            kind, payload, annotate = meta
+            if kind == "shm":
+                # view langsung ke shared memory (zero-copy); tidak diubah oleh predict/plot
+                frames.append(np.ndarray(payload, dtype=np.uint8, buffer=shm_in.buf, offset=slot * frame_bytes))
+            else:
+                frames.append(payload)
+            annotates.append(annotate)
+
+        try:
+            t0 = time.perf_counter()
+            results = backend.predict(frames)
+            infer_s = time.perf_counter() - t0
+            out = []
+            for slot, (frame, result, annotate) in enumerate(zip(frames, results, annotates)):
+                timings = {}
+
+                def timer(name, _timings=timings):
+                    return _Timer(_timings, name)
+
+                label, boxes, jpeg = detection.summarize_result(
+                    frame, result, names, annotate=annotate,
+                    quality=cfg["jpeg_quality"], max_side=cfg["max_side"], timer=timer)
+                timings["inference"] = infer_s
+                if jpeg is None:
+                    image = None
+                elif len(jpeg) <= out_bytes:
+                    start = slot * out_bytes
+                    shm_out.buf[start:start + len(jpeg)] = jpeg
+                    image = ("shm", len(jpeg))
+                else:
+                    image = ("inline", jpeg)
+                out.append((label, boxes, image, timings))
+            conn.send(("ok", out))
+        except Exception as e:
+            conn.send(("error", str(e)))
+        # lepas view ke shared memory (Results.orig_img juga menunjuk ke sana)
+        frames = results = None
+
+
+class _Timer:
+    __slots__ = ("timings", "name", "t0")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.t0
+
+
+# -----------------------------
+# sisi proses utama
+# -----------------------------
+class _Worker:
+    def __init__(self, index, slots, frame_bytes, out_bytes):
+        self.index = index
+        self.slots = slots
+        self.shm_in = shared_memory.SharedMemory(create=True, size=slots * frame_bytes)
+        self.shm_out = shared_memory.SharedMemory(create=True, size=slots * out_bytes)
+        self.lock = threading.Lock()  # satu batch per worker pada satu waktu
+        self.process = None  # subprocess.Popen
+        self.conn = None
+        self.state = "stopped"  # starting | ready | failed | stopped
+        self.pid = None
+        self.restarts = 0
+        self.calls = 0
+        self.items = 0
+        self.last_error = None
+        self.started_at = None
+
+
+class ProcessInferenceEngine:
+    """
+    Pool proses inferensi. run_batch([(frame, annotate), ...]) -> [(label, boxes, jpeg, timings), ...]
+    Batch dibagi ke worker yang siap (maks `slots` frame per worker sekali kirim) dan
+    dijalankan paralel. Dipakai sebagai infer_fn InferenceBatcher, jadi antrian per client,
+    batas antrian dan deadline tetap berlaku.
+    """
+
+    def __init__(self, workers=2, backend="pytorch", conf=0.6, slots=4,
+                 frame_bytes=8 * 1024 * 1024, out_bytes=2 * 1024 * 1024,
+                 jpeg_quality=80, max_side=0, call_timeout_s=30.0, startup_timeout_s=300.0,
+                 health_interval_s=2.0, threads_per_worker=None):
+        self.workers_n = max(1, int(workers))
+        self.slots = max(1, int(slots))
+        self.frame_bytes = int(frame_bytes)
+        self.out_bytes = int(out_bytes)
+        self.call_timeout_s = call_timeout_s
+        self.startup_timeout_s = startup_timeout_s
+        self.health_interval_s = health_interval_s
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers_n)
+        env = {}
+        if "INFER_THREADS" not in os.environ:
+            env["INFER_THREADS"] = str(threads_per_worker)
+        self.cfg = {
+            "backend": backend, "conf": conf,
+            "frame_bytes": self.frame_bytes, "out_bytes": self.out_bytes,
+            "jpeg_quality": jpeg_quality, "max_side": max_side, "env": env,
+        }
+        self._authkey = os.urandom(16)
+        self._listener = None
+        self._workers = []
+        self._executor = None
+        self._next = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        self._monitor = None
+        self.names = {}
+        self.name = f"procpool[{backend}]"
+        self.imgsz = None
+
+    # -----------------------------
+    # lifecycle
+    # -----------------------------
+    def start(self, wait_s=None):
+        """Spawn worker + monitor. Return self setelah minimal satu worker siap (atau raise)."""
+        if not self._workers:
+            family = "AF_PIPE" if sys.platform == "win32" else "AF_UNIX"
+            address = None if family == "AF_PIPE" else os.path.join(tempfile.mkdtemp(prefix="aiscale-"), "procpool.sock")
+            self._listener = Listener(address, family=family, authkey=self._authkey)
+            self._workers = [_Worker(i, self.slots, self.frame_bytes, self.out_bytes) for i in range(self.workers_n)]
+            self._executor = ThreadPoolExecutor(max_workers=self.workers_n, thread_name_prefix="procpool-dispatch")
+            threading.Thread(target=self._accept_loop, name="procpool-accept", daemon=True).start()
+            for w in self._workers:
+                self._spawn(w)
+            self._monitor = threading.Thread(target=self._monitor_loop, name="procpool-monitor", daemon=True)
+            self._monitor.start()
+        deadline = time.monotonic() + (self.startup_timeout_s if wait_s is None else wait_s)
+        with self._ready:
+            while not any(w.state == "ready" for w in self._workers):
+                if all(w.state == "failed" for w in self._workers):
+                    raise WorkerUnavailable("semua worker inferensi gagal start: %s" % self._workers[0].last_error)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WorkerUnavailable("tidak ada worker inferensi yang siap")
+                self._ready.wait(min(remaining, 1.0))
+        return self
+
+    def _spawn(self, w):
+        env = dict(os.environ, PROCPOOL_AUTHKEY=self._authkey.hex(), PROCPOOL_CFG=json.dumps(self.cfg))
+        cmd = [sys.executable, os.path.abspath(__file__), "worker", str(w.index),
+               w.shm_in.name, w.shm_out.name, self._listener.address]
+        with self._ready:
+            w.conn = None
+            w.state = "starting"
+            w.started_at = time.monotonic()
+            w.process = subprocess.Popen(cmd, env=env)
+            w.pid = w.process.pid
+
+    def _accept_loop(self):
+        # worker menyapa dengan ("hello", index, pid); koneksi dari proses lama diabaikan
+        while not self._stopped.is_set():
+            try:
+                conn = self._listener.accept()
+                hello = conn.recv()
+            except Exception:
+                if self._stopped.is_set():
+                    return
+                continue
+            with self._ready:
+                w = self._workers[hello[1]] if 0 <= hello[1] < len(self._workers) else None
+                if w is None or w.pid != hello[2] or w.state != "starting":
+                    conn.close()
+                    continue
+                w.conn = conn
+            threading.Thread(target=self._await_ready, args=(w, conn), name=f"procpool-start-{w.index}",
+                             daemon=True).start()
+
+    def _await_ready(self, w, conn):
+        msg = None
+        try:
+            if conn.poll(self.startup_timeout_s):
+                msg = conn.recv()
+        except (EOFError, OSError) as e:
+            msg = ("failed", w.pid, str(e) or type(e).__name__)
+        with self._ready:
+            if w.conn is not conn:
+                return  # worker sudah diganti
+            if msg and msg[0] == "ready":
+                w.state = "ready"
+                if not self.names:
+                    self.names = msg[2]
+                print(f"✅ Worker inferensi {w.index} siap (pid {w.pid})")
+            else:
+                w.state = "failed"
+                w.last_error = msg[2] if msg else "startup timeout"
+                print(f"⚠️ Worker inferensi {w.index} gagal start:", w.last_error)
+            self._ready.notify_all()
+
+    def _kill(self, w, reason):
+        w.last_error = reason
+        w.state = "failed"
+        try:
+            if w.process is not None and w.process.poll() is None:
+                w.process.terminate()
+                try:
+                    w.process.wait(2.0)
+                except subprocess.TimeoutExpired:
+                    w.process.kill()
+                    w.process.wait(2.0)
+        except Exception:
+            pass
+        try:
+            if w.conn is not None:
+                w.conn.close()
+        except Exception:
+            pass
+
+    def _restart(self, w, reason):
+        print(f"⚠️ Worker inferensi {w.index} di-restart: {reason}")
+        self._kill(w, reason)
+        w.restarts += 1
+        self._spawn(w)
+
+    def _monitor_loop(self):
+        while not self._stopped.wait(self.health_interval_s):
+            for w in self._workers:
+                if self._stopped.is_set():
+                    return
+                if w.state == "starting":
+                    # proses mati sebelum lapor siap / tidak pernah tersambung
+                    if w.process.poll() is not None:
+                        self._kill(w, f"exit code {w.process.returncode} saat start")
+                    elif time.monotonic() - w.started_at > self.startup_timeout_s:
+                        self._kill(w, "startup timeout")
+                    continue
+                # worker gagal: spawn ulang dengan backoff 1, 2, 4, ... maks 60 detik
+                if w.state == "failed" and time.monotonic() - w.started_at < min(60.0, 2.0 ** w.restarts):
+                    continue
+                # worker yang sedang memproses batch tidak di-ping (timeout-nya diurus _call)
+                if not w.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if w.state == "failed" or w.process.poll() is not None:
+                        self._restart(w, w.last_error or f"exit code {w.process.returncode}")
+                        continue
+                    try:
+                        w.conn.send(("ping",))
+                        if not w.conn.poll(5.0) or w.conn.recv()[0] != "pong":
+                            self._restart(w, "ping timeout")
+                    except (EOFError, OSError) as e:
+                        self._restart(w, f"pipe error: {e}")
+                finally:
+                    w.lock.release()
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        for w in self._workers:
+            try:
+                w.conn.send(None)
+            except Exception:
+                pass
+        for w in self._workers:
+            try:
+                w.process.wait(timeout)
+            except Exception:
+                pass
+            self._kill(w, "stopped")
+            w.state = "stopped"
+            for shm in (w.shm_in, w.shm_out):
+                try:
+                    shm.close()
+                    shm.unlink()
+                except Exception:
+                    pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+
+    # -----------------------------
+    # inferensi
+    # -----------------------------
+    def _pick_workers(self, n_chunks):
+        with self._lock:
+            ready = [w for w in self._workers if w.state == "ready"]
+            if not ready:
+                raise WorkerUnavailable("tidak ada worker inferensi yang siap")
+            start = self._next
+            self._next = (self._next + n_chunks) % len(ready)
+        return [ready[(start + i) % len(ready)] for i in range(n_chunks)]
+
+    def _call(self, w, items):
+        with w.lock:
+            if w.state != "ready":
+                raise WorkerUnavailable(f"worker {w.index} tidak siap")
+            metas = []
+            for slot, (frame, annotate) in enumerate(items):
+                frame = np.ascontiguousarray(frame, dtype=np.uint8)
+                if frame.nbytes <= self.frame_bytes:
+                    view = np.ndarray(frame.shape, dtype=np.uint8, buffer=w.shm_in.buf, offset=slot * self.frame_bytes)
+                    view[...] = frame
+                    del view
+                    metas.append(("shm", frame.shape, annotate))
+                else:
+                    metas.append(("inline", frame, annotate))  # frame lebih besar dari slot: pickle
+            try:
+                w.conn.send(("infer", metas))
+                if not w.conn.poll(self.call_timeout_s):
+                    self._restart(w, "infer timeout")
+                    raise WorkerUnavailable(f"worker {w.index} timeout")
+                msg = w.conn.recv()
+            except (EOFError, OSError) as e:
+                self._restart(w, f"pipe error: {e}")
+                raise WorkerUnavailable(f"worker {w.index} mati") from e
+            w.calls += 1
+            w.items += len(items)
+            if msg[0] != "ok":
+                w.last_error = msg[1]
+                raise RuntimeError(msg[1])
+            out = []
+            for slot, (label, boxes, image, timings) in enumerate(msg[1]):
+                if image is None:
+                    jpeg = None
+                elif image[0] == "shm":
+                    start = slot * self.out_bytes
+                    jpeg = bytes(w.shm_out.buf[start:start + image[1]])
+                else:
+                    jpeg = image[1]
+                out.append((label, boxes, jpeg, timings))
+            return out
+
+    def run_batch(self, items):
+        items = list(items)
+        chunks = [items[i:i + self.slots] for i in range(0, len(items), self.slots)]
+        workers = self._pick_workers(len(chunks))
+        # worker yang sama bisa dapat >1 chunk (batch > workers * slots): w.lock mengurutkannya
+        futures = [self._executor.submit(self._call, w, chunk) for w, chunk in zip(workers, chunks)]
+        results = []
+        for fut in futures:
+            results.extend(fut.result())
+        return results
+
+    def process(self, frame, annotate=True):
+        return self.run_batch([(frame, annotate)])[0]
+
+    # -----------------------------
+    # stats
+    # -----------------------------
+    @property
+    def ready(self):
+        return any(w.state == "ready" for w in self._workers)
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "workers": [
+                {
+                    "index": w.index, "pid": w.pid, "state": w.state,
+                    "alive": bool(w.process is not None and w.process.poll() is None),
+                    "restarts": w.restarts, "calls": w.calls, "items": w.items,
+                    "last_error": w.last_error,
+                }
+                for w in self._workers
+            ],
+            "slots_per_worker": self.slots,
+            "shm_bytes": sum(w.shm_in.size + w.shm_out.size for w in self._workers),
+            "threads_per_worker": self.cfg["env"].get("INFER_THREADS", os.environ.get("INFER_THREADS")),
+        }
+
+
+def main(argv):
+    # python procpool.py worker <index> <shm_in> <shm_out> <address>  (dijalankan oleh ProcessInferenceEngine)
+    if len(argv) != 5 or argv[0] != "worker":
+        print("usage: python procpool.py worker <index> <shm_in> <shm_out> <address>")
+        return 2
+    index = int(argv[1])
+    cfg = json.loads(os.environ.pop("PROCPOOL_CFG"))
+    authkey = bytes.fromhex(os.environ.pop("PROCPOOL_AUTHKEY"))
+    conn = Client(argv[4], authkey=authkey)
+    conn.send(("hello", index, os.getpid()))
+    _worker_main(index, conn, argv[2], argv[3], cfg)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,251 @@
+# ROI (area tray timbangan) per kiosk/client + resolusi inferensi adaptif
+# - frame dipotong ke ROI lalu diperkecil ke sisi terpanjang target sebelum masuk model
+# - koordinat box hasil model dipetakan balik ke frame asli (kiosk menggambar box di canvas-nya)
+# - AdaptiveResolution menurunkan ukuran inferensi bila latensi lewat budget, menaikkan lagi bila longgar
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+import cv2
+
+# original_x = ox + small_x / scale  (scale = ukuran kecil / ukuran crop, <= 1)
+Transform = namedtuple("Transform", "ox oy scale")
+IDENTITY = Transform(0, 0, 1.0)
+
+
+def parse_roi(value):
+    """
+    [x1, y1, x2, y2] atau "x1,y1,x2,y2". Semua nilai <= 1 -> pecahan lebar/tinggi frame,
+    selain itu piksel. None / "" -> tanpa ROI.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = [v for v in value.replace(" ", "").split(",") if v]
+    roi = tuple(float(v) for v in value)
+    if len(roi) != 4:
+        raise ValueError("roi harus 4 angka: x1,y1,x2,y2")
+    if min(roi) < 0 or roi[2] <= roi[0] or roi[3] <= roi[1]:
+        raise ValueError("roi tidak valid: butuh 0 <= x1 < x2 dan 0 <= y1 < y2")
+    return roi
+
+
+def roi_pixels(roi, width, height):
+    """ROI (pecahan atau piksel) -> (x1, y1, x2, y2) piksel yang sudah di-clamp ke frame."""
+    if roi is None:
+        return 0, 0, width, height
+    x1, y1, x2, y2 = roi
+    if max(roi) <= 1.0:
+        x1, x2 = x1 * width, x2 * width
+        y1, y2 = y1 * height, y2 * height
+    x1 = min(max(int(x1), 0), width - 1)
+    y1 = min(max(int(y1), 0), height - 1)
+    x2 = min(max(int(round(x2)), x1 + 1), width)
+    y2 = min(max(int(round(y2)), y1 + 1), height)
+    return x1, y1, x2, y2
+
+
+def prepare_frame(frame, roi=None, max_side=0):
+    """
+    Return (frame_inferensi, Transform). Crop = view (tanpa salin); resize hanya bila
+    sisi terpanjang crop > max_side (tidak pernah memperbesar).
+    """
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = roi_pixels(roi, w, h)
+    crop = frame[y1:y2, x1:x2] if (x1, y1, x2, y2) != (0, 0, w, h) else frame
+    ch, cw = crop.shape[:2]
+    scale = 1.0
+    if max_side and max(ch, cw) > max_side:
+        scale = max_side / float(max(ch, cw))
+        crop = cv2.resize(crop, (max(1, int(round(cw * scale))), max(1, int(round(ch * scale)))),
+                          interpolation=cv2.INTER_AREA)
+        # skala sebenarnya setelah pembulatan (pakai sisi terpanjang)
+        scale = max(crop.shape[:2]) / float(max(ch, cw))
+    return crop, Transform(x1, y1, scale)
+
+
+def map_detections(detections, transform):
+    """Koordinat box dari frame inferensi -> frame asli."""
+    if transform == IDENTITY:
+        return detections
+    ox, oy, scale = transform
+    mapped = []
+    for d in detections:
+        d = dict(d)
+        d["x1"] = round(ox + d["x1"] / scale, 1)
+        d["y1"] = round(oy + d["y1"] / scale, 1)
+        d["x2"] = round(ox + d["x2"] / scale, 1)
+        d["y2"] = round(oy + d["y2"] / scale, 1)
+        mapped.append(d)
+    return mapped
+
+
+class RoiConfig:
+    """
+    ROI + batas sisi inferensi per kiosk/client.
+    File JSON (ROI_CONFIG_FILE):
+      {"default": {"roi": [0.2, 0.1, 0.8, 0.9], "max_side": 480},
+       "clients": {"kiosk-1": {"roi": "0.25,0.2,0.75,0.95"}}}
+    Lookup: kiosk_id -> client_id -> default. Perubahan lewat set()/remove() ditulis balik ke file.
+    File dicek ulang (mtime) paling sering tiap reload_s, jadi perubahan dari proses lain
+    (worker gunicorn lain) ikut terpakai.
+    """
+
+    def __init__(self, path=None, default_roi=None, default_max_side=0, reload_s=2.0):
+        self.path = path
+        self.reload_s = reload_s
+        self._lock = threading.Lock()
+        self._default = {"roi": parse_roi(default_roi), "max_side": int(default_max_side or 0)}
+        self._clients = {}
+        self._mtime = None
+        self._checked_at = time.monotonic()
+        self._reloads = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _entry(data):
+        return {"roi": parse_roi(data.get("roi")), "max_side": int(data.get("max_side") or 0)}
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        clients = {str(k): self._entry(v) for k, v in (data.get("clients") or {}).items()}
+        with self._lock:
+            if "default" in data:
+                self._default = self._entry(data["default"])
+            self._clients = clients
+            self._mtime = mtime
+
+    def _maybe_reload(self, force=False):
+        if not self.path or (not force and time.monotonic() - self._checked_at < self.reload_s):
+            return
+        self._checked_at = time.monotonic()
+        try:
+            if not os.path.exists(self.path) or os.stat(self.path).st_mtime_ns == self._mtime:
+                return
+            self.load()
+            self._reloads += 1
+        except (OSError, ValueError) as e:
+            # file sedang ditulis / tidak valid: pakai konfigurasi terakhir
+            print("⚠️ ROI config gagal dimuat ulang:", e)
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        data = {"default": self._default, "clients": self._clients}
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def lookup(self, *keys):
+        self._maybe_reload()
+        with self._lock:
+            for key in keys:
+                if key and key in self._clients:
+                    return self._clients[key]
+            return self._default
+
+    def get(self, key):
+        self._maybe_reload()
+        with self._lock:
+            return self._clients.get(key)
+
+    def set(self, key, roi=None, max_side=0):
+        entry = self._entry({"roi": roi, "max_side": max_side})
+        # ambil dulu perubahan worker lain supaya tidak tertimpa
+        self._maybe_reload(force=True)
+        with self._lock:
+            self._clients[key] = entry
+            self._save_locked()
+        return entry
+
+    def remove(self, key):
+        self._maybe_reload(force=True)
+        with self._lock:
+            entry = self._clients.pop(key, None)
+            if entry is not None:
+                self._save_locked()
+        return entry is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "default": self._default,
+                "clients": len(self._clients),
+                "reloads": self._reloads,
+            }
+
+
+class AdaptiveResolution:
+    """
+    Pilih sisi terpanjang frame inferensi dari `sizes` (besar -> kecil) berdasarkan
+    latensi terbaru (EWMA). Turun satu tingkat bila EWMA > budget_ms, naik satu tingkat
+    bila EWMA < budget_ms * headroom. Setelah berpindah, tunggu `hold_s` dan minimal
+    `min_samples` sampel di ukuran baru sebelum berpindah lagi (tidak bolak-balik).
+    budget_ms <= 0 -> nonaktif, selalu sizes[0].
+    """
+
+    def __init__(self, sizes=(640, 512, 416, 320), budget_ms=0.0, headroom=0.6, alpha=0.3,
+                 hold_s=2.0, min_samples=5):
+        self.sizes = sorted({int(s) for s in sizes if int(s) > 0}, reverse=True)
+        if not self.sizes:
+            raise ValueError("sizes kosong")
+        self.budget_ms = float(budget_ms)
+        self.headroom = float(headroom)
+        self.alpha = float(alpha)
+        self.hold_s = float(hold_s)
+        self.min_samples = int(min_samples)
+        self._lock = threading.Lock()
+        self._level = 0
+        self._ewma = None
+        self._samples = 0
+        self._changed_at = time.monotonic()
+        self._down = 0
+        self._up = 0
+
+    @property
+    def enabled(self):
+        return self.budget_ms > 0
+
+    def current(self):
+        return self.sizes[self._level]
+
+    def observe(self, latency_ms):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._ewma = latency_ms if self._ewma is None else self.alpha * latency_ms + (1 - self.alpha) * self._ewma
+            self._samples += 1
+            if self._samples < self.min_samples or time.monotonic() - self._changed_at < self.hold_s:
+                return
+            if self._ewma > self.budget_ms and self._level < len(self.sizes) - 1:
+                self._level += 1
+                self._down += 1
+            elif self._ewma < self.budget_ms * self.headroom and self._level > 0:
+                self._level -= 1
+                self._up += 1
+            else:
+                return
+            # latensi di ukuran lama tidak berlaku lagi
+            self._ewma = None
+            self._samples = 0
+            self._changed_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "budget_ms": self.budget_ms,
+                "sizes": self.sizes,
+                "current": self.sizes[self._level],
+                "ewma_ms": round(self._ewma, 3) if self._ewma is not None else None,
+                "steps_down": self._down,
+                "steps_up": self._up,
+            }
@@ -0,0 +1,191 @@
+# rekap harian penjualan (tanggal x nama_produk) yang di-update inkremental oleh /cetak
+# rebuild / backfill dari transaksi lama:
+#   python rollup.py                          -> semua tanggal
+#   python rollup.py --from 2025-01-01 --to 2025-01-31
+import os
+import argparse
+
+import psycopg2.extras
+from psycopg2 import sql
+
+from dbpool import ConnectionPool
+
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "port": int(os.environ.get("DB_PORT", 5432)),
+    "user": os.environ.get("DB_USER", "postgres"),
+    "password": os.environ.get("DB_PASS", "gajahbengkak"),
+    "dbname": os.environ.get("DB_NAME", "timbangandigitalai")
+}
+
+# batas hari mengikuti zona waktu toko, bukan zona waktu session Postgres
+ROLLUP_TZ = os.environ.get("ROLLUP_TZ", "Asia/Jakarta")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS transaksi_harian (
+        tanggal date NOT NULL,
+        nama_produk character varying(100) NOT NULL,
+        jumlah integer NOT NULL DEFAULT 0,
+        total_berat_kg numeric(14,3) NOT NULL DEFAULT 0,
+        total_harga bigint NOT NULL DEFAULT 0,
+        PRIMARY KEY (tanggal, nama_produk)
+    );
+"""
+
+# INSERT transaksi + upsert rekap dalam satu statement (satu round trip, satu transaksi)
+# -> (id, timestamp) transaksi baru
+INSERT_TRANSAKSI_SQL = """
+    WITH t AS (
+        INSERT INTO transaksi (nama_produk, berat_kg, harga_per_kg, total_harga, timestamp)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id, nama_produk, berat_kg, total_harga, timestamp
+    ), h AS (
+        INSERT INTO transaksi_harian AS h (tanggal, nama_produk, jumlah, total_berat_kg, total_harga)
+        SELECT (t.timestamp AT TIME ZONE %s)::date, t.nama_produk, 1, t.berat_kg, t.total_harga
+        FROM t
+        ON CONFLICT (tanggal, nama_produk) DO UPDATE SET
+            jumlah = h.jumlah + EXCLUDED.jumlah,
+            total_berat_kg = h.total_berat_kg + EXCLUDED.total_berat_kg,
+            total_harga = h.total_harga + EXCLUDED.total_harga
+    )
+    SELECT id, timestamp FROM t;
+"""
+
+# versi batch (sync kiosk): banyak transaksi dalam satu statement multi-row.
+# kunci idempotensi yang sudah ada dilewati (ON CONFLICT DO NOTHING); rekap diagregasi dulu
+# per (tanggal, produk) karena satu upsert tidak boleh mengenai baris yang sama dua kali.
+# Hasil: baris baru (created = true) + baris lama dengan kunci yang sama (created = false);
+# SELECT ke transaksi memakai snapshot awal statement, jadi baris dari `t` tidak ikut terbaca.
+INSERT_TRANSAKSI_BATCH_SQL = """
+    WITH v (idempotency_key, nama_produk, berat_kg, harga_per_kg, total_harga, timestamp) AS (
+        VALUES %s
+    ), t AS (
+        INSERT INTO transaksi (idempotency_key, nama_produk, berat_kg, harga_per_kg, total_harga, timestamp)
+        SELECT idempotency_key, nama_produk, berat_kg, harga_per_kg, total_harga, timestamp FROM v
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id, idempotency_key, nama_produk, berat_kg, total_harga, timestamp
+    ), h AS (
+        INSERT INTO transaksi_harian AS h (tanggal, nama_produk, jumlah, total_berat_kg, total_harga)
+        SELECT (t.timestamp AT TIME ZONE {tz})::date, t.nama_produk, count(*), sum(t.berat_kg), sum(t.total_harga)
+        FROM t
+        GROUP BY 1, 2
+        ON CONFLICT (tanggal, nama_produk) DO UPDATE SET
+            jumlah = h.jumlah + EXCLUDED.jumlah,
+            total_berat_kg = h.total_berat_kg + EXCLUDED.total_berat_kg,
+            total_harga = h.total_harga + EXCLUDED.total_harga
+    )
+    SELECT idempotency_key, id, timestamp, true AS created FROM t
+    UNION ALL
+    SELECT x.idempotency_key, x.id, x.timestamp, false FROM transaksi x JOIN v USING (idempotency_key)
+"""
+SELECT_BY_KEY_SQL = """
+    SELECT id, nama_produk, berat_kg, harga_per_kg, total_harga, timestamp
+    FROM transaksi
+    WHERE idempotency_key = %s
+"""
+
+BATCH_ROW_TEMPLATE = "(%s, %s, %s::numeric, %s::integer, %s::integer, %s::timestamptz)"
+
+SUMMARY_SQL = """
+    SELECT tanggal,
+           nama_produk,
+           jumlah,
+           total_berat_kg::float8 AS total_berat_kg,
+           total_harga
+    FROM transaksi_harian
+    WHERE tanggal BETWEEN %s AND %s
+"""
+
+
+def insert_transaksi(cur, nama_produk, berat_kg, harga_per_kg, total_harga, ts, tz=ROLLUP_TZ):
+    cur.execute(INSERT_TRANSAKSI_SQL, (nama_produk, berat_kg, harga_per_kg, total_harga, ts, tz))
+    return cur.fetchone()
+
+
+def insert_transaksi_batch(cur, rows, tz=ROLLUP_TZ):
+    """
+    rows: [(idempotency_key, nama_produk, berat_kg, harga_per_kg, total_harga, ts), ...] dengan
+    kunci unik. Return {idempotency_key: (id, timestamp, created)}; kunci yang tidak ada di hasil
+    sedang ditulis transaksi lain yang belum commit (tetap dianggap duplikat).
+    """
+    if not rows:
+        return {}
+    query = sql.SQL(INSERT_TRANSAKSI_BATCH_SQL).format(tz=sql.Literal(tz))
+    # page_size = semua baris -> tetap satu statement (satu round trip)
+    result = psycopg2.extras.execute_values(cur, query, rows, template=BATCH_ROW_TEMPLATE,
+                                            page_size=len(rows), fetch=True)
+    return {key: (trx_id, ts, created) for key, trx_id, ts, created in result}
+
+
+def fetch_by_key(cur, idempotency_key):
+    """Transaksi yang sudah tersimpan dengan kunci idempotensi ini (tuple SELECT_BY_KEY_SQL) atau None."""
+    cur.execute(SELECT_BY_KEY_SQL, (idempotency_key,))
+    return cur.fetchone()
+
+
+def fetch_summary(cur, start_date, end_date, nama_produk=None):
+    query = SUMMARY_SQL
+    params = [start_date, end_date]
+    if nama_produk:
+        query += " AND nama_produk = %s"
+        params.append(nama_produk)
+    query += " ORDER BY tanggal ASC, nama_produk ASC"
+    cur.execute(query, tuple(params))
+    return cur.fetchall()
+
+
+def rebuild(cur, start_date=None, end_date=None, tz=ROLLUP_TZ):
+    """Hitung ulang rekap dari transaksi (seluruhnya atau rentang tanggal tertentu)."""
+    day = "(timestamp AT TIME ZONE %s)::date"
+    where = ""
+    params = []
+    if start_date:
+        where += " AND tanggal >= %s"
+        params.append(start_date)
+    if end_date:
+        where += " AND tanggal <= %s"
+        params.append(end_date)
+    # kunci rekap selama rebuild supaya /cetak yang berjalan bersamaan tidak terhitung dobel/hilang
+    cur.execute("LOCK TABLE transaksi_harian IN EXCLUSIVE MODE")
+    cur.execute("DELETE FROM transaksi_harian WHERE TRUE" + where, tuple(params))
+
+    src_where = []
+    src_params = [tz]
+    if start_date:
+        src_where.append("timestamp >= (%s::date)::timestamp AT TIME ZONE %s")
+        src_params.extend([start_date, tz])
+    if end_date:
+        src_where.append("timestamp < (%s::date + 1)::timestamp AT TIME ZONE %s")
+        src_params.extend([end_date, tz])
+    cur.execute(
+        f"""
+        INSERT INTO transaksi_harian (tanggal, nama_produk, jumlah, total_berat_kg, total_harga)
+        SELECT {day} AS tanggal, nama_produk, COUNT(*), COALESCE(SUM(berat_kg), 0), COALESCE(SUM(total_harga), 0)
+        FROM transaksi
+        {"WHERE " + " AND ".join(src_where) if src_where else ""}
+        GROUP BY 1, 2
+        """,
+        tuple(src_params),
+    )
+    return cur.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild rekap harian transaksi_harian dari tabel transaksi")
+    parser.add_argument("--from", dest="start_date", help="YYYY-MM-DD (inklusif)")
+    parser.add_argument("--to", dest="end_date", help="YYYY-MM-DD (inklusif)")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(DB_CONFIG, minconn=0, maxconn=1)
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(CREATE_TABLE_SQL)
+        n = rebuild(cur, args.start_date, args.end_date)
+        conn.commit()
+        cur.close()
+    pool.closeall()
+    print(f"✅ Rekap harian dibangun ulang: {n} baris")
+
+
+if __name__ == "__main__":
+    main()
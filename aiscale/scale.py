@@ -0,0 +1,192 @@
+# pembaca timbangan: serial dibaca secepat data datang -> ring buffer + deteksi berat stabil
+import time
+import random
+import threading
+from collections import namedtuple
+
+# weight        : pembacaan mentah terakhir (-1.0 bila timbangan tidak terhubung)
+# average       : rata-rata bergerak dalam jendela stabil
+# stable        : True bila fluktuasi dalam jendela <= ambang selama >= stable_window_ms
+# stable_weight : berat stabil terakhir (yang dipakai untuk checkout)
+ScaleReading = namedtuple("ScaleReading", "weight average stable stable_weight ts connected")
+
+
+class ScaleReader:
+    """
+    Thread pembaca timbangan.
+    - tidak ada sleep di antara pembacaan serial: readline() ber-timeout pendek
+    - sampel (ts, berat) disimpan di ring buffer ukuran tetap
+    - reading() tanpa lock: state dipublikasikan sebagai tuple immutable
+    - port error -> reconnect otomatis dengan backoff
+    - on_reading(reading) dipanggil dari thread pembaca tiap reading baru (mis. mirror ke shared memory)
+    """
+
+    def __init__(self, port, baud_rate, simulate=False, buffer_size=256,
+                 stable_window_ms=500, stable_tolerance=0.005, read_timeout_s=0.1,
+                 simulate_hz=10.0, on_reading=None):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.simulate = simulate
+        self.stable_window_s = stable_window_ms / 1000.0
+        self.stable_tolerance = stable_tolerance
+        self.read_timeout_s = read_timeout_s
+        self.simulate_hz = simulate_hz
+        self.on_reading = on_reading
+
+        self._size = buffer_size
+        self._ts = [0.0] * buffer_size
+        self._values = [0.0] * buffer_size
+        self._count = 0  # total sampel yang pernah masuk; index = count % size
+
+        self._reading = ScaleReading(0.0, 0.0, False, 0.0, 0.0, False)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.connection = None
+        self.samples = 0
+        self.invalid_lines = 0
+        self.reconnects = 0
+
+    # -----------------------------
+    # hot path (tanpa lock)
+    # -----------------------------
+    def reading(self):
+        return self._reading
+
+    def stable_weight(self):
+        return self._reading.stable_weight
+
+    # -----------------------------
+    # ring buffer & stabilitas
+    # -----------------------------
+    def _push(self, value, now):
+        i = self._count % self._size
+        self._ts[i] = now
+        self._values[i] = value
+        self._count += 1
+        self.samples += 1
+
+        # kumpulkan sampel dalam jendela stabil (dari terbaru ke belakang)
+        n = min(self._count, self._size)
+        lo = hi = value
+        total = 0.0
+        k = 0
+        oldest = now
+        for j in range(n):
+            idx = (self._count - 1 - j) % self._size
+            t = self._ts[idx]
+            if now - t > self.stable_window_s:
+                break
+            v = self._values[idx]
+            lo = v if v < lo else lo
+            hi = v if v > hi else hi
+            total += v
+            k += 1
+            oldest = t
+        average = total / k if k else value
+        # jendela harus benar-benar terisi selama stable_window_s (sampel sebelum jendela ada)
+        covered = n > k or (now - oldest) >= self.stable_window_s
+        stable = covered and k >= 2 and (hi - lo) <= self.stable_tolerance
+
+        prev = self._reading
+        stable_weight = round(average, 3) if stable else prev.stable_weight
+        self._reading = ScaleReading(round(value, 3), round(average, 3), stable, stable_weight, time.time(), True)
+        if self.on_reading is not None:
+            self.on_reading(self._reading)
+
+    def _set_disconnected(self):
+        prev = self._reading
+        self._reading = ScaleReading(-1.0, prev.average, False, -1.0, time.time(), False)
+        if self.on_reading is not None:
+            self.on_reading(self._reading)
+
+    # -----------------------------
+    # sumber data
+    # -----------------------------
+    def _run_simulated(self):
+        target = round(random.uniform(0.1, 2.5), 3)
+        next_change = time.monotonic() + random.uniform(2.0, 5.0)
+        interval = 1.0 / self.simulate_hz
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            if now >= next_change:
+                target = round(random.uniform(0.1, 2.5), 3)
+                next_change = now + random.uniform(2.0, 5.0)
+            self._push(target + random.uniform(-0.001, 0.001), now)
+            self._stopped.wait(interval)
+
+    def _run_serial(self):
+        try:
+            import serial
+        except ImportError as e:
+            print("❌ Gagal terhubung ke timbangan:", e)
+            self._set_disconnected()
+            return
+        backoff = 0.5
+        while not self._stopped.is_set():
+            try:
+                self.connection = serial.Serial(self.port, self.baud_rate, timeout=self.read_timeout_s)
+                print(f"✅ Berhasil terhubung ke timbangan di port {self.port}")
+                backoff = 0.5
+                while not self._stopped.is_set():
+                    raw = self.connection.readline()
+                    if not raw:
+                        continue
+                    line = raw.decode("utf-8", errors="ignore").strip()
+                    if not line:
+                        continue
+                    try:
+                        value = float(line.split()[0])
+                    except (ValueError, IndexError):
+                        self.invalid_lines += 1
+                        print("⚠️ Format data dari timbangan tidak valid:", line)
+                        continue
+                    self._push(value, time.monotonic())
+            except Exception as e:
+                print("❌ Gagal terhubung ke timbangan:", e)
+                self._set_disconnected()
+                self.reconnects += 1
+                try:
+                    if self.connection is not None:
+                        self.connection.close()
+                except Exception:
+                    pass
+                self.connection = None
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 10.0)
+
+    def _run(self):
+        if self.simulate:
+            self._run_simulated()
+        else:
+            self._run_serial()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="scale-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        r = self._reading
+        return {
+            "running": self.is_running(),
+            "simulate": self.simulate,
+            "port": None if self.simulate else self.port,
+            "connected": r.connected,
+            "weight": r.weight,
+            "average": r.average,
+            "stable": r.stable,
+            "stable_weight": r.stable_weight,
+            "samples": self.samples,
+            "invalid_lines": self.invalid_lines,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,70 @@
+# DDL tambahan yang dibutuhkan app.py (idempotent, aman dijalankan tiap start)
+import psycopg2
+
+import rollup
+
+SCHEMA_STATEMENTS = [
+    # rekap harian (lihat rollup.py)
+    rollup.CREATE_TABLE_SQL,
+    # kunci idempotensi dari kiosk untuk sync batch (NULL untuk transaksi lewat /cetak)
+    "ALTER TABLE transaksi ADD COLUMN IF NOT EXISTS idempotency_key character varying(64);",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_transaksi_idempotency_key ON transaksi (idempotency_key);",
+]
+
+# index di tabel besar: CONCURRENTLY (tidak mengunci INSERT transaksi selama build), harus di luar
+# transaksi -> koneksi autocommit. (nama, DDL)
+CONCURRENT_INDEXES = [
+    # keyset pagination & filter rentang waktu di /api/riwayat
+    ("idx_transaksi_timestamp_id",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transaksi_timestamp_id ON transaksi (timestamp, id);"),
+]
+
+# build CONCURRENTLY yang gagal meninggalkan index INVALID; IF NOT EXISTS akan melewatinya selamanya
+INVALID_INDEX_SQL = """
+SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace AND NOT i.indisvalid;
+"""
+
+# beberapa worker gunicorn start bersamaan: DDL dijalankan bergiliran (kunci dilepas saat commit)
+SCHEMA_LOCK_ID = 0x61697363616c65  # "aiscale"
+
+
+def ensure_schema(pool):
+    """Jalankan SCHEMA_STATEMENTS; gagal -> print peringatan, app tetap jalan."""
+    try:
+        with pool.connection() as db:
+            cur = db.cursor()
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+            for stmt in SCHEMA_STATEMENTS:
+                cur.execute(stmt)
+            db.commit()
+            cur.close()
+        ensure_indexes(pool)
+        return True
+    except (psycopg2.Error, OSError) as e:
+        print("⚠️ Peringatan: gagal menyiapkan schema tambahan:", e)
+        return False
+
+
+def ensure_indexes(pool):
+    with pool.connection() as db:
+        db.autocommit = True
+        try:
+            cur = db.cursor()
+            # try-lock (tanpa menunggu): CONCURRENTLY menunggu semua transaksi lain yang memegang
+            # snapshot, termasuk worker yang sedang antre lock ini -> worker lain cukup melewati
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                return
+            try:
+                for name, stmt in CONCURRENT_INDEXES:
+                    cur.execute(INVALID_INDEX_SQL, (name,))
+                    if cur.fetchone() is not None:
+                        print("⚠️ Index %s INVALID (build sebelumnya gagal), dibuat ulang" % name)
+                        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS %s;" % name)
+                    cur.execute(stmt)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_ID,))
+                cur.close()
+        finally:
+            db.autocommit = False
@@ -0,0 +1,646 @@
+# state bersama untuk mode multi-worker (gunicorn, AISCALE_MULTIWORKER=1, lihat gunicorn.conf.py)
+# - satu proses owner (`python sharedstate.py serve`) memegang timbangan (port serial dibuka sekali),
+#   latest_detection / client_last_ts dan server SSE status
+# - berat timbangan dicerminkan owner ke SharedMemory kecil (seqlock): worker membaca tanpa round trip
+# - state per client lewat RPC di socket lokal ber-authkey (multiprocessing.connection), satu koneksi per thread
+# - master gunicorn hanya men-spawn + mengawasi owner (StateOwner), tidak menyentuh SharedMemory
+#   supaya worker hasil fork tidak berbagi resource tracker dengan master
+import os
+import sys
+import json
+import atexit
+import time
+import signal
+import struct
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener, Client, arbitrary_address
+
+from scale import ScaleReading
+
+ENV_MULTIWORKER = "AISCALE_MULTIWORKER"
+ENV_MASTER_PID = "AISCALE_MASTER_PID"
+ENV_ADDRESS = "AISCALE_STATE_ADDRESS"
+ENV_AUTHKEY = "AISCALE_STATE_AUTHKEY"
+ENV_SHM = "AISCALE_STATE_SHM"
+ENV_CFG = "AISCALE_STATE_CFG"
+
+_MISSING = object()
+
+
+class StateUnavailable(RuntimeError):
+    pass
+
+
+def multiworker_enabled():
+    return os.environ.get(ENV_MULTIWORKER, "0") == "1"
+
+
+def is_preload_master():
+    # gunicorn.conf.py mencatat pid master sebelum app di-import (preload_app)
+    return os.environ.get(ENV_MASTER_PID) == str(os.getpid())
+
+
+def client_status(store, reading, client_id):
+    """Isi /api/status dan event SSE: status deteksi client + berat stabil terakhir."""
+    # fallback: try server-side video feed key
+    status = store.get(client_id or "server")
+    if status is None:
+        status = {
+            "detection": "-",
+            "ts": datetime.now(tz=ZoneInfo("Asia/Jakarta")).isoformat()
+        }
+    return dict(status, weight=reading.stable_weight, stable=reading.stable)
+
+
+def disconnected_reading():
+    return ScaleReading(-1.0, 0.0, False, -1.0, time.time(), False)
+
+
+# -----------------------------
+# berat timbangan di SharedMemory
+# -----------------------------
+# heartbeat (d) | seq (Q, ganjil = sedang ditulis) | weight, average, stable_weight, ts (dddd) | stable, connected (??)
+_BEAT = struct.Struct("<d")
+_SEQ = struct.Struct("<Q")
+_DATA = struct.Struct("<dddd??")
+_SEQ_OFFSET = _BEAT.size
+_DATA_OFFSET = _SEQ_OFFSET + _SEQ.size
+SHM_SIZE = _DATA_OFFSET + _DATA.size
+
+
+def attach_shm(name):
+    # import di sini: procpool menarik numpy, proses owner tidak membutuhkannya
+    from procpool import attach_shm as attach
+    return attach(name)
+
+
+class SharedWeight:
+    """
+    Satu penulis (thread timbangan di owner), banyak pembaca (worker).
+    write(): seq ganjil -> data -> seq genap; read() mengulang bila seq ganjil / berubah.
+    beat(): heartbeat owner, dipakai pembaca untuk mendeteksi owner mati / segmen lama.
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.name = shm.name
+        self._seq = 0
+
+    @classmethod
+    def create(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=SHM_SIZE)
+        except FileExistsError:
+            # sisa owner sebelumnya yang belum dibersihkan resource tracker-nya
+            stale = attach_shm(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=SHM_SIZE)
+        shm.buf[:SHM_SIZE] = bytes(SHM_SIZE)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(attach_shm(name))
+
+    def write(self, reading):
+        buf = self.shm.buf
+        self._seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self._seq)
+        _DATA.pack_into(buf, _DATA_OFFSET, reading.weight, reading.average, reading.stable_weight,
+                        reading.ts, reading.stable, reading.connected)
+        self._seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self._seq)
+
+    def beat(self, now=None):
+        _BEAT.pack_into(self.shm.buf, 0, time.time() if now is None else now)
+
+    def read(self):
+        """Return (ScaleReading atau None bila belum pernah ditulis, heartbeat)."""
+        buf = self.shm.buf
+        for _ in range(100):
+            seq = _SEQ.unpack_from(buf, _SEQ_OFFSET)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            data = _DATA.unpack_from(buf, _DATA_OFFSET)
+            if _SEQ.unpack_from(buf, _SEQ_OFFSET)[0] == seq:
+                break
+        else:
+            return None, _BEAT.unpack_from(buf, 0)[0]
+        beat = _BEAT.unpack_from(buf, 0)[0]
+        if seq == 0:
+            return None, beat
+        weight, average, stable_weight, ts, stable, connected = data
+        return ScaleReading(weight, average, stable, stable_weight, ts, connected), beat
+
+    def close(self):
+        self.shm.close()
+
+
+# -----------------------------
+# sisi worker
+# -----------------------------
+class StateClient:
+    """
+    RPC ke owner. Alamat/authkey dibaca dari env saat koneksi pertama (env di-set master
+    sebelum fork). Satu koneksi per thread (dan per pid: koneksi tidak dibawa lintas fork).
+    Gagal -> sambung ulang sekali, lalu StateUnavailable.
+    """
+
+    def __init__(self, timeout_s=2.0):
+        self.timeout_s = timeout_s
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.available = True
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        address = os.environ.get(ENV_ADDRESS)
+        if not address:
+            raise StateUnavailable(f"{ENV_ADDRESS} belum di-set (owner state tidak dijalankan)")
+        conn = Client(address, authkey=bytes.fromhex(os.environ.get(ENV_AUTHKEY, "")))
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        with self._lock:
+            self.reconnects += 1
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None and self._local.pid == os.getpid():
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, op, *args):
+        error = None
+        for _ in range(2):
+            try:
+                conn = self._conn()
+                conn.send((op,) + args)
+                if not conn.poll(self.timeout_s):
+                    # jawaban yang terlambat akan membuat koneksi tidak sinkron -> buang
+                    raise TimeoutError(f"owner state tidak menjawab {op} dalam {self.timeout_s} s")
+                status, value = conn.recv()
+            except (OSError, EOFError, TimeoutError) as e:
+                self._drop()
+                error = e
+                continue
+            with self._lock:
+                self.calls += 1
+                if not self.available:
+                    self.available = True
+                    print("✅ Owner state tersambung lagi")
+            if status == "error":
+                raise RuntimeError(value)
+            return value
+        with self._lock:
+            self.errors += 1
+            if self.available:
+                self.available = False
+                print("⚠️ Owner state tidak bisa dihubungi:", error)
+        raise StateUnavailable(str(error))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "address": os.environ.get(ENV_ADDRESS),
+                "available": self.available,
+                "calls": self.calls,
+                "errors": self.errors,
+                "connections": self.reconnects,
+            }
+
+
+class RemoteStateStore:
+    """
+    Antarmuka sama dengan ClientStateStore, data disimpan di owner.
+    Owner tidak terjangkau -> fail-soft: get() = default, set() diabaikan,
+    check_interval() = True (rate limit dilewati daripada semua frame ditolak).
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get(self, key, default=None):
+        try:
+            found, value = self.client.call("get", self.name, key)
+        except StateUnavailable:
+            return default
+        return value if found else default
+
+    def set(self, key, value):
+        try:
+            self.client.call("set", self.name, key, value)
+        except StateUnavailable:
+            pass
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def pop(self, key, default=None):
+        try:
+            found, value = self.client.call("pop", self.name, key)
+        except StateUnavailable:
+            return default
+        return value if found else default
+
+    def check_interval(self, key, min_interval_s, now=None):
+        now = time.time() if now is None else now
+        try:
+            return self.client.call("check_interval", self.name, key, min_interval_s, now)
+        except StateUnavailable:
+            return True
+
+    def sweep(self):
+        # owner yang menyapu store-nya sendiri
+        pass
+
+    def __len__(self):
+        try:
+            return self.client.call("len", self.name)
+        except StateUnavailable:
+            return 0
+
+    def stats(self):
+        try:
+            stats = self.client.call("stats", self.name)
+        except StateUnavailable as e:
+            stats = {"name": self.name, "error": str(e)}
+        return dict(stats, remote=True)
+
+
+class RemoteScale:
+    """
+    Pengganti ScaleReader di worker: reading() dari SharedMemory milik owner.
+    Heartbeat lebih tua dari stale_s -> owner mati / diganti: segmen dibuka ulang
+    (owner baru membuat segmen dengan nama yang sama), sementara itu dilaporkan tidak terhubung.
+    """
+
+    def __init__(self, client, stale_s=2.0, retry_s=1.0):
+        self.client = client
+        self.stale_s = stale_s
+        self.retry_s = retry_s
+        self._lock = threading.Lock()
+        self._weight = None
+        self._retry_at = 0.0
+        self.reattaches = 0
+
+    def _attach(self, force=False):
+        with self._lock:
+            if (self._weight is None or force) and time.monotonic() >= self._retry_at:
+                self._retry_at = time.monotonic() + self.retry_s
+                name = os.environ.get(ENV_SHM)
+                try:
+                    # segmen lama tidak di-close: thread lain mungkin masih membacanya (dilepas oleh GC)
+                    self._weight = SharedWeight.attach(name) if name else None
+                    self.reattaches += 1
+                except (FileNotFoundError, ValueError):
+                    self._weight = None
+            return self._weight
+
+    def _fresh(self, weight):
+        if weight is None:
+            return None
+        reading, beat = weight.read()
+        if reading is None or time.time() - beat > self.stale_s:
+            return None
+        return reading
+
+    def reading(self):
+        reading = self._fresh(self._attach())
+        if reading is None:
+            reading = self._fresh(self._attach(force=True))
+        return reading if reading is not None else disconnected_reading()
+
+    def stable_weight(self):
+        return self.reading().stable_weight
+
+    def start(self):
+        # timbangan dijalankan owner
+        pass
+
+    def stop(self, timeout=2.0):
+        pass
+
+    def is_running(self):
+        return self._fresh(self._attach()) is not None
+
+    def stats(self):
+        try:
+            stats = self.client.call("scale_stats")
+        except StateUnavailable as e:
+            reading = self.reading()
+            stats = {"connected": reading.connected, "weight": reading.weight, "error": str(e)}
+        return dict(stats, shared=True)
+
+
+class RemoteStatusHub:
+    """Server SSE berjalan di owner; publish() tidak perlu karena owner publish sendiri saat latest_detection di-set."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def publish(self, client_id):
+        pass
+
+    def start(self):
+        pass
+
+    def stats(self):
+        try:
+            stats = self.client.call("hub_stats")
+        except StateUnavailable as e:
+            stats = {"running": False, "error": str(e)}
+        return dict(stats, owner=True)
+
+
+# -----------------------------
+# proses owner
+# -----------------------------
+class StateServer:
+    """Store, timbangan dan hub SSE milik owner + dispatcher RPC dari worker."""
+
+    def __init__(self, stores, scale, weight, hub=None):
+        self.stores = stores
+        self.scale = scale
+        self.weight = weight
+        self.hub = hub
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    def status(self, client_id):
+        return client_status(self.stores["latest_detection"], self.scale.reading(), client_id)
+
+    def weight_state(self):
+        reading = self.scale.reading()
+        return reading.stable_weight, reading.stable
+
+    def handle(self, op, args):
+        if op == "get":
+            value = self.stores[args[0]].get(args[1], _MISSING)
+            return (False, None) if value is _MISSING else (True, value)
+        if op == "set":
+            name, key, value = args
+            self.stores[name].set(key, value)
+            if name == "latest_detection" and self.hub is not None:
+                self.hub.publish(key)
+            return None
+        if op == "pop":
+            value = self.stores[args[0]].pop(args[1], _MISSING)
+            return (False, None) if value is _MISSING else (True, value)
+        if op == "check_interval":
+            name, key, min_interval_s, now = args
+            return self.stores[name].check_interval(key, min_interval_s, now)
+        if op == "len":
+            return len(self.stores[args[0]])
+        if op == "stats":
+            return self.stores[args[0]].stats()
+        if op == "scale_stats":
+            return self.scale.stats()
+        if op == "hub_stats":
+            return self.hub.stats() if self.hub is not None else {"running": False}
+        if op == "ping":
+            return {"pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1),
+                    "connections": self.connections, "requests": self.requests}
+        raise ValueError(f"op tidak dikenal: {op}")
+
+    def serve_connection(self, conn):
+        with self._lock:
+            self.connections += 1
+        try:
+            while True:
+                msg = conn.recv()
+                try:
+                    reply = ("ok", self.handle(msg[0], msg[1:]))
+                except Exception as e:
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                with self._lock:
+                    self.requests += 1
+                conn.send(reply)
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self.connections -= 1
+            conn.close()
+
+    def accept_loop(self, listener, stopped):
+        while not stopped.is_set():
+            try:
+                conn = listener.accept()
+            except Exception:
+                if stopped.is_set():
+                    return
+                continue
+            threading.Thread(target=self.serve_connection, args=(conn,), name="state-conn", daemon=True).start()
+
+    def housekeeping(self, stopped, beat_s=0.5, sweep_s=30.0):
+        next_sweep = time.monotonic() + sweep_s
+        while True:
+            self.weight.beat()
+            if stopped.wait(beat_s):
+                return
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + sweep_s
+                for store in self.stores.values():
+                    store.sweep()
+
+
+def build_server(cfg, weight):
+    import jwt
+    from clientstate import ClientStateStore
+    from scale import ScaleReader
+    from statusstream import StatusHub
+    from authcache import TokenCache
+
+    cs = cfg["client_state"]
+    stores = {
+        "latest_detection": ClientStateStore(cs["ttl_s"], cs["max_entries"], cs["shards"], name="latest_detection"),
+        # waktu request terakhir per client untuk batas MIN_INTERVAL_S (cukup disimpan sebentar)
+        "client_last_ts": ClientStateStore(60, cs["max_entries"], cs["shards"], name="client_last_ts"),
+    }
+    scale = ScaleReader(on_reading=weight.write, **cfg["scale"])
+    server = StateServer(stores, scale, weight)
+
+    ss = cfg["status_stream"]
+    if ss["enabled"]:
+        secret, algo = cfg["jwt"]["secret"], cfg["jwt"]["algorithm"]
+        tokens = TokenCache(lambda token: jwt.decode(token, secret, algorithms=[algo]), max_entries=cfg["jwt"]["cache_size"])
+
+        def verify_token(token):
+            if not token:
+                raise jwt.InvalidTokenError("token missing")
+            return tokens.decode(token)
+
+        server.hub = StatusHub(server.status, server.weight_state, verify_token, port=ss["port"],
+                               coalesce_ms=ss["coalesce_ms"], heartbeat_s=ss["heartbeat_s"])
+    return server
+
+
+def serve(address, authkey, shm_name, cfg):
+    """Loop proses owner; berhenti saat SIGTERM/SIGINT atau master (parent) hilang."""
+    parent = os.getppid()
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *a: stopped.set())
+    # Ctrl+C di terminal juga sampai ke owner: biarkan master yang menghentikannya lewat SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    weight = SharedWeight.create(shm_name)
+    if not address.startswith("\\\\") and os.path.exists(address):
+        os.unlink(address)  # socket owner sebelumnya
+    listener = Listener(address, authkey=authkey)
+    try:
+        server = build_server(cfg, weight)
+        server.scale.start()
+        if server.hub is not None:
+            server.hub.start()
+        threading.Thread(target=server.housekeeping, args=(stopped,), name="state-housekeeping", daemon=True).start()
+        threading.Thread(target=server.accept_loop, args=(listener, stopped), name="state-accept", daemon=True).start()
+        print(f"✅ Owner state siap (pid {os.getpid()}, {address})")
+        while not stopped.wait(1.0):
+            if os.getppid() != parent:
+                print("⚠️ Master hilang, owner state berhenti")
+                break
+        server.scale.stop()
+    finally:
+        stopped.set()
+        try:
+            # socket dihapus di sini saja (StateOwner.stop tidak menyentuhnya); tetap toleran bila
+            # sudah hilang, supaya SharedMemory di bawah tetap di-unlink
+            listener.close()
+        except OSError as e:
+            print("⚠️ Gagal menutup socket owner state:", e)
+        finally:
+            try:
+                weight.close()
+            finally:
+                weight.shm.unlink()
+    return 0
+
+
+# -----------------------------
+# sisi master gunicorn
+# -----------------------------
+class StateOwner:
+    """
+    Spawn + awasi proses owner dari master gunicorn (on_starting). Alamat socket, authkey
+    dan nama SharedMemory di-set di os.environ supaya diwarisi worker hasil fork.
+    Owner mati -> di-spawn ulang dengan backoff; state client (latest_detection dll.) ikut hilang,
+    berat timbangan terisi lagi dari pembacaan berikutnya.
+    """
+
+    def __init__(self, cfg, startup_timeout_s=15.0, health_interval_s=1.0):
+        self.cfg = cfg
+        self.startup_timeout_s = startup_timeout_s
+        self.health_interval_s = health_interval_s
+        self.address = None
+        self.process = None
+        self.restarts = 0
+        self._dir = None
+        self._started_at = 0.0
+        self._stopped = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        if sys.platform == "win32":
+            self.address = arbitrary_address("AF_PIPE")
+        else:
+            self._dir = tempfile.mkdtemp(prefix="aiscale-")
+            self.address = os.path.join(self._dir, "state.sock")
+        os.environ[ENV_ADDRESS] = self.address
+        os.environ[ENV_AUTHKEY] = os.urandom(16).hex()
+        os.environ[ENV_SHM] = f"aiscale_{os.getpid()}_{os.urandom(4).hex()}"
+        # master bisa keluar tanpa hook on_exit (mis. gagal bind port)
+        atexit.register(self.stop)
+        self._spawn()
+        self.wait_ready()
+        self._monitor = threading.Thread(target=self._monitor_loop, name="state-owner-monitor", daemon=True)
+        self._monitor.start()
+        return self
+
+    def _spawn(self):
+        env = dict(os.environ, **{ENV_CFG: json.dumps(self.cfg)})
+        self._started_at = time.monotonic()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve"], env=env)
+
+    def wait_ready(self):
+        # Client() baru berhasil setelah owner menjalankan accept loop (handshake authkey)
+        authkey = bytes.fromhex(os.environ[ENV_AUTHKEY])
+        deadline = time.monotonic() + self.startup_timeout_s
+        while True:
+            if self.process.poll() is not None:
+                raise StateUnavailable(f"owner state keluar saat start (exit code {self.process.returncode})")
+            try:
+                Client(self.address, authkey=authkey).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise StateUnavailable("owner state tidak siap dalam %.0f s" % self.startup_timeout_s)
+                time.sleep(0.1)
+
+    def _monitor_loop(self):
+        while not self._stopped.wait(self.health_interval_s):
+            if self.process.poll() is None:
+                continue
+            # backoff 1, 2, 4, ... maks 30 detik sejak start terakhir
+            if time.monotonic() - self._started_at < min(30.0, 2.0 ** self.restarts):
+                continue
+            # exit code tidak bisa dipercaya: master gunicorn ikut me-reap child lewat SIGCHLD
+            print("⚠️ Owner state berhenti, di-restart")
+            self.restarts += 1
+            self._spawn()
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait(timeout)
+        if self._dir is not None:
+            # socket milik owner (dihapus oleh listener.close() di serve()); SIGTERM ke process
+            # group bisa membuat stop() jalan saat owner masih menutup -> tunggu sebentar lalu
+            # hapus direktori kosongnya saja (owner di-kill: socket tersisa, rmdir gagal dibiarkan)
+            deadline = time.monotonic() + timeout
+            while os.path.exists(self.address) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            try:
+                os.rmdir(self._dir)
+            except OSError:
+                pass
+
+
+def main(argv):
+    # python sharedstate.py serve  (dijalankan oleh StateOwner, konfigurasi lewat env)
+    if argv != ["serve"]:
+        print("usage: python sharedstate.py serve")
+        return 2
+    cfg = json.loads(os.environ.pop(ENV_CFG))
+    authkey = bytes.fromhex(os.environ[ENV_AUTHKEY])
+    return serve(os.environ[ENV_ADDRESS], authkey, os.environ[ENV_SHM], cfg)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
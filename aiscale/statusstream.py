@@ -0,0 +1,201 @@
+# push status per client_id lewat Server-Sent Events
+# semua subscriber dilayani satu event loop asyncio (satu thread), bukan satu thread per koneksi
+#   GET http://<host>:<STATUS_STREAM_PORT>/api/status/stream?client_id=<uuid>&token=<jwt>
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+STREAM_PATH = "/api/status/stream"
+
+
+class _Subscriber:
+    __slots__ = ("client_id", "wake", "last_key")
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.wake = asyncio.Event()
+        self.last_key = None
+
+
+class StatusHub:
+    """
+    - snapshot_fn(client_id) -> dict status (sama dengan /api/status)
+    - weight_fn() -> (stable_weight, stable), dicek tiap weight_poll_s untuk semua subscriber sekaligus
+    - verify_fn(token) -> raise bila token tidak valid
+    - publish(client_id) dipanggil dari thread Flask saat deteksi client berubah
+    Event hanya dikirim bila (detection, weight, stable) berubah; update beruntun dalam
+    coalesce_ms digabung jadi satu event; heartbeat komentar SSE tiap heartbeat_s.
+    """
+
+    def __init__(self, snapshot_fn, weight_fn, verify_fn, host="0.0.0.0", port=4001,
+                 coalesce_ms=100, heartbeat_s=15.0, weight_poll_s=0.1):
+        self.snapshot_fn = snapshot_fn
+        self.weight_fn = weight_fn
+        self.verify_fn = verify_fn
+        self.host = host
+        self.port = port
+        self.coalesce_s = coalesce_ms / 1000.0
+        self.heartbeat_s = heartbeat_s
+        self.weight_poll_s = weight_poll_s
+
+        self._loop = None
+        self._thread = None
+        self._subs = {}  # client_id -> set(_Subscriber)
+        self._events_sent = 0
+        self._publishes = 0
+
+    # -----------------------------
+    # API dari thread lain
+    # -----------------------------
+    def publish(self, client_id):
+        loop = self._loop
+        if loop is None or client_id not in self._subs:
+            return
+        self._publishes += 1
+        loop.call_soon_threadsafe(self._wake_client, client_id)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="status-stream", daemon=True)
+        self._thread.start()
+        ready.wait(5.0)
+
+    def stats(self):
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "port": self.port,
+            "clients": len(self._subs),
+            "subscribers": sum(len(s) for s in list(self._subs.values())),
+            "events_sent": self._events_sent,
+            "publishes": self._publishes,
+        }
+
+    # -----------------------------
+    # event loop
+    # -----------------------------
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            print(f"⚠️ Status stream tidak bisa listen di port {self.port}:", e)
+            ready.set()
+            return
+        self._loop = loop
+        print(f"✅ Status stream (SSE) di port {self.port}{STREAM_PATH}")
+        ready.set()
+        loop.create_task(self._watch_weight())
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+
+    def _wake_client(self, client_id):
+        for sub in self._subs.get(client_id, ()):
+            sub.wake.set()
+
+    async def _watch_weight(self):
+        last = None
+        while True:
+            await asyncio.sleep(self.weight_poll_s)
+            try:
+                current = tuple(self.weight_fn())
+            except Exception:
+                continue
+            if current != last:
+                last = current
+                for subs in self._subs.values():
+                    for sub in subs:
+                        sub.wake.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10.0)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2:
+                return
+            method, target = parts[0], parts[1]
+            url = urlsplit(target)
+            if method == "OPTIONS":
+                await self._write_head(writer, "204 No Content", "text/plain")
+                return
+            if method != "GET" or url.path != STREAM_PATH:
+                await self._write_head(writer, "404 Not Found", "text/plain")
+                return
+            query = parse_qs(url.query)
+            client_id = (query.get("client_id") or [""])[0]
+            token = (query.get("token") or [""])[0]
+            if not client_id:
+                await self._write_head(writer, "400 Bad Request", "text/plain")
+                return
+            try:
+                self.verify_fn(token)
+            except Exception:
+                await self._write_head(writer, "401 Unauthorized", "text/plain")
+                return
+            await self._stream(writer, client_id)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _write_head(self, writer, status, content_type):
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Access-Control-Allow-Headers: *\r\n"
+            "X-Accel-Buffering: no\r\n"
+            f"Connection: {'keep-alive' if content_type == 'text/event-stream' else 'close'}\r\n"
+            "\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+    async def _stream(self, writer, client_id):
+        sub = _Subscriber(client_id)
+        self._subs.setdefault(client_id, set()).add(sub)
+        try:
+            await self._write_head(writer, "200 OK", "text/event-stream")
+            writer.write(b"retry: 3000\n\n")
+            await self._send_if_changed(writer, sub)
+            while True:
+                try:
+                    await asyncio.wait_for(sub.wake.wait(), self.heartbeat_s)
+                except asyncio.TimeoutError:
+                    writer.write(f": ping {int(time.time())}\n\n".encode("utf-8"))
+                    await writer.drain()
+                    continue
+                # coalescing: tunggu sebentar supaya update beruntun jadi satu event
+                await asyncio.sleep(self.coalesce_s)
+                sub.wake.clear()
+                await self._send_if_changed(writer, sub)
+        finally:
+            subs = self._subs.get(client_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    self._subs.pop(client_id, None)
+
+    async def _send_if_changed(self, writer, sub):
+        status = self.snapshot_fn(sub.client_id)
+        key = (status.get("detection"), status.get("weight"), status.get("stable"))
+        if key == sub.last_key:
+            return
+        sub.last_key = key
+        data = json.dumps(status, separators=(",", ":"), default=str)
+        writer.write(f"event: status\ndata: {data}\n\n".encode("utf-8"))
+        await writer.drain()
+        self._events_sent += 1
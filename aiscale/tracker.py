@@ -0,0 +1,245 @@
+# deteksi keyframe + tracking ringan per client: YOLO penuh tiap N frame (atau bila tracking
+# tidak yakin lagi), frame di antaranya box digeser dengan optical flow (Lucas-Kanade)
+import time
+import threading
+
+import cv2
+import numpy as np
+
+from clientstate import ClientStateStore
+
+
+def iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class _Track:
+    __slots__ = ("id", "box", "cls", "label", "conf", "votes", "classes", "points")
+
+    def __init__(self, track_id):
+        self.id = track_id
+        self.votes = {}    # label -> skor (conf, meluruh tiap keyframe)
+        self.classes = {}  # label -> cls
+        self.points = None
+
+    def observe(self, det, vote_decay):
+        self.box = (det["x1"], det["y1"], det["x2"], det["y2"])
+        self.conf = det["conf"]
+        for label in self.votes:
+            self.votes[label] *= vote_decay
+        self.votes[det["label"]] = self.votes.get(det["label"], 0.0) + det["conf"]
+        self.classes[det["label"]] = det["cls"]
+        # label stabil = skor terbesar, jadi satu keyframe yang salah kelas tidak langsung mengganti label
+        self.label = max(self.votes, key=self.votes.get)
+        self.cls = self.classes[self.label]
+
+    def detection(self):
+        x1, y1, x2, y2 = self.box
+        return {
+            "cls": self.cls, "label": self.label, "conf": round(self.conf, 4),
+            "x1": round(x1, 1), "y1": round(y1, 1), "x2": round(x2, 1), "y2": round(y2, 1),
+            "track_id": self.id,
+        }
+
+
+class _ClientTracks:
+    __slots__ = ("tracks", "gray", "sig", "transform", "since_key", "key_ts", "next_id")
+
+    def __init__(self):
+        self.tracks = []
+        self.gray = None
+        self.sig = None
+        self.transform = None
+        self.since_key = 0
+        self.key_ts = 0.0
+        self.next_id = 1
+
+
+class KeyframeTracker:
+    """
+    State tracking per client_id. Alur per frame (koordinat box = frame asli,
+    optical flow dihitung di frame inferensi hasil crop ROI / resize):
+      propagate() -> boxes hasil geser optical flow, atau None bila perlu keyframe:
+        - sudah `interval` frame sejak keyframe / keyframe lebih tua dari max_age_s
+        - ukuran frame inferensi / ROI berubah
+        - scene berubah: >= scene_fraction sel grid 32x32 berselisih >= scene_threshold
+          (barang baru di tray kosong tetap memicu YOLO walau kecil)
+        - track kehilangan titik yang dilacak, atau conf-nya turun di bawah min_conf
+      track tanpa titik fitur (objek polos) dianggap diam: box tetap, conf tetap meluruh.
+      update() -> dipanggil dengan hasil YOLO keyframe; dicocokkan ke track lama (IoU)
+        supaya track_id dan label (voting beberapa keyframe) stabil antar frame.
+    conf track meluruh `decay` per frame propagasi (lebih cepat bila flow buruk).
+    """
+
+    def __init__(self, interval=8, min_conf=0.5, decay=0.97, max_age_s=1.0, scene_threshold=20.0,
+                 scene_fraction=0.02, match_iou=0.3, vote_decay=0.7, max_points=24, enabled_default=False, store=None):
+        self.interval = max(1, int(interval))
+        self.min_conf = float(min_conf)
+        self.decay = float(decay)
+        self.max_age_s = float(max_age_s)
+        self.scene_threshold = float(scene_threshold)
+        self.scene_fraction = float(scene_fraction)
+        self.match_iou = float(match_iou)
+        self.vote_decay = float(vote_decay)
+        self.max_points = int(max_points)
+        self.enabled_default = enabled_default
+        self.entries = store if store is not None else ClientStateStore(30, name="tracks")
+        self._lock = threading.Lock()
+        self._keyframes = 0
+        self._propagated = 0
+        self._reasons = {}
+
+    @staticmethod
+    def _gray(frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    @staticmethod
+    def _signature(gray):
+        return cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _to_infer(box, transform):
+        ox, oy, scale = transform
+        return ((box[0] - ox) * scale, (box[1] - oy) * scale, (box[2] - ox) * scale, (box[3] - oy) * scale)
+
+    def _features(self, gray, box, transform):
+        h, w = gray.shape[:2]
+        x1, y1, x2, y2 = self._to_infer(box, transform)
+        # bagian dalam box saja: tepi box sering berisi latar (tray) yang tidak ikut bergerak
+        mx, my = (x2 - x1) * 0.1, (y2 - y1) * 0.1
+        x1, y1 = max(0, int(x1 + mx)), max(0, int(y1 + my))
+        x2, y2 = min(w, int(x2 - mx)), min(h, int(y2 - my))
+        if x2 - x1 < 4 or y2 - y1 < 4:
+            return None
+        mask = np.zeros_like(gray)
+        mask[y1:y2, x1:x2] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=self.max_points, qualityLevel=0.01,
+                                       minDistance=3, mask=mask)
+
+    def _need_keyframe(self, reason):
+        with self._lock:
+            self._reasons[reason] = self._reasons.get(reason, 0) + 1
+        return None
+
+    def propagate(self, client_id, infer_frame, transform):
+        """Return list detections (koordinat frame asli) atau None bila frame ini harus keyframe."""
+        state = self.entries.get(client_id)
+        if state is None or state.gray is None:
+            return self._need_keyframe("new")
+        if state.since_key + 1 >= self.interval:
+            return self._need_keyframe("interval")
+        if time.monotonic() - state.key_ts > self.max_age_s:
+            return self._need_keyframe("age")
+        gray = self._gray(infer_frame)
+        if gray.shape != state.gray.shape or transform != state.transform:
+            return self._need_keyframe("resize")
+        sig = self._signature(gray)
+        if float(np.mean(cv2.absdiff(sig, state.sig) >= self.scene_threshold)) >= self.scene_fraction:
+            return self._need_keyframe("scene")
+
+        # hitung ke nilai sementara dulu: bila satu track gagal (return None), state track
+        # lain tidak boleh sudah tergeser / meluruh setengah jalan
+        updates = {}
+        tracks = []
+        for t in state.tracks:
+            if t.points is None or not len(t.points):
+                conf = t.conf * self.decay
+                if conf < self.min_conf:
+                    return self._need_keyframe("conf")
+                updates[t.id] = (t.box, conf, t.points)
+            else:
+                tracks.append(t)
+        if tracks:
+            p0 = np.concatenate([t.points for t in tracks]).astype(np.float32)
+            p1, status, _ = cv2.calcOpticalFlowPyrLK(state.gray, gray, p0, None, winSize=(15, 15), maxLevel=2)
+            if p1 is None:
+                return self._need_keyframe("lost")
+            status = status.reshape(-1).astype(bool)
+            scale = transform[2]
+            start = 0
+            for t in tracks:
+                n = len(t.points)
+                ok = status[start:start + n]
+                moved = (p1[start:start + n] - p0[start:start + n]).reshape(-1, 2)[ok]
+                new_points = p1[start:start + n][ok]
+                start += n
+                if len(moved) < min(3, n):
+                    return self._need_keyframe("lost")
+                # geser box dengan median perpindahan titik (tahan terhadap titik yang salah lacak)
+                dx, dy = (float(v) / scale for v in np.median(moved, axis=0))
+                x1, y1, x2, y2 = t.box
+                # makin sedikit titik yang bertahan, makin cepat conf turun
+                conf = t.conf * self.decay * (0.5 + 0.5 * len(moved) / n)
+                if conf < self.min_conf:
+                    return self._need_keyframe("conf")
+                updates[t.id] = ((x1 + dx, y1 + dy, x2 + dx, y2 + dy), conf, new_points.reshape(-1, 1, 2))
+        for t in state.tracks:
+            t.box, t.conf, t.points = updates[t.id]
+        state.gray = gray
+        state.sig = sig
+        state.since_key += 1
+        self.entries.set(client_id, state)
+        with self._lock:
+            self._propagated += 1
+        return [t.detection() for t in state.tracks]
+
+    def update(self, client_id, infer_frame, transform, detections):
+        """Hasil YOLO keyframe -> detections dengan track_id + label stabil (urut conf turun)."""
+        state = self.entries.get(client_id) or _ClientTracks()
+        # pasangkan greedy: pasangan IoU terbesar dulu
+        pairs = sorted(((iou(t.box, (d["x1"], d["y1"], d["x2"], d["y2"])), ti, di)
+                        for ti, t in enumerate(state.tracks) for di, d in enumerate(detections)), reverse=True)
+        used_t, used_d = set(), set()
+        tracks = []
+        for score, ti, di in pairs:
+            if score < self.match_iou:
+                break
+            if ti in used_t or di in used_d:
+                continue
+            used_t.add(ti)
+            used_d.add(di)
+            track = state.tracks[ti]
+            track.observe(detections[di], self.vote_decay)
+            tracks.append(track)
+        for di, det in enumerate(detections):
+            if di not in used_d:
+                track = _Track(state.next_id)
+                state.next_id += 1
+                track.observe(det, self.vote_decay)
+                tracks.append(track)
+        # track yang tidak terdeteksi di keyframe dibuang: keyframe menentukan isi tray
+        gray = self._gray(infer_frame)
+        for track in tracks:
+            track.points = self._features(gray, track.box, transform)
+        tracks.sort(key=lambda t: t.conf, reverse=True)
+        state.tracks = tracks
+        state.gray = gray
+        state.sig = self._signature(gray)
+        state.transform = transform
+        state.since_key = 0
+        state.key_ts = time.monotonic()
+        self.entries.set(client_id, state)
+        with self._lock:
+            self._keyframes += 1
+        return [t.detection() for t in tracks]
+
+    def forget(self, client_id):
+        self.entries.pop(client_id)
+
+    def stats(self):
+        with self._lock:
+            total = self._keyframes + self._propagated
+            return {
+                "enabled_default": self.enabled_default,
+                "interval": self.interval,
+                "min_conf": self.min_conf,
+                "clients": len(self.entries),
+                "keyframes": self._keyframes,
+                "propagated": self._propagated,
+                "propagated_ratio": round(self._propagated / total, 4) if total else 0.0,
+                "keyframe_reasons": dict(self._reasons),
+            }
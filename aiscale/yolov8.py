@@ -1,7 +1,7 @@
-from ultralytics import YOLO
-import psycopg2
-import psycopg2.extras
-from datetime import datetime
+import os
+from backends import load_backend
+from dbpool import ConnectionPool
+from detectionwriter import DetectionWriter
 
 # Koneksi Database PostgreSQL
 DB = {
@@ -12,41 +12,46 @@ DB = {
     "dbname": "ujicobamodelai"    # nama DB hasil migrasi
 }
 
-# Buka koneksi
-db = psycopg2.connect(**DB)
-cursor = db.cursor()
+# Pool koneksi
+db_pool = ConnectionPool(DB, minconn=1, maxconn=2)
 
-# Load YOLO
-model = YOLO("models/best.pt")
+# Load YOLO (INFER_BACKEND=onnx/openvino/torchscript untuk model hasil export, lihat backends.py)
+model = load_backend(os.environ.get("INFER_BACKEND", "pytorch").lower(), conf=0.4, warmup=False).model
+
+# Penulis DB ber-buffer: deteksi dikumpulkan lalu ditulis multi-row tiap
+# FLUSH_ROWS baris / FLUSH_INTERVAL_S detik, jadi loop kamera tidak menunggu commit.
+# DEDUP_IOU > 0 (mis. 0.8) -> objek yang sama di frame berturut-turut hanya ditulis sekali (default mati).
+writer = DetectionWriter(
+    db_pool,
+    flush_rows=int(os.environ.get("FLUSH_ROWS", 100)),
+    flush_interval_s=float(os.environ.get("FLUSH_INTERVAL_S", 1.0)),
+    max_rows=int(os.environ.get("MAX_BUFFER_ROWS", 5000)),
+    dedup_iou=float(os.environ.get("DEDUP_IOU", 0)),
+    dedup_window_s=float(os.environ.get("DEDUP_WINDOW_S", 1.0)),
+)
 
 # Fungsi Simpan ke DB
 def simpan_ke_db(label, confidence, bbox):
-    sql = """INSERT INTO deteksi_objek
-            (nama_objek, confidence, timestamp, bbox_x_min, bbox_y_min, bbox_x_max, bbox_y_max)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)"""
-    data = (
-        label,
-        float(confidence),
-        datetime.now(),
-        int(bbox[0]),
-        int(bbox[1]),
-        int(bbox[2]),
-        int(bbox[3])
-    )
-    cursor.execute(sql, data)
-    db.commit()
-    print(f"✅ Simpan ke DB: {label}, conf={confidence:.2f}")
+    writer.add(label, confidence, bbox)
 
 # Kamera Stream
 results = model(source=1, stream=True, conf=0.4, show=True)
 
-for r in results:
-    boxes = r.boxes
-    if boxes:
-        for box in boxes:
-            conf = box.conf.item()
-            if conf > 0.4:
-                cls_id = int(box.cls.item())
-                label = model.names[cls_id]
-                bbox = box.xyxy[0].tolist()
-                simpan_ke_db(label, conf, bbox)
+try:
+    for r in results:
+        boxes = r.boxes
+        if boxes:
+            for box in boxes:
+                conf = box.conf.item()
+                if conf > 0.4:
+                    cls_id = int(box.cls.item())
+                    label = model.names[cls_id]
+                    bbox = box.xyxy[0].tolist()
+                    simpan_ke_db(label, conf, bbox)
+except KeyboardInterrupt:
+    pass
+finally:
+    # flush sisa buffer sebelum keluar
+    writer.close()
+    print("Statistik penulis deteksi:", writer.stats())
+    db_pool.closeall()